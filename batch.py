@@ -0,0 +1,197 @@
+"""
+Batch (re)processing of shows from the command line.
+
+Renders many shows in parallel, e.g. to re-render a back catalogue after a
+change to the segment timings or bitrates:
+
+    python batch.py /path/to/wavs --output /app/app/processed --jobs 4
+    python batch.py shows.csv --jobs 8 --upload
+
+The source is either a directory of WAV files or a manifest. A manifest is a
+CSV file with a header row (wav,date_str,show_title,guest), or a JSON list of
+objects with the same keys; relative WAV paths are resolved against the
+manifest's directory. In a directory, each WAV may have a <name>.json sidecar
+with date_str/show_title/guest; otherwise the date (MM-DD-YY, the Monday) is
+taken from the filename.
+
+Finished jobs are recorded in a state file, so rerunning the same command
+after a crash or Ctrl-C resumes with the jobs that are left.
+"""
+import os
+import re
+import csv
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+DATE_RE = re.compile(r"(\d{2}-\d{2}-\d{2})")
+
+
+def load_entries(source):
+    """
+    Read the jobs to run from a directory of WAVs or a CSV/JSON manifest.
+
+    :return: list of dicts with wav, date_str, show_title and guest
+    """
+    if os.path.isdir(source):
+        entries = []
+        for name in sorted(os.listdir(source)):
+            if not name.lower().endswith(".wav"):
+                continue
+            wav = os.path.join(source, name)
+            entry = {"wav": wav, "date_str": None, "show_title": "", "guest": ""}
+
+            sidecar = os.path.splitext(wav)[0] + ".json"
+            if os.path.exists(sidecar):
+                with open(sidecar) as f:
+                    entry.update(json.load(f))
+            if not entry["date_str"]:
+                match = DATE_RE.search(name)
+                if not match:
+                    logging.warning(f"Skipping {name}: no date_str in a sidecar or the filename")
+                    continue
+                entry["date_str"] = match.group(1)
+            entries.append(entry)
+        return entries
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        if source.lower().endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    entries = []
+    for row in rows:
+        entries.append({
+            "wav": os.path.join(base, row["wav"]),
+            "date_str": row["date_str"],
+            "show_title": row.get("show_title") or "",
+            "guest": row.get("guest") or "",
+        })
+    return entries
+
+
+def job_key(entry):
+    return f"{os.path.abspath(entry['wav'])}|{entry['date_str']}"
+
+
+class BatchState:
+    """Finished jobs by key, kept in a JSON file that is rewritten atomically after every job."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.jobs = json.load(f)
+        except (OSError, ValueError):
+            self.jobs = {}
+
+    def is_done(self, entry):
+        return self.jobs.get(job_key(entry), {}).get("status") == "done"
+
+    def record(self, entry, result):
+        self.jobs[job_key(entry)] = result
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_entry(entry, output_dir, render_workers, upload, profile=None):
+    """
+    Process one show in a worker process; never raises.
+
+    :return: dict with status, timings (seconds) and outputs or error
+    """
+    # Imported here so every worker process sets up its own caches and pools
+    from processor import split_and_export
+    from profiles import load_profile
+
+    result = {"wav": entry["wav"], "date_str": entry["date_str"], "pid": os.getpid()}
+    start = time.time()
+    try:
+        # Uploads (with --upload) overlap the rendering, so there is one timing for both
+        wav_files, mp3_files, podcast_file = split_and_export(
+            entry["wav"], output_dir, entry["date_str"], entry["show_title"], entry["guest"],
+            workers=render_workers, upload=upload, profile=load_profile(profile),
+        )
+        result["outputs"] = wav_files + mp3_files
+
+        result["status"] = "done"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = round(time.time() - start, 2)
+    return result
+
+
+def print_report(results, elapsed):
+    """Per-job timings, then totals."""
+    print()
+    print(f"{'date':<10} {'status':<7} {'total s':>8}  wav")
+    for r in sorted(results, key=lambda r: r["date_str"]):
+        print(f"{r['date_str']:<10} {r['status']:<7} {r['seconds']:>8}  {os.path.basename(r['wav'])}")
+        if r["status"] == "failed":
+            print(f"{'':<10} ❌ {r['error']}")
+
+    done = [r for r in results if r["status"] == "done"]
+    busy = sum(r["seconds"] for r in results)
+    print()
+    print(f"✅ {len(done)}/{len(results)} jobs succeeded in {elapsed:.1f}s wall clock "
+          f"({busy:.1f}s of job time, {busy / elapsed if elapsed else 0:.1f} jobs running on average)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render (and optionally deliver) many shows in parallel.")
+    parser.add_argument("source", help="directory of WAV files, or a CSV/JSON manifest")
+    parser.add_argument("--output", default="/app/app/processed", help="directory for rendered files")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="shows processed at once")
+    parser.add_argument("--render-workers", type=int, default=1,
+                        help="ffmpeg processes per show (1 = single-pass render)")
+    parser.add_argument("--upload", action="store_true", help="deliver each show to the FTP sites")
+    parser.add_argument("--profile", help="output profile (default: $PROFILE, see profiles.py)")
+    parser.add_argument("--state", help="resume file (default: <output>/batch_state.json)")
+    parser.add_argument("--force", action="store_true", help="rerun jobs already recorded as done")
+    parser.add_argument("--verbose", action="store_true", help="log every processing step")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='[%(levelname)s] %(message)s')
+
+    os.makedirs(args.output, exist_ok=True)
+    state = BatchState(args.state or os.path.join(args.output, "batch_state.json"))
+
+    entries = load_entries(args.source)
+    todo = [e for e in entries if args.force or not state.is_done(e)]
+    if len(todo) < len(entries):
+        print(f"⏭ {len(entries) - len(todo)} jobs already done, resuming with {len(todo)}")
+    if not todo:
+        return 0
+
+    jobs = max(1, min(args.jobs, len(todo)))
+    print(f"⏳ Processing {len(todo)} shows with {jobs} worker processes...")
+
+    results = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_entry, e, args.output, args.render_workers, args.upload, args.profile): e for e in todo}
+        for future in as_completed(futures):
+            entry = futures[future]
+            result = future.result()
+            results.append(result)
+            state.record(entry, result)
+
+            mark = "✅" if result["status"] == "done" else "❌"
+            print(f"{mark} [{len(results)}/{len(todo)}] {entry['date_str']} "
+                  f"{os.path.basename(entry['wav'])} in {result['seconds']}s")
+
+    print_report(results, time.time() - start)
+    return 0 if all(r["status"] == "done" for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
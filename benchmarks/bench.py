@@ -0,0 +1,328 @@
+"""
+Stage benchmarks for the audio pipeline.
+
+Generates synthetic WAVs (60 minutes by default) for each sample rate and
+bit depth, then times every stage of a show on them:
+
+    split        Sirius WAV segments cut from the source
+    encode       H1 + podcast MP3s, single ffmpeg pass
+    tag          ID3 tags on a freshly encoded podcast
+    retag        ID3 tags again (in-place edit)
+    ftp_upload   every output to a local pyftpdlib server
+    sftp_upload  every output to a local paramiko SFTP server
+
+Each stage runs in a fresh process so its peak RSS is its own. Results go
+to a JSON file that later runs can be compared against:
+
+    python -m benchmarks.bench --output results.json
+    python -m benchmarks.bench --rates 48000 --depths 24 --compare results.json
+
+Run from the repository root. Needs ffmpeg on PATH and, for ftp_upload,
+pyftpdlib (see benchmarks/requirements.txt).
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import random
+import struct
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import multiprocessing
+
+from benchmarks.servers import start_ftp_server, start_sftp_server
+
+
+STAGES = ["split", "encode", "tag", "retag", "ftp_upload", "sftp_upload"]
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+BENCH_DATE = "10-20-25"
+
+
+# ---------- Synthetic sources ----------
+def _sample_packer(bit_depth):
+    """Return (format_tag, sample_width, pack(value in [-1, 1]) -> bytes)."""
+    if bit_depth == 16:
+        return 1, 2, lambda v: struct.pack("<h", int(v * 32767))
+    if bit_depth == 24:
+        return 1, 3, lambda v: struct.pack("<i", int(v * 8388607))[:3]
+    if bit_depth == 32:
+        return 3, 4, lambda v: struct.pack("<f", v)
+    raise ValueError(f"Unsupported bit depth: {bit_depth}")
+
+
+def generate_wav(path, minutes, sample_rate, bit_depth, channels=2, seed=1):
+    """
+    Write a synthetic programme: a few distinct seconds of tones plus noise,
+    cycled for `minutes`. Realistic enough for the encoder, cheap to build.
+    """
+    from wavfile import build_header
+
+    format_tag, sample_width, pack = _sample_packer(bit_depth)
+    rng = random.Random(seed)
+
+    seconds = []
+    for n in range(7):
+        freq = 110 * (n + 2)
+        frames = bytearray()
+        for i in range(sample_rate):
+            t = i / sample_rate
+            v = 0.4 * math.sin(2 * math.pi * freq * t) * (0.6 + 0.4 * math.sin(2 * math.pi * 0.5 * t))
+            v += rng.uniform(-0.05, 0.05)
+            frames += pack(v) * channels
+        seconds.append(bytes(frames))
+
+    total_seconds = int(minutes * 60)
+    fmt = {
+        "format_tag": format_tag,
+        "channels": channels,
+        "sample_rate": sample_rate,
+        "sample_width": sample_width,
+        "block_align": channels * sample_width,
+    }
+    with open(path, "wb") as f:
+        f.write(build_header(fmt, total_seconds * sample_rate * fmt["block_align"]))
+        for s in range(total_seconds):
+            f.write(seconds[s % len(seconds)])
+
+
+# ---------- Stages (each runs in its own process) ----------
+def _import_processor():
+    try:
+        import processor
+    except ModuleNotFoundError as e:
+        if e.name not in ("config", "config.settings"):
+            raise
+        # Outside the app container there is no config/settings.py; the
+        # benchmarks pass their own hosts, so no sites need to be defined.
+        import types
+        config = types.ModuleType("config")
+        config.settings = types.ModuleType("config.settings")
+        config.settings.FTP_LOCATIONS = {}
+        sys.modules["config"] = config
+        sys.modules["config.settings"] = config.settings
+        import processor
+    return processor
+
+
+def _outputs(processor, case):
+    from wavfile import WavReader
+
+    with WavReader(case["wav"]) as source:
+        plan = processor.build_output_plan(case["out_dir"], BENCH_DATE, source.sample_rate)
+    return [out for out in plan if out["codec"] is None], [out for out in plan if out["codec"]]
+
+
+def stage_split(processor, case):
+    from wavfile import WavReader
+
+    pcm, _ = _outputs(processor, case)
+    written = 0
+    with WavReader(case["wav"]) as source:
+        for out in pcm:
+            written += source.write(out["path"], [source.view(s, e) for s, e in out["intervals"]])
+    return {"bytes": written}
+
+
+def stage_encode(processor, case):
+    _, encoded = _outputs(processor, case)
+    processor.render_outputs(case["wav"], encoded)
+    return {"bytes": sum(os.path.getsize(out["path"]) for out in encoded)}
+
+
+def _podcast(processor, case):
+    _, encoded = _outputs(processor, case)
+    return next(out["path"] for out in encoded if out["kind"] == "podcast")
+
+
+def stage_tag(processor, case):
+    podcast = _podcast(processor, case)
+    if not processor.apply_id3_tags(podcast, BENCH_DATE, "Benchmark", "Guest"):
+        raise RuntimeError("apply_id3_tags failed")
+    return {"bytes": os.path.getsize(podcast)}
+
+
+def stage_retag(processor, case):
+    podcast = _podcast(processor, case)
+    if not processor.apply_id3_tags(podcast, BENCH_DATE, "Benchmark, corrected title", "Another Guest"):
+        raise RuntimeError("apply_id3_tags failed")
+    return {"bytes": os.path.getsize(podcast)}
+
+
+def _upload(processor, case, upload, host):
+    pcm, encoded = _outputs(processor, case)
+    files = [out["path"] for out in pcm + encoded]
+    missing = [f for f in files if not os.path.exists(f)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} outputs missing; run the split and encode stages first")
+    upload(files, host, BENCH_USER, BENCH_PASSWORD, case["remote_dir"], progress=lambda msg: None)
+    return {"bytes": sum(os.path.getsize(f) for f in files)}
+
+
+def stage_ftp_upload(processor, case):
+    return _upload(processor, case, processor.ftp_upload, f"127.0.0.1:{case['ftp_port']}")
+
+
+def stage_sftp_upload(processor, case):
+    return _upload(processor, case, processor.sftp_upload, f"127.0.0.1:{case['sftp_port']}")
+
+
+def _run_stage(stage, case):
+    """Child process entry point: run one stage and measure it."""
+    processor = _import_processor()
+    start = time.perf_counter()
+    result = globals()[f"stage_{stage}"](processor, case)
+    seconds = time.perf_counter() - start
+
+    result["seconds"] = round(seconds, 3)
+    result["mb_per_s"] = round(result["bytes"] / seconds / 1e6, 2) if seconds else None
+    # ru_maxrss is in KiB on Linux (bytes on macOS)
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_child_rss_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return result
+
+
+def measure(stage, case):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_run_stage, (stage, case))
+
+
+# ---------- Reporting ----------
+def environment():
+    def run(cmd):
+        try:
+            out = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+            return out.stdout.strip().splitlines()[0] if out.returncode == 0 and out.stdout else None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    return {
+        "commit": run(["git", "rev-parse", "--short", "HEAD"]),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": run(["ffmpeg", "-version"]),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def case_name(case):
+    return f"{case['sample_rate']}Hz/{case['bit_depth']}bit/{case['channels']}ch/{case['minutes']}min"
+
+
+def compare(baseline_path, results):
+    """Print each stage's time against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(c["name"], stage): m for c in baseline["cases"] for stage, m in c["stages"].items()}
+
+    print(f"\nCompared with {baseline_path} ({baseline['environment'].get('commit')}):")
+    print(f"{'case':<28} {'stage':<12} {'before s':>9} {'after s':>9} {'change':>8}")
+    for c in results["cases"]:
+        for stage, m in c["stages"].items():
+            old = before.get((c["name"], stage))
+            if not old or "seconds" not in old or "seconds" not in m:
+                continue
+            change = (m["seconds"] - old["seconds"]) / old["seconds"] * 100 if old["seconds"] else 0
+            print(f"{c['name']:<28} {stage:<12} {old['seconds']:>9.2f} {m['seconds']:>9.2f} {change:>+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each stage of the audio pipeline on synthetic input.")
+    parser.add_argument("--rates", default="44100,48000", help="comma-separated sample rates")
+    parser.add_argument("--depths", default="16,24", help="comma-separated bit depths (16, 24, 32 = float)")
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated subset of " + ",".join(STAGES))
+    parser.add_argument("--workdir", help="keeps generated WAVs between runs (default: a temp dir)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    requested = set(s for s in args.stages.split(",") if s)
+    unknown = requested - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    # Always in pipeline order: later stages work on earlier stages' outputs
+    stages = [s for s in STAGES if s in requested]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pipeline-bench-")
+    state_dir = os.path.join(workdir, "state")
+    server_root = os.path.join(workdir, "remote")
+    os.makedirs(server_root, exist_ok=True)
+
+    # Stage processes inherit these: measure real work, not caches or old state
+    os.environ["STATE_DIR"] = state_dir
+    os.environ["RENDER_CACHE_MAX_BYTES"] = "0"
+
+    servers = {}
+    if "ftp_upload" in stages:
+        ftp_server, servers["ftp_port"] = start_ftp_server(server_root, BENCH_USER, BENCH_PASSWORD)
+    if "sftp_upload" in stages:
+        sftp_sock, servers["sftp_port"] = start_sftp_server(server_root, BENCH_USER, BENCH_PASSWORD)
+
+    results = {"environment": environment(), "cases": []}
+    for rate in [int(r) for r in args.rates.split(",")]:
+        for depth in [int(d) for d in args.depths.split(",")]:
+            name = f"{rate}_{depth}_{args.channels}_{args.minutes:g}"
+            case = {
+                "sample_rate": rate,
+                "bit_depth": depth,
+                "channels": args.channels,
+                "minutes": args.minutes,
+                "wav": os.path.join(workdir, f"source_{name}.wav"),
+                "out_dir": os.path.join(workdir, f"out_{name}"),
+                "remote_dir": f"/{name}",
+                **servers,
+            }
+            case["name"] = case_name(case)
+            os.makedirs(case["out_dir"], exist_ok=True)
+            os.makedirs(os.path.join(server_root, name), exist_ok=True)
+
+            if not os.path.exists(case["wav"]):
+                print(f"⏳ Generating {case['name']} source...")
+                generate_wav(case["wav"], args.minutes, rate, depth, args.channels)
+
+            entry = {"name": case["name"], "wav_bytes": os.path.getsize(case["wav"]), "stages": {}}
+            for stage in stages:
+                try:
+                    entry["stages"][stage] = measure(stage, case)
+                except Exception as e:
+                    entry["stages"][stage] = {"error": str(e)}
+                m = entry["stages"][stage]
+                if "error" in m:
+                    print(f"❌ {case['name']:<28} {stage:<12} {m['error']}")
+                else:
+                    print(f"✅ {case['name']:<28} {stage:<12} {m['seconds']:>8.2f}s {m['mb_per_s'] or 0:>8.1f} MB/s "
+                          f"rss {m['peak_rss_kb'] / 1024:>6.1f} MiB (children {m['peak_child_rss_kb'] / 1024:.1f})")
+            results["cases"].append(entry)
+
+            # Keep the disk footprint to one case's outputs at a time
+            shutil.rmtree(case["out_dir"], ignore_errors=True)
+            shutil.rmtree(os.path.join(server_root, name), ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📄 Results written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+    if "ftp_upload" in stages:
+        ftp_server.close_all()
+    if "sftp_upload" in stages:
+        sftp_sock.close()
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,193 @@
+"""
+Local stand-in FTP and SFTP servers for the upload benchmarks.
+
+Both serve a directory on 127.0.0.1 from a daemon thread of the calling
+process and accept a single user/password. pyftpdlib is needed for FTP;
+paramiko (already an app dependency) provides the SFTP side.
+"""
+import os
+import socket
+import logging
+import threading
+import subprocess
+
+import paramiko
+from paramiko import SFTPServer, SFTPServerInterface, SFTPAttributes, SFTPHandle, SFTP_OK
+
+
+def start_ftp_server(root, user, password, handler_base=None):
+    """
+    Serve `root` over plain FTP on a free port.
+
+    :param handler_base: FTPHandler subclass to serve with (e.g. one adding
+                         hash commands), default FTPHandler
+    :return: (server, port); call server.close_all() to stop it
+    """
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import FTPServer
+    except ImportError:
+        raise RuntimeError("pyftpdlib is required for the FTP benchmark (pip install pyftpdlib)")
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(user, password, root, perm="elradfmwMT")
+
+    handler = type("BenchFTPHandler", (handler_base or FTPHandler,), {})
+    handler.authorizer = authorizer
+    handler.banner = "benchmark ftpd"
+
+    # pyftpdlib logs every command at INFO, and installs its own stderr
+    # handler unless one is configured; keep the benchmark output readable
+    ftpd_log = logging.getLogger("pyftpdlib")
+    ftpd_log.setLevel(logging.WARNING)
+    if not ftpd_log.handlers:
+        ftpd_log.addHandler(logging.NullHandler())
+
+    server = FTPServer(("127.0.0.1", 0), handler)
+    port = server.socket.getsockname()[1]
+    threading.Thread(target=server.serve_forever, kwargs={"handle_exit": False},
+                     name="bench-ftpd", daemon=True).start()
+    return server, port
+
+
+class _SFTPHandle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class _SFTPRoot(SFTPServerInterface):
+    """Maps SFTP paths onto a local directory; just enough for the uploader."""
+
+    root = None
+
+    def _local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def canonicalize(self, path):
+        return os.path.normpath("/" + path).replace("//", "/")
+
+    def list_folder(self, path):
+        local = self._local(path)
+        try:
+            entries = []
+            for name in os.listdir(local):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags, 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+
+        handle = _SFTPHandle(flags)
+        handle.filename = local
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+
+def start_sftp_server(root, user, password, allow_exec=False):
+    """
+    Serve `root` over SFTP on a free port with a throwaway host key.
+
+    :param allow_exec: also run exec requests (sha256sum, cp, ...) with the
+                       local shell; paths are only the same as the SFTP ones
+                       when `root` is "/"
+    :return: (socket, port); close the socket to stop accepting connections
+    """
+    host_key = paramiko.RSAKey.generate(2048)
+    sftp_root = type("BenchSFTPRoot", (_SFTPRoot,), {"root": root})
+
+    class Server(paramiko.ServerInterface):
+        def check_auth_password(self, username, pw):
+            if username == user and pw == password:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+        def check_channel_exec_request(self, channel, command):
+            if not allow_exec:
+                return False
+
+            def run():
+                result = subprocess.run(command.decode(), shell=True, capture_output=True)
+                channel.sendall(result.stdout)
+                channel.send_exit_status(result.returncode)
+                channel.close()
+
+            threading.Thread(target=run, daemon=True).start()
+            return True
+
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+
+    def serve():
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, sftp_root)
+            transport.start_server(server=Server())
+
+    threading.Thread(target=serve, name="bench-sftpd", daemon=True).start()
+    return sock, sock.getsockname()[1]
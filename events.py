@@ -0,0 +1,148 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+# Last event of every job's stream; subscribers stop after it
+END_OF_STREAM = "[DONE]"
+
+
+class _JobLog:
+    """In-memory copy of one job's events; seq N is events[N - 1]."""
+
+    def __init__(self, events, closed_at=None):
+        self.events = events   # [(seq, event, data), ...]
+        self.closed_at = closed_at
+        self.cond = threading.Condition()
+
+
+class EventBroker:
+    """
+    Append-only progress log per job, fanned out to any number of subscribers.
+
+    Events are numbered per job and persisted to SQLite, so a client that
+    reconnects with Last-Event-ID (even after a restart) gets exactly what it
+    missed. Events may carry a type (SSE "event:" field, e.g. "span" for
+    metrics); untyped ones are plain progress messages. Subscribers block
+    on a condition instead of polling, and one publish wakes all of them.
+    Logs of jobs that ended more than `ttl` seconds ago are removed.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, keepalive=15):
+        self.path = path
+        self.ttl = ttl
+        self.keepalive = keepalive
+        self._logs = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    ts REAL NOT NULL,
+                    data TEXT NOT NULL,
+                    event TEXT,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+            # Logs written before events had a type
+            if "event" not in [row[1] for row in db.execute("PRAGMA table_info(events)")]:
+                db.execute("ALTER TABLE events ADD COLUMN event TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def publish(self, job_id, data, event=None):
+        """Append an event (optionally typed) to a job's log and wake its subscribers; returns the event id."""
+        log = self._log(job_id)
+        with log.cond:
+            seq = len(log.events) + 1
+            now = time.time()
+            with self._connect() as db:
+                db.execute("INSERT INTO events (job_id, seq, ts, data, event) VALUES (?, ?, ?, ?, ?)",
+                           (job_id, seq, now, data, event))
+            log.events.append((seq, event, data))
+            if data == END_OF_STREAM:
+                log.closed_at = now
+            log.cond.notify_all()
+        return seq
+
+    def has_events(self, job_id):
+        with self._lock:
+            log = self._logs.get(job_id)
+        if log is not None:
+            return bool(log.events)
+        with self._connect() as db:
+            return db.execute("SELECT 1 FROM events WHERE job_id = ? LIMIT 1", (job_id,)).fetchone() is not None
+
+    def subscribe(self, job_id, after=0, finished=False):
+        """
+        Yield (seq, event, data) for every event after id `after`, waiting for new ones
+        until END_OF_STREAM. Yields None every `keepalive` seconds without news,
+        so the caller can write a heartbeat and notice a closed connection.
+
+        :param finished: the job is no longer running, so nothing will be
+                         published to it again: replay what is stored and stop
+        """
+        log = self._log(job_id, finished)
+        while True:
+            with log.cond:
+                if len(log.events) <= after and log.closed_at is None:
+                    log.cond.wait(self.keepalive)
+                pending = log.events[after:]
+                closed = log.closed_at is not None
+
+            if not pending:
+                if closed:
+                    return
+                yield None
+                continue
+
+            for event in pending:
+                yield event
+            after = pending[-1][0]
+
+    # ---------- internals ----------
+    def _log(self, job_id, finished=False):
+        with self._lock:
+            log = self._logs.get(job_id)
+            if log is None:
+                log = self._load(job_id)
+                if finished:
+                    # Nothing will be published to it, so it isn't cached: the
+                    # reaper only drops closed logs, and one rebuilt for a job
+                    # that ended without END_OF_STREAM would be kept forever
+                    if log.closed_at is None:
+                        log.closed_at = time.time()
+                    return log
+                self._logs[job_id] = log
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="event-log-reaper", daemon=True)
+                self._reaper.start()
+        return log
+
+    def _load(self, job_id):
+        with self._connect() as db:
+            rows = db.execute("SELECT seq, event, data, ts FROM events WHERE job_id = ? ORDER BY seq",
+                              (job_id,)).fetchall()
+        closed_at = rows[-1][3] if rows and rows[-1][2] == END_OF_STREAM else None
+        return _JobLog([(seq, event, data) for seq, event, data, _ in rows], closed_at)
+
+    def _reap(self):
+        while True:
+            time.sleep(min(300, self.ttl))
+            cutoff = time.time() - self.ttl
+            with self._lock:
+                for job_id in [j for j, log in self._logs.items() if log.closed_at and log.closed_at < cutoff]:
+                    del self._logs[job_id]
+            with self._connect() as db:
+                db.execute("""
+                    DELETE FROM events WHERE job_id IN (
+                        SELECT job_id FROM events WHERE data = ? AND ts < ?
+                    )
+                """, (END_OF_STREAM, cutoff))
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import logging
+import threading
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised by JobScheduler.submit when no more jobs can be admitted."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobStore:
+    """
+    Jobs persisted in a local SQLite database.
+
+    Each row keeps the job's parameters (JSON), its status and timestamps,
+    so queued and interrupted jobs survive a restart. Every call opens its
+    own short-lived connection, which keeps the store safe to use from the
+    worker threads and the Flask request threads at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, job_id, params):
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, status, params, created) VALUES (?, ?, ?, ?)",
+                       (job_id, QUEUED, json.dumps(params), time.time()))
+
+    def get(self, job_id):
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def mark_running(self, job_id):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, started = ?, attempts = attempts + 1 WHERE id = ?",
+                       (RUNNING, time.time(), job_id))
+
+    def mark_finished(self, job_id, error=None):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                       (FAILED if error else DONE, time.time(), error, job_id))
+
+    def unfinished(self):
+        """Ids of queued and running jobs, oldest first."""
+        with self._connect() as db:
+            rows = db.execute("SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created",
+                              (QUEUED, RUNNING)).fetchall()
+        return [row[0] for row in rows]
+
+    def average_duration(self, recent=20):
+        """Mean run time of the last `recent` successful jobs, or None if there are none."""
+        with self._connect() as db:
+            row = db.execute("""
+                SELECT AVG(finished - started) FROM (
+                    SELECT started, finished FROM jobs
+                    WHERE status = ? AND started IS NOT NULL
+                    ORDER BY finished DESC LIMIT ?
+                )
+            """, (DONE, recent)).fetchone()
+        return row[0]
+
+
+class JobScheduler:
+    """
+    Runs jobs from a JobStore on a fixed pool of worker threads.
+
+    At most `workers` jobs run at once and at most `max_pending` are admitted
+    (queued or running); submit() raises JobQueueFull past that, with a
+    Retry-After estimate, instead of letting a burst oversubscribe the CPU.
+    start() re-queues whatever was queued or running when the process stopped.
+
+    :param handler: callable(job_id, params); an exception marks the job failed
+    """
+
+    def __init__(self, store, handler, workers=2, max_pending=8):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for job_id in self.store.unfinished():
+            logging.info(f"Resuming job {job_id}")
+            with self._lock:
+                self._pending.add(job_id)
+            self._queue.put(job_id)
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, params):
+        """Persist and queue a new job; returns its id."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise JobQueueFull(self.retry_after())
+            job_id = str(uuid.uuid4())
+            self._pending.add(job_id)
+
+        try:
+            self.store.create(job_id, params)
+        except Exception:
+            with self._lock:
+                self._pending.discard(job_id)
+            raise
+        self._queue.put(job_id)
+        return job_id
+
+    @property
+    def pending(self):
+        """Jobs admitted and not finished yet (queued or running)."""
+        with self._lock:
+            return len(self._pending)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, from recent job durations."""
+        average = self.store.average_duration() or 60
+        waves = max(1, len(self._pending) - self.workers + 1) / self.workers
+        return max(5, int(average * waves))
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            job = self.store.get(job_id)
+            if job is None:
+                with self._lock:
+                    self._pending.discard(job_id)
+                continue
+
+            self.store.mark_running(job_id)
+            error = None
+            try:
+                self.handler(job_id, job["params"])
+            except Exception as e:
+                logging.exception(f"Job {job_id} failed")
+                error = str(e) or e.__class__.__name__
+            finally:
+                self.store.mark_finished(job_id, error)
+                with self._lock:
+                    self._pending.discard(job_id)
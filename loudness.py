@@ -0,0 +1,253 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from wavfile import WavReader
+from silence import pcm_samples
+
+
+# BS.1770 gating: 400 ms blocks with 75% overlap, built from 100 ms sub-blocks
+SUB_BLOCK_MS = 100
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+# Sub-blocks scanned (and cached) per step; keeps memory constant however long the cut is
+BLOCK_SUB_BLOCKS = 50
+
+# Length of the K-weighting impulse response kept; what is left of the
+# filter's tail after that is below 1e-11 at any sample rate
+K_WEIGHTING_MS = 100
+# FFT length of the overlap-save convolution; small enough to stay in the CPU cache
+K_WEIGHTING_FFT = 16384
+
+# True peak: 4x oversampling (windowed sinc, PEAK_TAPS samples either side,
+# as in BS.1770) around the samples within PEAK_MARGIN_DB of the loudest
+# peak found so far; sub-blocks and gathered samples are taken in batches
+OVERSAMPLE = 4
+PEAK_TAPS = 6
+PEAK_MARGIN_DB = 3.0
+PEAK_BATCH = 16
+PEAK_GATHER = 64 * 1024
+
+
+def _k_weighting_biquads(sample_rate):
+    """
+    (b, a) of the BS.1770 K-weighting stages at `sample_rate`, a[0] normalised
+    to 1. Analogue prototypes through the bilinear transform (De Man's
+    parameters), which give BS.1770's published 48 kHz coefficients exactly.
+    """
+    # High shelf, +4 dB above ~1.7 kHz (head effects)
+    gain, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    K = np.tan(np.pi * fc / sample_rate)
+    Vh = 10 ** (gain / 20)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1 + K / q + K * K
+    shelf = (
+        ((Vh + Vb * K / q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / q + K * K) / a0),
+        (1.0, 2 * (K * K - 1) / a0, (1 - K / q + K * K) / a0))
+
+    # High-pass at ~38 Hz (RLB weighting)
+    q, fc = 0.5003270373238773, 38.13547087602444
+    K = np.tan(np.pi * fc / sample_rate)
+    a0 = 1 + K / q + K * K
+    highpass = (
+        (1.0, -2.0, 1.0),
+        (1.0, 2 * (K * K - 1) / a0, (1 - K / q + K * K) / a0))
+
+    return [(list(b), list(a)) for b, a in (shelf, highpass)]
+
+
+@lru_cache(maxsize=None)
+def k_weighting(sample_rate):
+    """
+    Impulse response of the BS.1770 K-weighting filter (the high shelf and
+    high-pass biquads in cascade), run sample by sample for K_WEIGHTING_MS.
+    """
+    signal = [0.0] * (sample_rate * K_WEIGHTING_MS // 1000)
+    signal[0] = 1.0
+    for (b0, b1, b2), (_, a1, a2) in _k_weighting_biquads(sample_rate):
+        x1 = x2 = y1 = y2 = 0.0
+        for n, x in enumerate(signal):
+            y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            x1, x2, y1, y2 = x, x1, y, y1
+            signal[n] = y
+    return np.array(signal)
+
+
+@lru_cache(maxsize=None)
+def _k_weighting_spectrum(sample_rate, size):
+    return np.fft.rfft(k_weighting(sample_rate), size)
+
+
+def _k_weight(samples, sample_rate):
+    """
+    K-weighted `samples` (channels, n), by overlap-save convolution with the
+    filter's impulse response, batched over FFT blocks. The first
+    len(taps) - 1 outputs lack history and are dropped.
+    """
+    taps = len(k_weighting(sample_rate))
+    size = max(K_WEIGHTING_FFT, 1 << (4 * taps).bit_length())
+    hop = size - taps + 1
+    count = samples.shape[1] - taps + 1
+    blocks = -(-count // hop)
+    padded = np.zeros((samples.shape[0], (blocks - 1) * hop + size), dtype=samples.dtype)
+    padded[:, :samples.shape[1]] = samples
+    windows = np.lib.stride_tricks.sliding_window_view(padded, size, axis=1)[:, ::hop]
+    weighted = np.fft.irfft(np.fft.rfft(windows) * _k_weighting_spectrum(sample_rate, size), size)
+    return weighted[:, :, taps - 1:].reshape(samples.shape[0], -1)[:, :count]
+
+
+def _interpolation_kernel():
+    """Windowed-sinc weights, (2 * PEAK_TAPS, OVERSAMPLE - 1), for the points between sample n and n + 1."""
+    offsets = np.arange(-PEAK_TAPS + 1, PEAK_TAPS + 1)[:, None] - np.arange(1, OVERSAMPLE)[None, :] / OVERSAMPLE
+    return (np.sinc(offsets) * np.cos(np.pi * offsets / (2 * PEAK_TAPS)) ** 2).astype(np.float32)
+
+
+def _true_peak(reader, starts, peaks):
+    """
+    Largest 4x-oversampled peak over the sub-blocks at `starts`.
+
+    Only samples within PEAK_MARGIN_DB of the peak found so far can sit next
+    to a higher inter-sample peak, so just the gaps around those are
+    interpolated, loudest sub-blocks first.
+    """
+    frames = reader.sample_rate * SUB_BLOCK_MS // 1000
+    channels = reader.format["channels"]
+    margin = 10 ** (PEAK_MARGIN_DB / 20)
+    kernel = _interpolation_kernel()
+    taps = np.arange(-PEAK_TAPS + 1, PEAK_TAPS + 1)
+
+    order = np.argsort(peaks)[::-1]
+    true_peak = float(peaks[order[0]])
+    for i in range(0, len(order), PEAK_BATCH):
+        batch = order[i:i + PEAK_BATCH]
+        batch = batch[peaks[batch] * margin > true_peak]
+        if not len(batch):
+            break
+
+        # Each sub-block with PEAK_TAPS neighbours on both sides (zeros past the file)
+        length = frames + 2 * PEAK_TAPS
+        segments = np.zeros((len(batch), length, channels), dtype=np.float32)
+        for row, index in enumerate(batch):
+            first = max(0, starts[index] - PEAK_TAPS)
+            view = reader.view(first, starts[index] + frames + PEAK_TAPS)
+            try:
+                samples, full_scale = pcm_samples(view, reader.format)
+            finally:
+                view.release()
+            samples = (samples / full_scale).reshape(-1, channels)
+            offset = PEAK_TAPS - (starts[index] - first)
+            segments[row, offset:offset + len(samples)] = samples
+
+        # Inter-sample peaks rise next to local maxima of |x|: interpolate the
+        # gaps on either side of every loud one
+        level = np.abs(segments)
+        body = level[:, PEAK_TAPS:PEAK_TAPS + frames]
+        loud = ((body >= level[:, PEAK_TAPS - 1:PEAK_TAPS + frames - 1])
+                & (body >= level[:, PEAK_TAPS + 1:PEAK_TAPS + frames + 1])
+                & (body * margin > true_peak))
+        rows, positions, chans = np.nonzero(loud)
+        positions = np.concatenate((positions, positions - 1)) + PEAK_TAPS
+        rows, chans = np.tile(rows, 2), np.tile(chans, 2)
+        for at in range(0, len(positions), PEAK_GATHER):
+            part = slice(at, at + PEAK_GATHER)
+            windows = segments[rows[part, None], positions[part, None] + taps[None, :], chans[part, None]]
+            true_peak = max(true_peak, float(np.abs(windows @ kernel).max()))
+    return true_peak
+
+
+class LoudnessMeter:
+    """
+    Integrated loudness (BS.1770 / EBU R128) and true peak of cuts from one
+    WAV source, read straight from the memory-mapped PCM.
+
+    K-weighting is the BS.1770 biquad cascade in the time domain: its
+    impulse response is convolved (by FFT) over each chunk of sub-blocks,
+    starting K_WEIGHTING_MS early so the filter has settled, which matches
+    running the biquads over the whole source. Sub-blocks lie on a fixed
+    grid from the start of the source and
+    their energies are kept, so outputs sharing source audio (H1 and the
+    podcast) only pay for it once; a cut is measured on the sub-blocks it
+    fully contains. All channels are weighted 1.0 (mono and stereo sources).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._chunks = {}   # chunk index -> (energy, sample peak) arrays of BLOCK_SUB_BLOCKS sub-blocks
+        self._lock = threading.Lock()
+
+    def measure(self, intervals):
+        """
+        :param intervals: list of (start_frame, end_frame) cuts, played back to back
+        :return: (integrated LUFS, true peak dBTP); -inf for digital silence
+        """
+        with WavReader(self.path) as reader:
+            frames = reader.sample_rate * SUB_BLOCK_MS // 1000
+            indexes = []
+            for start, end in intervals:
+                first = -(-start // frames)
+                indexes.append(np.arange(first, max(first, min(end, reader.frames) // frames)))
+            indexes = np.concatenate(indexes) if indexes else np.zeros(0, dtype=int)
+            if not len(indexes):
+                return float("-inf"), float("-inf")
+
+            partial = {}
+            with self._lock:
+                for chunk in np.unique(indexes // BLOCK_SUB_BLOCKS).tolist():
+                    if chunk in self._chunks:
+                        continue
+                    stats = self._scan(reader, chunk, frames)
+                    if len(stats[0]) < BLOCK_SUB_BLOCKS:
+                        # Source still arriving (or its end): keep the partial scan out of the cache
+                        partial[chunk] = stats
+                    else:
+                        self._chunks[chunk] = stats
+            return self._measure(reader, indexes, frames, partial)
+
+    def _scan(self, reader, chunk, frames):
+        """Energy (K-weighted mean square, summed over channels) and sample peak per sub-block of a chunk."""
+        pos = chunk * BLOCK_SUB_BLOCKS * frames
+        count = max(0, min(BLOCK_SUB_BLOCKS, (reader.frames - pos) // frames))
+        if not count:
+            return np.zeros(0), np.zeros(0)
+
+        # Audio before the chunk that the filter is still ringing from
+        # (zeros before the start of the source, like a filter starting at rest)
+        history = len(k_weighting(reader.sample_rate)) - 1
+        first = max(0, pos - history)
+        view = reader.view(first, pos + count * frames)
+        try:
+            samples, full_scale = pcm_samples(view, reader.format)
+        finally:
+            view.release()
+        channels = reader.format["channels"]
+        # Frames last and contiguous: the FFT runs along that axis
+        samples = samples.reshape(-1, channels).T * np.float32(1 / full_scale)
+        samples = np.concatenate((np.zeros((channels, history - (pos - first)), dtype=samples.dtype), samples),
+                                 axis=1)
+
+        weighted = _k_weight(samples, reader.sample_rate).reshape(channels, count, frames)
+        energy = np.einsum("csf,csf->s", weighted, weighted) / frames
+        peaks = np.abs(samples[:, history:]).reshape(channels, count, frames).max(axis=(0, 2))
+        return energy, peaks
+
+    def _measure(self, reader, indexes, frames, partial):
+        chunks = {**self._chunks, **partial}
+        energy = np.array([chunks[i // BLOCK_SUB_BLOCKS][0][i % BLOCK_SUB_BLOCKS] for i in indexes.tolist()])
+        peaks = np.array([chunks[i // BLOCK_SUB_BLOCKS][1][i % BLOCK_SUB_BLOCKS] for i in indexes.tolist()])
+
+        # Mean square of every 400 ms block, stepping by one sub-block
+        blocks = np.convolve(energy, np.full(4, 0.25), mode="valid") if len(energy) >= 4 else np.zeros(0)
+        loudness = -0.691 + 10 * np.log10(np.maximum(blocks, 1e-20))
+
+        gated = blocks[loudness > ABSOLUTE_GATE_LUFS]
+        if not len(gated):
+            integrated = float("-inf")
+        else:
+            relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE_LU
+            gated = blocks[(loudness > ABSOLUTE_GATE_LUFS) & (loudness > relative_gate)]
+            integrated = float(-0.691 + 10 * np.log10(gated.mean()))
+
+        true_peak = _true_peak(reader, indexes * frames, peaks)
+        return integrated, (20 * np.log10(true_peak) if true_peak > 0 else float("-inf"))
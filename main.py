@@ -1,13 +1,18 @@
 import os
+import re
+import json
 import logging
-import threading
+from datetime import datetime
 from flask import Flask, render_template, request, jsonify, Response
-from processor import split_and_export
-from queue import Queue, Empty
-import uuid
+from processor import split_and_export, STATE_DIR
 from ftplib import FTP
 from config.settings import FTP_LOCATIONS  # your settings.py with FTP_PASS etc.
 from processor import upload_files_to_ftp
+from uploads import UploadStore, UploadOffsetError
+from jobs import JobStore, JobScheduler, JobQueueFull, DONE, FAILED
+from events import EventBroker, END_OF_STREAM
+from metrics import METRICS, recorder
+from wavfile import WavFormatError
 
 UPLOAD_FOLDER = "/app/app/uploads"
 PROCESSED_FOLDER = "/app/app/processed"
@@ -21,8 +26,15 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
-# Dictionary to store per-job progress queues
-jobs = {}
+# Progress events older than this (after their job ends) are no longer replayable
+EVENT_TTL = int(os.environ.get("EVENT_TTL", str(24 * 3600)))
+
+# Jobs run on a fixed pool of workers; anything past MAX_PENDING_JOBS is turned away with a 503
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", "8"))
+
+# Resumable chunked uploads in progress
+upload_store = UploadStore(UPLOAD_FOLDER)
 
 
 @app.route("/")
@@ -41,6 +53,9 @@ def upload_audio():
     if not wav_file:
         logging.warning("No WAV file uploaded!")
         return jsonify(success=False, message="No WAV file uploaded!"), 400
+    error = date_str_error(date_str)
+    if error:
+        return jsonify(success=False, message=error), 400
 
     # Save uploaded files
     wav_path = os.path.join(app.config['UPLOAD_FOLDER'], wav_file.filename)
@@ -50,17 +65,202 @@ def upload_audio():
         artwork_path = os.path.join(app.config['UPLOAD_FOLDER'], artwork_file.filename)
         artwork_file.save(artwork_path)
 
-    # Create a unique job ID and queue
-    job_id = str(uuid.uuid4())
-    job_queue = Queue()
-    jobs[job_id] = job_queue
+    try:
+        job_id = start_job(date_str, wav_path, artwork_path, show_title, guest)
+    except JobQueueFull as e:
+        return busy_response(e)
+
+    return jsonify(success=True, message="Upload successful. Processing started.", job_id=job_id)
+
+
+def date_str_error(date_str):
+    """Why a show date can't be processed (it must be the Monday as MM-DD-YY), or None if it can."""
+    if not date_str:
+        return "date_str is required"
+    try:
+        datetime.strptime(date_str, "%m-%d-%y")
+    except ValueError:
+        return f"Invalid date_str {date_str!r}, expected MM-DD-YY"
+    return None
+
+
+def start_job(date_str, wav_path, artwork_path, show_title, guest, upload_id=None):
+    """
+    Queue a job for processing by the worker pool.
 
-    # Start processing in a separate thread
-    thread = threading.Thread(
-        target=process_audio,
-        args=(date_str, wav_path, artwork_path, show_title, guest, job_queue)
-    )
-    thread.start()
+    :param upload_id: set when wav_path is a chunked upload that may still be arriving
+    :raises JobQueueFull: if the scheduler is at capacity
+    """
+    return scheduler.submit({
+        "date_str": date_str,
+        "wav_path": wav_path,
+        "artwork_path": artwork_path,
+        "show_title": show_title,
+        "guest": guest,
+        "upload_id": upload_id,
+    })
+
+
+def run_job(job_id, params):
+    """Scheduler handler: process one job, publishing progress to its event log."""
+    source_ready = None
+    if params.get("upload_id"):
+        # Still uploading (possibly resumed after a restart): wait for bytes as they come
+        session = upload_store.get(params["upload_id"])
+        if session is not None and not session.complete:
+            source_ready = session.wait_for
+
+    process_audio(params["date_str"], params["wav_path"], params["artwork_path"], params["show_title"],
+                  params["guest"], lambda msg, event=None: broker.publish(job_id, msg, event), source_ready)
+
+
+def busy_response(e):
+    logging.warning(str(e))
+    response = jsonify(success=False, message="Server busy, please retry shortly.", retry_after=e.retry_after)
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+job_store = JobStore(os.path.join(STATE_DIR, "jobs.db"))
+broker = EventBroker(os.path.join(STATE_DIR, "jobs.db"), ttl=EVENT_TTL)
+scheduler = JobScheduler(job_store, run_job, workers=JOB_WORKERS, max_pending=MAX_PENDING_JOBS)
+
+METRICS.gauge("pipeline_jobs_pending", "Jobs queued or running.", lambda: scheduler.pending)
+
+
+@app.route("/metrics")
+def metrics():
+    """Per-stage timings, throughput and memory in Prometheus text format."""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+# ---------- Resumable chunked uploads ----------
+# POST /uploads                  -> start (or resume) an upload, returns upload_id and bytes received;
+#                                   with date_str set, processing starts right away (job_id)
+# PUT  /uploads/<id>             -> body is one chunk, placed by its Content-Range header
+# GET  /uploads/<id>             -> bytes received so far, to resume after a dropped connection
+# POST /uploads/<id>/complete    -> all bytes are in; start processing if it has not started yet
+#                                   (date_str, show_title and guest may be given here instead)
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    data = request.get_json(silent=True) or request.form
+    size = str(data.get("size", ""))
+
+    # Resume an existing upload of the same file
+    upload_id = data.get("upload_id")
+    if upload_id:
+        session = upload_store.get(upload_id)
+        if session and str(session.size) == size:
+            if session.job_id is None:
+                start_upload_job(session)
+            return jsonify(success=True, upload_id=session.upload_id, received=session.received,
+                           job_id=session.job_id)
+
+    filename = data.get("filename")
+    if not filename or not size.isdigit():
+        return jsonify(success=False, message="filename and size are required"), 400
+
+    fields = {key: data.get(key) for key in ("date_str", "show_title", "guest")}
+    # Without a date the upload is just stored, and processed once completed with one
+    error = date_str_error(fields["date_str"]) if fields["date_str"] else None
+    if error:
+        return jsonify(success=False, message=error), 400
+    session = upload_store.create(filename, int(size), fields)
+    logging.info(f"Started chunked upload {session.upload_id} for {filename} ({size} bytes)")
+    start_upload_job(session)
+    return jsonify(success=True, upload_id=session.upload_id, received=0, job_id=session.job_id)
+
+
+def start_upload_job(session):
+    """
+    Start processing an upload while it is still arriving.
+
+    Each output is rendered as soon as the bytes up to its end minute are in,
+    so early segments are encoded and delivered during the upload.
+    """
+    fields = session.fields
+    if not fields.get("date_str"):
+        return None
+    try:
+        session.job_id = start_job(fields["date_str"], session.path, None, fields.get("show_title"),
+                                   fields.get("guest"), upload_id=session.upload_id)
+    except JobQueueFull as e:
+        # No room yet; the job is queued when the upload completes instead
+        logging.info(f"Not pipelining upload {session.upload_id}: {e}")
+        return None
+    session.save()
+    return session.job_id
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    session = upload_store.get(upload_id)
+    if session is None:
+        return jsonify(success=False, message=f"No such upload: {upload_id}"), 404
+    return jsonify(success=True, upload_id=upload_id, received=session.received, size=session.size)
+
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    session = upload_store.get(upload_id)
+    if session is None:
+        return jsonify(success=False, message=f"No such upload: {upload_id}"), 404
+
+    match = CONTENT_RANGE_RE.match(request.headers.get("Content-Range", ""))
+    if not match:
+        return jsonify(success=False, message="Content-Range header required"), 400
+
+    # Stream the body straight into the destination file
+    try:
+        received = session.write(int(match.group(1)), request.stream)
+    except UploadOffsetError as e:
+        return jsonify(success=False, message=str(e), received=session.received), 409
+
+    # Reject non-WAV uploads as soon as the header is in, not after 600 MB
+    try:
+        session.probe_header()
+    except WavFormatError as e:
+        upload_store.discard(upload_id, delete_file=True)
+        logging.warning(f"Rejected upload {upload_id}: {e}")
+        return jsonify(success=False, message=f"Not a valid WAV file: {e}"), 415
+
+    return jsonify(success=True, received=received, size=session.size)
+
+
+@app.route("/uploads/<upload_id>/complete", methods=["POST"])
+def complete_upload(upload_id):
+    session = upload_store.get(upload_id)
+    if session is None:
+        return jsonify(success=False, message=f"No such upload: {upload_id}"), 404
+    if not session.complete:
+        return jsonify(success=False, message="Upload incomplete", received=session.received), 409
+
+    try:
+        session.probe_header()
+    except WavFormatError as e:
+        upload_store.discard(upload_id, delete_file=True)
+        return jsonify(success=False, message=f"Not a valid WAV file: {e}"), 415
+
+    fields = session.fields
+    job_id = session.job_id
+    if job_id is None:
+        # Not started during the upload (no metadata, or the queue was full); process it now,
+        # with the metadata sent on completion if the upload was started without it
+        data = request.get_json(silent=True) or request.form
+        fields = dict(fields, **{key: data[key] for key in ("date_str", "show_title", "guest") if data.get(key)})
+        error = date_str_error(fields["date_str"])
+        if error:
+            return jsonify(success=False, message=error), 400
+        try:
+            job_id = start_job(fields["date_str"], session.path, None, fields.get("show_title"), fields.get("guest"))
+        except JobQueueFull as e:
+            return busy_response(e)
+    upload_store.discard(upload_id)
 
     return jsonify(success=True, message="Upload successful. Processing started.", job_id=job_id)
 
@@ -152,19 +352,25 @@ def get_processed_files(date_str, sbe_number=None):
 #     finally:
 #         progress_queue.put("[DONE]")
 
-def process_audio(date_str, wav_path, artwork_path, show_title, guest, progress_queue):
+def process_audio(date_str, wav_path, artwork_path, show_title, guest, publish, source_ready=None):
     """
-    Process audio and push progress messages into the given queue,
-    then upload to all FTP sites using the refactored upload function.
+    Process audio and publish progress messages for the job,
+    uploading each output to its FTP sites as soon as it is rendered.
+
+    :param publish: callable(msg, event=None) appending to the job's event log;
+                    stage timings go out as JSON "span" events
+    :param source_ready: set when wav_path is still being uploaded; see split_and_export
     """
     def progress(msg):
         logging.info(msg)
-        progress_queue.put(msg)
+        publish(msg)
+
+    spans = recorder(lambda event: publish(json.dumps(event), "span"))
 
     try:
         progress("⏳ Starting processing...")
 
-        # Process audio
+        # Process audio; each output is uploaded to its FTP sites while the rest are still rendering
         result = split_and_export(
             wav_path,
             app.config['PROCESSED_FOLDER'],
@@ -172,52 +378,78 @@ def process_audio(date_str, wav_path, artwork_path, show_title, guest, progress_
             show_title,
             guest,
             artwork_path,
-            progress_callback=progress
+            progress_callback=progress,
+            source_ready=source_ready,
+            on_span=spans,
+            upload=True
         )
 
         # Unpack files
         if result and len(result) == 3:
             wav_files, mp3_files, podcast_file = result
-            h1_mp3 = mp3_files[0]
             progress(f"✅ Processing complete!")
             progress(f"WAV segments: {', '.join(wav_files)}")
             progress(f"MP3 files: {', '.join(mp3_files)}")
-            progress(f"Podcast file: {podcast_file}")
+            if podcast_file:
+                progress(f"Podcast file: {podcast_file}")
         else:
             # fallback if split_and_export fails
             h1_mp3, wav_files, podcast_file = get_processed_files(date_str)
             progress("✅ Processing complete! (using default filenames)")
+            upload_files_to_ftp(h1_mp3, wav_files, podcast_file, progress_callback=progress, on_span=spans,
+                                date_str=date_str)
+            return
 
-        # --- FTP Uploads using refactored function ---
-        upload_files_to_ftp(h1_mp3, wav_files, podcast_file, progress_callback=progress)
+        progress("🎉 All FTP uploads completed successfully!")
 
     except Exception as e:
         progress(f"❌ Error during processing: {e}")
+        raise
     finally:
-        progress_queue.put("[DONE]")
+        publish(END_OF_STREAM)
 
 
 @app.route("/process-audio-sse/<job_id>")
 def process_audio_sse(job_id):
-    """SSE endpoint to stream progress messages for a specific job."""
-    if job_id not in jobs:
+    """
+    SSE endpoint to stream progress messages for a specific job.
+
+    Every event carries an id; a reconnecting EventSource sends the last one
+    it saw in Last-Event-ID and gets everything after it replayed.
+    """
+    job = job_store.get(job_id)
+    if job is None:
         return f"No such job: {job_id}", 404
 
-    progress_queue = jobs[job_id]
+    last_id = request.headers.get("Last-Event-ID", request.args.get("last_event_id", "0"))
+    after = int(last_id) if last_id.isdigit() else 0
 
     def generate():
-        while True:
-            try:
-                msg = progress_queue.get(timeout=0.5)
-                yield f"data: {msg}\n\n"
-                if msg == "[DONE]":
-                    del jobs[job_id]
-                    break
-            except Empty:
+        yield "retry: 3000\n\n"
+
+        if job["status"] in (DONE, FAILED) and not broker.has_events(job_id):
+            # Finished so long ago its events expired; report the outcome only
+            yield f"data: {'✅ Job complete' if job['status'] == DONE else '❌ Job failed: ' + job['error']}\n\n"
+            yield f"data: {END_OF_STREAM}\n\n"
+            return
+
+        for event in broker.subscribe(job_id, after, finished=job["status"] in (DONE, FAILED)):
+            if event is None:
+                yield ": keepalive\n\n"
                 continue
+            seq, kind, msg = event
+            if kind:
+                yield f"id: {seq}\nevent: {kind}\ndata: {msg}\n\n"
+            else:
+                yield f"id: {seq}\ndata: {msg}\n\n"
 
-    return Response(generate(), mimetype="text/event-stream")
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True, threaded=True)
+    debug = True
+    # The debug reloader runs this file twice; only the serving child process runs jobs
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        scheduler.start()
+    app.run(host="0.0.0.0", port=5000, debug=debug, threaded=True)
@@ -0,0 +1,169 @@
+import os
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+
+# Span fields exported as Prometheus labels; everything else (file names,
+# byte counts, ...) only goes out with the span event itself
+LABELS = ("span", "kind", "site", "protocol", "status")
+
+# Upper bounds (seconds) of the span duration histogram buckets
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def current_rss_kb():
+    """Resident set size of this process right now, in KiB; None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+class Span:
+    """
+    One timed piece of work: an export, an encode, a tag write, an upload, ...
+
+    Set `bytes` and, for audio work, `audio_seconds` on it while it runs;
+    throughput and realtime factor are derived when it ends, along with
+    the process's RSS when it started and ended (spans on other threads
+    share the process, so these are not the span's own memory).
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.bytes = 0
+        self.audio_seconds = None
+        self.status = "ok"
+        self._rss_start_kb = current_rss_kb()
+        self._start = time.perf_counter()
+
+    def finish(self):
+        duration = time.perf_counter() - self._start
+        event = {"span": self.name, **self.fields, "status": self.status,
+                 "duration": round(duration, 3), "bytes": self.bytes}
+        if self.bytes and duration:
+            event["mb_per_s"] = round(self.bytes / duration / 1e6, 2)
+        if self.audio_seconds:
+            event["audio_seconds"] = round(self.audio_seconds, 3)
+            if duration:
+                event["realtime"] = round(self.audio_seconds / duration, 1)
+        if self._rss_start_kb is not None:
+            event["rss_start_kb"] = self._rss_start_kb
+            event["rss_end_kb"] = current_rss_kb()
+        # ru_maxrss is a lifetime high-water mark, in KiB: the largest RSS the
+        # process (or any one finished child, e.g. ffmpeg) has reached so far,
+        # not this span's
+        event["process_peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        event["process_peak_child_rss_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return event
+
+
+class Metrics:
+    """Aggregates finished spans for the Prometheus text endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}   # label tuple -> {"count", "sum", "bytes", "audio", "buckets"}
+        self._gauges = {}   # name -> (help, callable)
+
+    def observe(self, event):
+        key = tuple((name, str(event[name])) for name in LABELS if event.get(name) is not None)
+        with self._lock:
+            series = self._series.setdefault(key, {
+                "count": 0, "sum": 0.0, "bytes": 0, "audio": 0.0, "buckets": [0] * len(DURATION_BUCKETS)})
+            series["count"] += 1
+            series["sum"] += event["duration"]
+            series["bytes"] += event.get("bytes") or 0
+            series["audio"] += event.get("audio_seconds") or 0
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if event["duration"] <= bound:
+                    series["buckets"][i] += 1
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge whose value is read from fn() at scrape time."""
+        self._gauges[name] = (help_text, fn)
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            series = {key: dict(value, buckets=list(value["buckets"])) for key, value in self._series.items()}
+
+        def labels(key, extra=()):
+            pairs = list(key) + list(extra)
+            return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}" if pairs else ""
+
+        lines = [
+            "# HELP pipeline_span_seconds Duration of pipeline spans.",
+            "# TYPE pipeline_span_seconds histogram",
+        ]
+        for key, s in sorted(series.items()):
+            for bound, count in zip(DURATION_BUCKETS, s["buckets"]):
+                lines.append(f"pipeline_span_seconds_bucket{labels(key, [('le', bound)])} {count}")
+            lines.append(f"pipeline_span_seconds_bucket{labels(key, [('le', '+Inf')])} {s['count']}")
+            lines.append(f"pipeline_span_seconds_sum{labels(key)} {s['sum']:.3f}")
+            lines.append(f"pipeline_span_seconds_count{labels(key)} {s['count']}")
+
+        lines += ["# HELP pipeline_span_bytes_total Bytes processed by pipeline spans.",
+                  "# TYPE pipeline_span_bytes_total counter"]
+        lines += [f"pipeline_span_bytes_total{labels(key)} {s['bytes']}" for key, s in sorted(series.items())]
+
+        lines += ["# HELP pipeline_span_audio_seconds_total Seconds of audio processed by pipeline spans.",
+                  "# TYPE pipeline_span_audio_seconds_total counter"]
+        lines += [f"pipeline_span_audio_seconds_total{labels(key)} {s['audio']:.3f}"
+                  for key, s in sorted(series.items()) if s["audio"]]
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        lines += ["# HELP process_peak_rss_bytes Peak resident set size of the server process.",
+                  "# TYPE process_peak_rss_bytes gauge",
+                  f"process_peak_rss_bytes {usage.ru_maxrss * 1024}",
+                  "# HELP process_cpu_seconds_total CPU time used by the server process.",
+                  "# TYPE process_cpu_seconds_total counter",
+                  f"process_cpu_seconds_total {usage.ru_utime + usage.ru_stime:.2f}"]
+
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {fn()}"]
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def recorder(publish=None):
+    """
+    Span sink that aggregates into METRICS and forwards each span event,
+    e.g. to a job's event stream.
+    """
+    def emit(event):
+        METRICS.observe(event)
+        if publish:
+            publish(event)
+    return emit
+
+
+def with_fields(emit, **fields):
+    """Wrap a span sink so every span passing through gets extra fields (e.g. the site)."""
+    emit = emit or METRICS.observe
+    return lambda event: emit({**event, **fields})
+
+
+@contextmanager
+def span(name, emit=None, **fields):
+    """
+    Time a block of work and hand the finished span event to `emit`
+    (default: straight into METRICS). Failed blocks are reported with
+    status "error" and the exception is re-raised.
+    """
+    current = Span(name, fields)
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        (emit or METRICS.observe)(current.finish())
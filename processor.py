@@ -1,20 +1,104 @@
 import os
 import logging
-import time
+import asyncio
 from datetime import datetime, timedelta
-from pydub import AudioSegment, effects
-from pydub.silence import detect_silence
-import ftplib
+from pydub import AudioSegment
 from config.settings import FTP_LOCATIONS
 from mutagen.easyid3 import EasyID3
 from mutagen.mp3 import MP3
 from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, TRCK, TCON, COMM, APIC, ID3NoHeaderError
-import paramiko
 import socket
+import subprocess
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from wavfile import WavReader, HEADER_PROBE_BYTES
+from rendercache import RenderCache
+from metrics import span, with_fields
+from silence import snap_to_silence, compress_silences
+from loudness import LoudnessMeter
+from profiles import load_profile, compile_outputs, file_deliveries, DEFAULT_PROFILE
+from taskgraph import TaskGraph
+from uploadengine import UploadEngine, backoff_delay, CHUNK_SIZE
+from transfer import (ProtocolCache, ConnectionPool, remote_names, ftp_server_copy, sftp_server_copy,
+                      ftp_resume_offset, ftp_open_store, ftp_finish_store, sftp_resume_offset, sftp_open_store,
+                      sftp_open_range, sftp_open_channel, byte_ranges, ftp_remote_digest, sftp_remote_digest,
+                      checksum_sidecar, ftp_put_bytes, sftp_put_bytes, DeliveryManifest, Digests,
+                      cached_digests, remember_digests, file_digests, file_sha256)
 
 
 SILENCE_MS = 1500
 
+# Move every segment cut to the nearest silence within this many ms of its
+# table time (0 = cut exactly at the SEGMENTS/MONDAY_SEGMENTS times)
+SNAP_TO_SILENCE_MS = int(os.environ.get("SNAP_TO_SILENCE_MS", "0"))
+# Anything quieter than this counts as silence; a gap needs SILENCE_MIN_GAP_MS of it
+SILENCE_THRESHOLD_DB = float(os.environ.get("SILENCE_THRESHOLD_DB", "-40"))
+SILENCE_MIN_GAP_MS = int(os.environ.get("SILENCE_MIN_GAP_MS", "250"))
+# Shorten pauses in the podcast to at most SILENCE_MS
+COMPRESS_PODCAST_SILENCE = os.environ.get("COMPRESS_PODCAST_SILENCE", "0") == "1"
+
+
+def _loudness_target(prefix):
+    """<prefix>_TARGET_LUFS / <prefix>_TRUE_PEAK from the environment; None leaves the levels alone."""
+    lufs = os.environ.get(f"{prefix}_TARGET_LUFS")
+    if not lufs:
+        return None
+    return {"lufs": float(lufs), "true_peak": float(os.environ.get(f"{prefix}_TRUE_PEAK", "-1.0"))}
+
+
+# EBU R128 loudness normalisation of the encoded outputs, e.g. H1_TARGET_LUFS=-23
+# for broadcast and PODCAST_TARGET_LUFS=-16 for the podcast (true peak in dBTP)
+LOUDNESS_TARGETS = {
+    "h1": _loudness_target("H1"),
+    "podcast": _loudness_target("PODCAST"),
+}
+
+H1_SEGMENT = {"start": 6, "end": 58.833}
+
+# Local state (protocol cache, ...) kept between jobs
+STATE_DIR = os.environ.get("STATE_DIR", "/app/app/state")
+
+# How long a host's negotiated protocol is trusted before probing again
+PROTOCOL_CACHE_TTL = int(os.environ.get("PROTOCOL_CACHE_TTL", str(24 * 3600)))
+PROTOCOL_CACHE = ProtocolCache(os.path.join(STATE_DIR, "protocol_cache.json"), PROTOCOL_CACHE_TTL)
+
+# Files already verified on each site; reruns skip them
+DELIVERY_MANIFEST = DeliveryManifest(os.path.join(STATE_DIR, "delivery_manifest.json"))
+
+# Authenticated FTP/FTPS/SFTP sessions are reused across files, sites and jobs
+CONNECTION_IDLE_TIMEOUT = int(os.environ.get("CONNECTION_IDLE_TIMEOUT", "300"))
+CONNECTION_POOL = ConnectionPool(idle_timeout=CONNECTION_IDLE_TIMEOUT)
+
+# Every transfer runs on one event loop; blocking protocol calls share UPLOAD_IO_WORKERS threads.
+# Bandwidth caps in bytes/s (0 = unlimited): UPLOAD_MAX_BPS for all uploads together, so
+# deliveries leave room for the live stream, and UPLOAD_HOST_MAX_BPS per host (a site's
+# "max_bps" in FTP_LOCATIONS overrides it)
+UPLOAD_IO_WORKERS = int(os.environ.get("UPLOAD_IO_WORKERS", "8"))
+UPLOAD_MAX_BPS = int(os.environ.get("UPLOAD_MAX_BPS", "0"))
+UPLOAD_HOST_MAX_BPS = int(os.environ.get("UPLOAD_HOST_MAX_BPS", "0"))
+UPLOAD_ENGINE = UploadEngine(UPLOAD_IO_WORKERS, UPLOAD_MAX_BPS, UPLOAD_HOST_MAX_BPS)
+
+# SFTP files of at least SFTP_SEGMENT_MIN_BYTES are split into SFTP_STREAMS byte ranges
+# written at once over their own channels, so a high-latency link is not held to one
+# channel's window (1 = a single stream)
+SFTP_STREAMS = int(os.environ.get("SFTP_STREAMS", "4"))
+SFTP_SEGMENT_MIN_BYTES = int(os.environ.get("SFTP_SEGMENT_MIN_BYTES", str(16 * 1024 * 1024)))
+
+# Uploads are checked against the server's own hash of the file where it has one. On a
+# mismatch the file is compared in VERIFY_BLOCK_BYTES blocks and re-sent from the first
+# bad one. CHECKSUM_SIDECARS puts a `<name>.sha256` next to every delivered file (a site's
+# "sidecar" in FTP_LOCATIONS overrides it)
+VERIFY_BLOCK_BYTES = int(os.environ.get("VERIFY_BLOCK_BYTES", str(8 * 1024 * 1024)))
+CHECKSUM_SIDECARS = os.environ.get("CHECKSUM_SIDECARS", "1") == "1"
+
+# Number of outputs encoded concurrently by split_and_export (1 = single-pass graph)
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "1"))
+
+# Encoded outputs keyed on their source audio and codec; identical renders become a copy
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(STATE_DIR, "render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+RENDER_CACHE = RenderCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+
 SEGMENTS = [
     {"name": "S1", "start": 6, "end": 18},
     {"name": "S2", "start": 21, "end": 30},
@@ -72,326 +156,778 @@ def get_saturday_before(date_str):
     saturday = dt - timedelta(days=2)
     return saturday.strftime("%m-%d-%y")  
 
-def sftp_upload(files, host, user, password, remote_dir, rename=None, max_retries=3, progress=None):
+def _upload_files(protocol, files, host, user, password, remote_dir, rename_map, max_retries, progress,
+                  on_verified, on_span, max_connections, max_bps, sidecar=False):
+    """
+    Coroutine uploading `files` with one protocol on UPLOAD_ENGINE.
 
-    if progress is None:
-        progress = lambda msg: print(msg)
+    Files go largest first, through at most max_connections connections to
+    the host (shared with every other upload to it); a failed attempt is
+    resumed after an exponential backoff with jitter. Every file is tried
+    even if another fails; the first error is raised at the end. Large
+    SFTP files are sent as parallel byte ranges (see send_segmented).
 
-    rename_map = rename if isinstance(rename, dict) else {}
-
-    # Connect to SFTP
-    transport = paramiko.Transport((host, 22))
-    transport.connect(username=user, password=password)
-    sftp = paramiko.SFTPClient.from_transport(transport)
+    Each upload is checked by size and, where the server can hash files,
+    by content (see verify); with `sidecar`, a checksum file is uploaded
+    next to it.
+    """
+    engine = UPLOAD_ENGINE
+    label = " via SFTP" if protocol == "sftp" else ""
+    remote_digest = sftp_remote_digest if protocol == "sftp" else ftp_remote_digest
+    put_bytes = sftp_put_bytes if protocol == "sftp" else ftp_put_bytes
+
+    async def cd(conn):
+        if protocol == "sftp":
+            await engine.call(conn.chdir, remote_dir)
+        else:
+            await engine.call(conn.cwd, remote_dir)
+
+    def segmented(local_size):
+        return protocol == "sftp" and SFTP_STREAMS > 1 and local_size >= SFTP_SEGMENT_MIN_BYTES
+
+    async def send_segmented(conn, file_path, remote_name, local_size, completed):
+        """
+        Write SFTP_STREAMS byte ranges of the file at once, each over its own
+        channel with offset writes. Out-of-order bytes can't feed one hash,
+        so unless its digests are already known the file is read a second
+        time to hash it, alongside the streams so those reads mostly come
+        from the page cache; verify, the manifest and the sidecar share it.
+
+        :param completed: starts of the ranges already written, kept across
+                          attempts so a retry only resends the unfinished ones
+        """
+        todo = [r for r in byte_ranges(local_size, SFTP_STREAMS, CHUNK_SIZE) if r[0] not in completed]
+        if not completed:
+            remote = await engine.call(conn.open, remote_name, "wb")
+            await engine.call(remote.close)
+        elif len(todo) < SFTP_STREAMS:
+            progress(f"↪ Resuming {remote_name}: {len(todo)} of its ranges left...")
+
+        async def stream(start, end):
+            channel = await engine.call(sftp_open_channel, conn)
+            try:
+                remote = await engine.call(sftp_open_range, channel, remote_name, start)
+                try:
+                    sent = await engine.send_file(host, file_path, start, remote.write, end)
+                finally:
+                    # Waits for the server to acknowledge every pipelined write
+                    await engine.call(remote.close)
+            finally:
+                await engine.call(channel.close)
+            completed.add(start)
+            return sent
+
+        hashing = engine.call(file_digests, file_path) if cached_digests(file_path) is None else asyncio.sleep(0)
+        results = await asyncio.gather(hashing, *[stream(start, end) for start, end in todo],
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        return sum(results[1:]), (await engine.call(conn.stat, remote_name)).st_size
+
+    async def send(conn, file_path, remote_name, local_size, attempt, completed, resume_at):
+        """
+        Send one file over a checked-out session; returns (bytes sent, remote size).
+
+        :param resume_at: offset to re-send from after a checksum mismatch
+                          (None = keep whatever a failed attempt delivered)
+        """
+        await cd(conn)
+        if segmented(local_size):
+            return await send_segmented(conn, file_path, remote_name, local_size, completed)
+
+        if resume_at is not None:
+            offset = resume_at
+            progress(f"↪ Re-sending {remote_name} from byte {offset}/{local_size}...")
+        else:
+            resume_offset = sftp_resume_offset if protocol == "sftp" else ftp_resume_offset
+            # Keep whatever a failed attempt already delivered
+            offset = await engine.call(resume_offset, conn, remote_name, local_size) if attempt > 1 else 0
+            if offset:
+                progress(f"↪ Resuming {remote_name} at byte {offset}/{local_size}...")
+
+        if protocol == "sftp":
+            remote = await engine.call(sftp_open_store, conn, remote_name, offset)
+        else:
+            data, start = await engine.call(ftp_open_store, conn, remote_name, offset)
+            if start != offset:
+                progress(f"Server refused to resume {remote_name}, sending it whole...")
+                offset = start
 
-    # Ensure directory exists
-    try:
-        sftp.chdir(remote_dir)
-    except IOError:
-        progress(f"📁 Remote directory not found, creating: {remote_dir}")
-        sftp.mkdir(remote_dir)
-        sftp.chdir(remote_dir)
+        # The file is hashed as it goes out (after the bytes kept on the server,
+        # if resuming), so verifying it needs no second read
+        digests = Digests() if cached_digests(file_path) is None else None
 
-    for file_path in files:
-        local_name = os.path.basename(file_path)
-        remote_name = rename_map.get(local_name, local_name)
+        async def send_from(write):
+            if digests is not None and offset:
+                await engine.call(digests.update_from_file, file_path, 0, offset)
+            return await engine.send_file(host, file_path, offset, write, digests=digests)
 
+        if protocol == "sftp":
+            try:
+                sent = await send_from(remote.write)
+            finally:
+                await engine.call(remote.close)
+            remote_size = (await engine.call(conn.stat, remote_name)).st_size
+        else:
+            try:
+                sent = await send_from(data.sendall)
+            except BaseException:
+                data.close()
+                raise
+            await engine.call(ftp_finish_store, conn, data)
+            remote_size = await engine.call(conn.size, remote_name)
+
+        if digests is not None:
+            remember_digests(file_path, digests)
+        return sent, remote_size
+
+    async def verify(conn, file_path, remote_name):
+        """
+        Compare the server's hash of the remote file (HASH, XSHA256, XMD5 or
+        XCRC over FTP, sha256sum or md5sum over SFTP) with the local one.
+
+        :return: (algorithm, matches), or None if the server can't hash files
+        """
+        remote = await engine.call(remote_digest, conn, remote_name)
+        if remote is None:
+            return None
+        algorithm, digest = remote
+        return algorithm, digest == (await engine.call(file_digests, file_path))[algorithm]
+
+    async def range_matches(conn, file_path, remote_name, start, end):
+        """Whether the remote bytes [start, end) hash like the local ones; None if the server can't tell."""
+        remote = await engine.call(remote_digest, conn, remote_name, start, end)
+        if remote is None:
+            return None
+        algorithm, digest = remote
+        return digest == (await engine.call(file_digests, file_path, start, end))[algorithm]
+
+    async def first_bad_block(conn, file_path, remote_name, local_size):
+        """Start of the first VERIFY_BLOCK_BYTES block that differs on the server (0 if it can't hash ranges)."""
+        for start in range(0, local_size, VERIFY_BLOCK_BYTES):
+            matches = await range_matches(conn, file_path, remote_name, start,
+                                          min(start + VERIFY_BLOCK_BYTES, local_size))
+            if not matches:
+                return start
+        return 0
+
+    async def forget_bad_ranges(conn, file_path, remote_name, local_size, completed):
+        """Drop the byte ranges that differ on the server from `completed` (all of them if it can't hash ranges)."""
+        ranges = byte_ranges(local_size, SFTP_STREAMS, CHUNK_SIZE)
+        for start, end in ranges:
+            if not await range_matches(conn, file_path, remote_name, start, end):
+                completed.discard(start)
+        if len(completed) == len(ranges):
+            completed.clear()
+
+    async def send_sidecar(conn, file_path, remote_name):
+        sidecar_name, data = checksum_sidecar(remote_name, await engine.call(file_sha256, file_path))
+        await engine.call(put_bytes, conn, sidecar_name, data)
+        progress(f"🧾 Checksum sidecar: {sidecar_name}")
+
+    async def store(file_path, remote_name):
         local_size = os.path.getsize(file_path)
+        completed = set()
+        resume_at = None
 
         for attempt in range(1, max_retries + 1):
             try:
-                progress(f"Uploading {remote_name} via SFTP (Attempt {attempt}/{max_retries})...")
-                sftp.put(file_path, remote_name)
-
-                # Verify upload
-                remote_size = sftp.stat(remote_name).st_size
-
-                if remote_size != local_size:
-                    raise Exception(f"Size mismatch local={local_size} remote={remote_size}")
-
-                progress(f"✔ Verified SFTP upload: {remote_name}")
-                break
+                progress(f"Uploading {remote_name}{label} (Attempt {attempt}/{max_retries})...")
+
+                # The connection slot is held while sending only, not while backing off.
+                # A session that dropped mid-transfer is discarded by the pool,
+                # so each attempt gets a live one
+                async with slots.take(local_size):
+                    with span("upload", on_span, protocol=protocol, file=remote_name, attempt=attempt) as s:
+                        async with engine.session(CONNECTION_POOL, protocol, host, user, password) as conn:
+                            s.bytes, remote_size = await send(conn, file_path, remote_name, local_size, attempt,
+                                                              completed, resume_at)
+                            resume_at = None
+                            if remote_size != local_size:
+                                completed.clear()
+                                raise Exception(f"File size mismatch: local={local_size}, remote={remote_size}")
+
+                            checked = await verify(conn, file_path, remote_name)
+                            if checked and not checked[1]:
+                                # Only what differs goes again on the next attempt
+                                if segmented(local_size):
+                                    await forget_bad_ranges(conn, file_path, remote_name, local_size, completed)
+                                else:
+                                    resume_at = await first_bad_block(conn, file_path, remote_name, local_size)
+                                raise Exception(f"Checksum mismatch ({checked[0]}): {remote_name}")
+                            if sidecar:
+                                await send_sidecar(conn, file_path, remote_name)
+
+                method = f" ({checked[0]} match)" if checked else ""
+                progress(f"✓ Verified: {remote_name} uploaded successfully{method}.")
+                await engine.call(on_verified, file_path, remote_name)
+                return
 
             except Exception as e:
                 progress(f"⚠️ Error uploading {remote_name}: {e}")
                 if attempt == max_retries:
-                    raise Exception(f"FAILED after {max_retries} attempts: {remote_name}")
-                time.sleep(2)
-
-    sftp.close()
-    transport.close()
-
-# def ftp_upload(file_paths, host, user, password, remote_dir="/", rename=None, max_retries=2):
-#     """
-#     Upload files to FTP server (plain FTP for testing) with retry.
-#     One FTP connection per file to avoid TLS session issues.
-#     """
-#     for file_path in file_paths:
-#         filename = os.path.basename(file_path)
-
-#         # Determine files to upload (rename or plain)
-#         upload_files = [filename]
-#         if rename:
-#             upload_files = [filename.replace("H1", tag) for tag in rename]
-
-#         for up_file in upload_files:
-#             for attempt in range(1, max_retries + 1):
-#                 try:
-#                     logging.info(f"Connecting to {host} for {up_file} (attempt {attempt})")
-#                     ftp = FTP(host, timeout=30)
-#                     ftp.login(user, password)
-#                     ftp.set_pasv(True)
-#                     ftp.cwd(remote_dir)
-
-#                     logging.info(f"Uploading {up_file} to {host}")
-#                     with open(file_path, "rb") as f:
-#                         ftp.storbinary(f"STOR {up_file}", f)
-
-#                     logging.info(f"✅ Successfully uploaded {up_file}")
-#                     ftp.quit()
-#                     break
-#                 except Exception as e:
-#                     logging.error(f"Error uploading {up_file} to {host}: {e}")
-#                     try:
-#                         ftp.quit()
-#                     except:
-#                         pass
-#                     if attempt < max_retries:
-#                         logging.info("Retrying...")
-#                         time.sleep(2)  # short delay before retry
-#                     else:
-#                         logging.error(f"❌ Failed to upload {up_file} after {max_retries} attempts")
-
-
-# def ftp_upload(files, host, user, password, remote_dir, rename=None, max_retries=3, progress=None):
-#     """
-#     Upload files to an FTP or FTPS server with automatic TLS detection.
-#     """
-
-#     if progress is None:
-#         progress = lambda msg: print(msg)
-
-#     rename_map = rename if isinstance(rename, dict) else {}
-
-#     # -------------------------------------
-#     # Try FTP first; if TLS required, retry with FTP_TLS
-#     # -------------------------------------
-#     def connect(try_tls=False):
-#         if try_tls:
-#             progress("🔐 Attempting FTPS (TLS)...")
-#             ftp = ftplib.FTP_TLS(host)
-#             ftp.login(user=user, passwd=password)
-#             ftp.prot_p()  # Secure data connection
-#         else:
-#             progress("🌐 Attempting plain FTP...")
-#             ftp = ftplib.FTP(host)
-#             ftp.login(user=user, passwd=password)
-
-#         ftp.cwd(remote_dir)
-#         return ftp
-
-#     # Try plain FTP — if TLS is required, fall back to FTPS
-#     try:
-#         ftp = connect(try_tls=False)
-#     except Exception as e:
-#         if "TLS" in str(e).upper() or "SSL" in str(e).upper() or "secure" in str(e).lower():
-#             progress(f"⚠️ Server requires TLS: {e}")
-#             ftp = connect(try_tls=True)
-#         else:
-#             raise
-
-#     # -------------------------------------
-#     # Upload files
-#     # -------------------------------------
-#     with ftp:
-#         for file_path in files:
-#             filename_local = os.path.basename(file_path)
-#             filename_remote = rename_map.get(filename_local, filename_local)
-#             local_size = os.path.getsize(file_path)
+                    raise
+                delay = backoff_delay(attempt)
+                progress(f"⏳ Retrying {remote_name} in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    async def upload_file(file_path):
+        names = remote_names(file_path, rename_map)
+        await store(file_path, names[0])
+
+        # Same content under another name: copy on the server instead of re-sending
+        for copy_name in names[1:]:
+            server_copy = sftp_server_copy if protocol == "sftp" else ftp_server_copy
+            async with engine.session(CONNECTION_POOL, protocol, host, user, password) as conn:
+                await cd(conn)
+                copied = await engine.call(server_copy, conn, names[0], copy_name)
+                checked = await verify(conn, file_path, copy_name) if copied else None
+                if checked and not checked[1]:
+                    copied = False
+                elif copied and sidecar:
+                    await send_sidecar(conn, file_path, copy_name)
+            if copied:
+                progress(f"✓ Server-side copy: {names[0]} → {copy_name}")
+                await engine.call(on_verified, file_path, copy_name)
+            else:
+                progress(f"Server-side copy unavailable, re-uploading {copy_name}...")
+                await store(file_path, copy_name)
+
+    async def run():
+        nonlocal slots
+        # On the engine's loop, like everything that touches its slots and buckets
+        engine.set_host_rate(host, max_bps)
+        slots = engine.slots(host, max(1, max_connections))
+
+        # Log in once up front so a host that doesn't speak this protocol fails fast
+        async with engine.session(CONNECTION_POOL, protocol, host, user, password) as conn:
+            try:
+                await cd(conn)
+            except IOError:
+                if protocol != "sftp":
+                    raise
+                progress(f"📁 Remote directory not found, creating: {remote_dir}")
+                await engine.call(conn.mkdir, remote_dir)
 
-#             for attempt in range(1, max_retries + 1):
-#                 try:
-#                     progress(f"⬆️ Uploading {filename_remote} (Attempt {attempt}/{max_retries})...")
+        results = await asyncio.gather(*[upload_file(f) for f in engine.largest_first(files)],
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
 
-#                     with open(file_path, "rb") as f:
-#                         ftp.storbinary(f"STOR {filename_remote}", f)
+    slots = None
+    return run()
 
-#                     # Verify remote size
-#                     remote_size = ftp.size(filename_remote)
 
-#                     if remote_size != local_size:
-#                         raise Exception(f"Size mismatch: local={local_size}, remote={remote_size}")
+def sftp_upload(files, host, user, password, remote_dir, rename=None, max_retries=3, progress=None,
+                on_verified=None, on_span=None, max_connections=1, max_bps=None, sidecar=False):
+    """
+    Upload files over SFTP on UPLOAD_ENGINE (see _upload_files), creating
+    remote_dir if it is missing.
 
-#                     progress(f"✅ Verified: {filename_remote} uploaded successfully.")
-#                     break
+    :param max_bps: bandwidth cap for this host in bytes/s (None = UPLOAD_HOST_MAX_BPS)
+    :param sidecar: also upload a `<name>.sha256` checksum file for every file
+    """
+    if progress is None:
+        progress = lambda msg: print(msg)
+    if on_verified is None:
+        on_verified = lambda file_path, remote_name: None
 
-#                 except Exception as e:
-#                     progress(f"⚠️ Error uploading {filename_remote}: {e}")
+    rename_map = rename if isinstance(rename, dict) else {}
 
-#                     if attempt == max_retries:
-#                         raise Exception(
-#                             f"❌ Upload failed after {max_retries} attempts: {filename_remote}"
-#                         )
+    UPLOAD_ENGINE.run(_upload_files("sftp", files, host, user, password, remote_dir, rename_map, max_retries,
+                                    progress, on_verified, on_span, max_connections, max_bps, sidecar))
 
-#                     time.sleep(2)
 
 def ftp_upload(files, host, user, password, remote_dir,
-               rename=None, max_retries=3, progress=None):
+               rename=None, max_retries=3, progress=None, on_verified=None, on_span=None,
+               max_connections=1, max_bps=None, sidecar=False):
     """
     Smart uploader:
     1. Try plain FTP
     2. If disabled, try FTPS
     3. If disabled, try SFTP
+
+    The protocol that worked is remembered per host in PROTOCOL_CACHE and
+    tried first next time; it is forgotten again if it fails. Transfers run
+    on UPLOAD_ENGINE (see _upload_files), up to max_connections at once and
+    within max_bps bytes/s for this host (None = UPLOAD_HOST_MAX_BPS).
+
+    on_verified(file_path, remote_name) is called for every file confirmed
+    on the server (by size, and by content where the server can hash it);
+    on_span gets a metrics span event for every transfer. With `sidecar`,
+    a `<name>.sha256` checksum file is uploaded next to every file.
     """
 
     if progress is None:
         progress = lambda msg: print(msg)
+    if on_verified is None:
+        on_verified = lambda file_path, remote_name: None
 
     # Renaming support
     rename_map = rename if isinstance(rename, dict) else {}
 
-    # ---------- HELPER UPLOADERS ----------
-    def upload_via_ftp(ftp):
-        ftp.cwd(remote_dir)
-        for file_path in files:
-            filename_local = os.path.basename(file_path)
-            filename_remote = rename_map.get(filename_local, filename_local)
-            local_size = os.path.getsize(file_path)
-
-            for attempt in range(1, max_retries + 1):
-                try:
-                    progress(f"Uploading {filename_remote} (Attempt {attempt}/{max_retries})...")
-                    with open(file_path, "rb") as f:
-                        ftp.storbinary(f"STOR {filename_remote}", f)
-
-                    remote_size = ftp.size(filename_remote)
-                    if remote_size != local_size:
-                        raise Exception(
-                            f"File size mismatch: local={local_size}, remote={remote_size}"
-                        )
-
-                    progress(f"✓ Verified: {filename_remote} uploaded successfully.")
-                    break
-
-                except Exception as e:
-                    progress(f"⚠️ Error uploading {filename_remote}: {e}")
-                    if attempt == max_retries:
-                        raise
-                    time.sleep(2)
-
-    # ---------- TRY PLAIN FTP ----------
-    progress("🌐 Attempting plain FTP...")
-    try:
-        with ftplib.FTP(host, timeout=10) as ftp:
-            ftp.login(user, password)
-            upload_via_ftp(ftp)
-            progress("✅ FTP upload successful.")
+    def upload_via(protocol):
+        UPLOAD_ENGINE.run(_upload_files(protocol, files, host, user, password, remote_dir, rename_map,
+                                        max_retries, progress, on_verified, on_span, max_connections, max_bps,
+                                        sidecar))
+
+    # ---------- PROTOCOL ATTEMPTS ----------
+    def try_ftp():
+        upload_via("ftp")
+
+    def try_ftps():
+        upload_via("ftps")
+
+    def try_sftp():
+        upload_via("sftp")
+
+    attempts = {
+        "ftp": ("plain FTP", "FTP", try_ftp),
+        "ftps": ("FTPS", "FTPS", try_ftps),
+        "sftp": ("SFTP", "SFTP", try_sftp),
+    }
+
+    # Go straight to the protocol that worked last time for this host
+    order = list(attempts)
+    cached = PROTOCOL_CACHE.get(host)
+    if cached in attempts:
+        progress(f"⚡ Using cached protocol for {host}: {attempts[cached][1]}")
+        order.remove(cached)
+        order.insert(0, cached)
+
+    for protocol in order:
+        label, short_name, connect_and_upload = attempts[protocol]
+        progress(f"🌐 Attempting {label}...")
+        try:
+            connect_and_upload()
+            PROTOCOL_CACHE.set(host, protocol)
+            progress(f"✅ {short_name} upload successful.")
             return True
-    except Exception as e:
-        progress(f"❌ FTP failed: {e}")
+        except Exception as e:
+            progress(f"❌ {short_name} failed: {e}")
+            if protocol == cached:
+                PROTOCOL_CACHE.invalidate(host)
 
-    # ---------- TRY FTPS ----------
-    progress("🌐 Attempting FTPS...")
-    try:
-        ftps = ftplib.FTP_TLS(timeout=10)
-        ftps.connect(host)
-        ftps.login(user, password)
-        ftps.prot_p()   # Enable secure data channel
-        upload_via_ftp(ftps)
-        ftps.quit()
-        progress("✅ FTPS upload successful.")
-        return True
-    except Exception as e:
-        progress(f"❌ FTPS failed: {e}")
+    raise Exception("All upload methods failed.")
 
-    # ---------- TRY SFTP ----------
-    progress("🌐 Attempting SFTP...")
-    try:
-        transport = paramiko.Transport((host, 22))
-        transport.connect(username=user, password=password)
-        sftp = paramiko.SFTPClient.from_transport(transport)
 
-        try:
-            sftp.chdir(remote_dir)
-        except IOError:
-            # Create directory if missing
-            sftp.mkdir(remote_dir)
-            sftp.chdir(remote_dir)
-
-        for file_path in files:
-            filename_local = os.path.basename(file_path)
-            filename_remote = rename_map.get(filename_local, filename_local)
-
-            progress(f"Uploading {filename_remote} via SFTP...")
-            sftp.put(file_path, filename_remote)
-            progress(f"✓ SFTP upload complete: {filename_remote}")
-
-        sftp.close()
-        transport.close()
-        progress("✅ SFTP upload successful.")
-        return True
+def _to_frame(minutes, sample_rate):
+    """Source frame nearest to a table time; every output cutting there gets the same frame."""
+    return round(minutes * 60 * sample_rate)
 
-    except Exception as e:
-        progress(f"❌ SFTP failed: {e}")
-        raise Exception("All upload methods failed.")
 
+def show_fields(date_str, show_title="", guest=""):
+    """Values a profile's file names, remote names and tags are filled in with."""
+    return {
+        "date_str": date_str,
+        "saturday": get_saturday_before(date_str),
+        "sunday": get_sunday_before(date_str),
+        "monday": format_monday(date_str),
+        "sbe": get_sbe_number(date_str),
+        "year": str(datetime.strptime(date_str, "%m-%d-%y").year),
+        "show_title": show_title or "",
+        "guest": guest or "",
+    }
+
+
+def _segment_tables():
+    return {"H1": [H1_SEGMENT], "SEGMENTS": SEGMENTS, "MONDAY_SEGMENTS": MONDAY_SEGMENTS}
+
+
+def build_output_plan(output_dir, date_str, sample_rate, show_title="", guest="", profile=None):
+    """
+    Describe every file rendered for a show, as set out by its output profile
+    (see profiles.py; the default one renders H1, the Sirius segments and the
+    Monday podcast from the SEGMENTS/MONDAY_SEGMENTS tables).
+
+    Each output is a dict with:
+    - kind: e.g. "h1", "sirius" or "podcast"
+    - path: destination file
+    - intervals: list of (start_frame, end_frame) cuts of the source at
+      `sample_rate`, concatenated in order
+    - codec: ffmpeg encoder arguments, or None for a straight PCM copy
+    - loudness: target for encoded outputs (the profile's, else LOUDNESS_TARGETS
+      for the kind; None = as recorded)
+    - tags: ID3 tag set to apply once rendered, or None
+    - deliveries: {site: [remote names]} it is uploaded under
+
+    :param profile: profile dict, or None for load_profile()
+    """
+    if profile is None:
+        profile = load_profile()
+    outputs = compile_outputs(profile, output_dir, show_fields(date_str, show_title, guest), _segment_tables())
+
+    for out in outputs:
+        out["intervals"] = [(_to_frame(start, sample_rate), _to_frame(end, sample_rate))
+                            for start, end in out.pop("segments")]
+        if out["codec"] and not out["loudness"]:
+            out["loudness"] = LOUDNESS_TARGETS.get(out["kind"])
+    return outputs
+
+
+def refine_intervals(source, out, snapped):
+    """
+    Adjust an output's cuts to the audio: snap them to silence (SNAP_TO_SILENCE_MS)
+    and, for the podcast, compress long pauses (COMPRESS_PODCAST_SILENCE).
+
+    :param source: open WavReader covering the output's intervals
+    :param snapped: dict of table frame -> snapped frame shared by the show's
+                    outputs, so a cut shared by several outputs lands in the same place
+    :return: new list of (start_frame, end_frame)
+    """
+    intervals = out["intervals"]
+
+    if SNAP_TO_SILENCE_MS:
+        def snap(frame):
+            if frame not in snapped:
+                snapped[frame] = snap_to_silence(source, frame, SNAP_TO_SILENCE_MS,
+                                                 SILENCE_THRESHOLD_DB, SILENCE_MIN_GAP_MS)
+            return snapped[frame]
+        intervals = [(snap(start), snap(end)) for start, end in intervals]
+
+    if COMPRESS_PODCAST_SILENCE and out["kind"] == "podcast":
+        intervals = compress_silences(source, intervals, SILENCE_MS, SILENCE_THRESHOLD_DB)
+
+    return intervals
+
+
+def plan_pieces(outputs):
+    """
+    Cut the source at every interval boundary of every output.
+
+    H1, the podcast and the Sirius segments share most of their audio; cut
+    at the union of their boundaries, each stretch of source between two
+    boundaries is one piece, and every output is a run of whole pieces.
+
+    :return: (bounds, pieces): the sorted cut frames, and for each output
+             (by index) the indices of its pieces in play order, piece i
+             being frames [bounds[i], bounds[i + 1])
+    """
+    bounds = sorted({frame for out in outputs for interval in out["intervals"] for frame in interval})
+    index = {frame: i for i, frame in enumerate(bounds)}
+    pieces = [[i for start, end in out["intervals"] for i in range(index[start], index[end])]
+              for out in outputs]
+    return bounds, pieces
+
+
+def build_render_command(wav_path, outputs):
+    """
+    Build a single ffmpeg invocation that reads the source once and writes every output.
+
+    The decoded source is cut into the shared pieces of plan_pieces with
+    asegment (sample-exact, one pass), a piece used by several outputs is
+    fanned out with asplit, and each output concatenates its pieces. An
+    output's "gain_db" (from loudness normalisation) is applied with volume.
+    Tagged MP3s get their ID3 tag reserved here (see _tag_reserve_args).
+    """
+    bounds, pieces = plan_pieces(outputs)
+    tagged = [out for out in outputs if out.get("tags") and out["path"].lower().endswith(".mp3")]
+    artworks = []
+    for out in tagged:
+        artwork = out["tags"].get("artwork")
+        if artwork and os.path.isfile(artwork) and artwork not in artworks:
+            artworks.append(artwork)
+
+    # Labels each piece is consumed under, in output order
+    consumers = {}
+    for index, out_pieces in enumerate(pieces):
+        for n, piece in enumerate(out_pieces):
+            consumers.setdefault(piece, []).append(f"[o{index}p{n}]")
+
+    # asegment yields [0, bounds[0]), then piece 0, 1, ..., then [bounds[-1], end)
+    filters = ["[0:a]asegment=samples=%s%s" % (
+        "|".join(str(frame) for frame in bounds), "".join(f"[s{i}]" for i in range(len(bounds) + 1)))]
+    for segment in range(len(bounds) + 1):
+        labels = consumers.get(segment - 1, [])
+        if not labels:
+            filters.append(f"[s{segment}]anullsink")
+        elif len(labels) == 1:
+            filters.append(f"[s{segment}]asetpts=PTS-STARTPTS{labels[0]}")
+        else:
+            filters.append(f"[s{segment}]asetpts=PTS-STARTPTS,asplit={len(labels)}{''.join(labels)}")
+
+    for index, out in enumerate(outputs):
+        parts = "".join(f"[o{index}p{n}]" for n in range(len(pieces[index])))
+        gain = f",volume={out['gain_db']:.2f}dB" if out.get("gain_db") else ""
+        if len(pieces[index]) > 1:
+            filters.append(f"{parts}concat=n={len(pieces[index])}:v=0:a=1{gain}[o{index}]")
+        else:
+            filters.append(f"{parts}anull{gain}[o{index}]")
+
+    cmd = [AudioSegment.converter, "-y", "-hide_banner", "-loglevel", "error", "-i", wav_path]
+    for artwork in artworks:
+        cmd += ["-i", artwork]
+    cmd += ["-filter_complex", ";".join(filters)]
+    for index, out in enumerate(outputs):
+        cmd += ["-map", f"[o{index}]"] + out["codec"]
+        if out in tagged:
+            artwork = out["tags"].get("artwork")
+            cmd += _tag_reserve_args(artworks.index(artwork) + 1 if artwork in artworks else None)
+        cmd += [out["path"]]
+    return cmd
+
+
+def _tag_reserve_args(artwork_input):
+    """
+    ffmpeg output options that write an output's ID3 tag ahead of apply_tag_set.
+
+    The cover goes in as the APIC frame apply_tag_set writes (same
+    description, same bytes), next to an ID3_PADDING placeholder frame that
+    apply_tag_set drops. The tag set then fits the tag ffmpeg wrote, so
+    tagging the fresh encode rewrites the tag only, not the whole MP3.
+
+    :param artwork_input: ffmpeg input index of the cover image, or None
+    """
+    args = ["-metadata", f"{ID3_PLACEHOLDER}={' ' * ID3_PADDING}"]
+    if artwork_input is not None:
+        args = ["-map", f"{artwork_input}:v", "-c:v", "copy", "-disposition:v", "attached_pic",
+                "-metadata:s:v", "title=Cover", "-metadata:s:v", "comment=Cover (front)"] + args
+    return args
+
+
+def render_outputs(wav_path, outputs):
+    """Run the single-pass render graph; raises RuntimeError if ffmpeg fails."""
+    cmd = build_render_command(wav_path, outputs)
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"ffmpeg render failed ({result.returncode}): {stderr[-2000:]}")
+
+
+EXPORT_MESSAGES = {
+    "h1": "H1 exported",
+    "sirius": "Sirius segment exported",
+    "podcast": "Podcast exported",
+}
 
-def split_and_export(wav_path, output_dir, date_str, show_title="", guest="", artwork_path=None, progress_callback=None):
+# Outputs uploaded at once per show (each site still limited by its max_connections)
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "4"))
+
+# PCM exports and tagging run at once per show, next to the encodes
+IO_WORKERS = 2
+
+
+def split_and_export(wav_path, output_dir, date_str, show_title="", guest="", artwork_path=None, progress_callback=None,
+                     workers=None, source_ready=None, on_output=None, on_span=None, upload=False,
+                     upload_workers=None, profile=None):
+    """
+    Render (and optionally deliver) every output of a show's profile: by
+    default H1, the Sirius segments and the Monday podcast.
+
+    The profile is compiled into a task graph: a render task per output (or
+    one single-pass render for all encoded outputs), a tag task per output
+    once it is rendered, and with `upload` an upload task per output and
+    site once it is tagged. Tasks run as soon as their inputs are done,
+    within "render" (`workers`), "io" (IO_WORKERS) and "upload"
+    (`upload_workers`) slots, so encodes, tagging and uploads overlap and
+    an extra output or site adds work alongside the others, not after them.
+
+    Encoded outputs already in RENDER_CACHE are copied instead of re-encoded.
+    The podcast is cached before tagging, so a metadata fix only re-tags it.
+    Cuts are fitted to the audio first when SNAP_TO_SILENCE_MS or
+    COMPRESS_PODCAST_SILENCE is set (see refine_intervals).
+
+    :param workers: outputs encoded concurrently, capped at the CPU count;
+                    1 renders every MP3 in a single ffmpeg pass.
+                    Defaults to RENDER_WORKERS.
+    :param source_ready: optional callable(nbytes) that blocks until the first
+                         nbytes of wav_path are on disk, for a source that is
+                         still being uploaded. Each output then starts as soon
+                         as the source has arrived up to its end minute.
+    :param on_output: optional callable(output) run as each output is finished
+                      (after tagging)
+    :param on_span: optional callable(event) receiving a metrics span event for
+                    every source wait, export, encode, tag and upload (see metrics.py)
+    :param upload: deliver each output to its sites as soon as it is finished;
+                   failed uploads are raised once everything else has run
+    :param upload_workers: uploads running at once, default DELIVERY_WORKERS
+    :param profile: output profile dict, default load_profile()
+    :return: (wav_files, mp3_files, podcast_file): the PCM outputs, the
+             encoded outputs and the podcast (None if the profile has none)
+    """
     def log(msg):
         logging.info(msg)
         if progress_callback:
             progress_callback(msg)
 
-    audio = AudioSegment.from_wav(wav_path)
-
-    # --- Export H1 ---
-    log("Starting H1 MP3 export...")
-    #h1_audio = audio[0:int(58.833*60*1000)]
-    h1_start_ms = int(6 * 60 * 1000)  # 6 minutes in milliseconds
-    h1_end_ms = int(58.833 * 60 * 1000)  # keep the same length
-    h1_audio = audio[h1_start_ms:h1_end_ms]
-    h1_file = os.path.join(output_dir, f"stevebrown_{get_saturday_before(date_str)}_H1.mp3")
-    h1_audio.export(h1_file, format="mp3", bitrate="320k")
-    log(f"H1 exported: {h1_file}")
-
-    # --- Export Sirius segments ---
-    wav_files = []
-    for seg in SEGMENTS:
-        start_ms = int(seg["start"]*60*1000)
-        end_ms = int(seg["end"]*60*1000)
-        segment_audio = audio[start_ms:end_ms] #+ AudioSegment.silent(duration=SILENCE_MS)
-        wav_file = os.path.join(output_dir, f"stevebrown_{get_saturday_before(date_str)}_{seg['name']}_Sirius.wav")
-        segment_audio.export(wav_file, format="wav")
-        wav_files.append(wav_file)
-        log(f"Sirius segment exported: {wav_file}")
-
-    # --- Export Monday podcast ---
-    podcast_audio = AudioSegment.silent(0)
-    for seg in MONDAY_SEGMENTS:
-        start_ms = int(seg["start"]*60*1000)
-        end_ms = int(seg["end"]*60*1000)
-        podcast_audio += audio[start_ms:end_ms] #+ AudioSegment.silent(duration=SILENCE_MS)
-
-    # Remove extra silence at the start/end and compress long pauses
-    # podcast_audio = effects.strip_silence(
-    #     podcast_audio,
-    #     silence_len=1000,  # minimum silence to consider (ms)
-    #     silence_thresh=-40  # anything quieter than this dBFS is silence
-    # )
-
-    podcast_file = os.path.join(output_dir, f"sbe{get_sbe_number(date_str)}-{format_monday(date_str)}.mp3")
-    podcast_audio.export(podcast_file, format="mp3", bitrate="96k", parameters=["-ar","44100"])
-    log(f"Podcast exported: {podcast_file}")
-
-    # --- ID3 tagging ---
-    log("Applying ID3 tags to Podcast...")
-    if apply_id3_tags(podcast_file, date_str, show_title, guest):
-        log(f"✅ ID3 tags applied to {podcast_file}")
+    if workers is None:
+        workers = RENDER_WORKERS
+    workers = max(1, min(workers, os.cpu_count() or 1))
+
+    if source_ready:
+        source_ready(HEADER_PROBE_BYTES)
+    with WavReader(wav_path) as header:
+        sample_rate = header.sample_rate
+        outputs = build_output_plan(output_dir, date_str, sample_rate, show_title, guest, profile)
+
+        # Source bytes each output needs, up to the end of its last interval
+        # (plus the window searched for silence past it)
+        margin = sample_rate * SNAP_TO_SILENCE_MS // 1000
+        needed = {out["path"]: header.byte_at_frame(max(end for _, end in out["intervals"]) + margin)
+                  for out in outputs}
+
+    if upload:
+        # Fail before rendering rather than after
+        unknown = sorted({site for out in outputs for site in out["deliveries"]} - set(FTP_LOCATIONS))
+        if unknown:
+            raise RuntimeError(f"No FTP_LOCATIONS entry for site(s): {', '.join(unknown)}")
+
+    encoded = [out for out in outputs if out["codec"]]
+    pcm = [out for out in outputs if out["codec"] is None]
+
+    snapped = {}
+    meter = LoudnessMeter(wav_path)
+
+    def normalize(out):
+        """Set the output's gain to reach its loudness target without passing its true-peak ceiling."""
+        target = out.get("loudness")
+        if not target:
+            return
+        with span("loudness", on_span, kind=out["kind"], file=os.path.basename(out["path"])) as s:
+            s.audio_seconds = audio_seconds([out])
+            lufs, peak = meter.measure(out["intervals"])
+        if lufs == float("-inf"):
+            log(f"⚠️ {os.path.basename(out['path'])} is silent, leaving its level alone")
+            return
+        out["gain_db"] = round(min(target["lufs"] - lufs, target["true_peak"] - peak), 2)
+        log(f"🔊 {os.path.basename(out['path'])}: {lufs:.1f} LUFS, {peak:.1f} dBTP, "
+            f"gain {out['gain_db']:+.1f} dB (target {target['lufs']:.1f} LUFS)")
+
+    def prepare(out):
+        """Fit the output's cuts to the audio, once its part of the source is in."""
+        if not SNAP_TO_SILENCE_MS and not (COMPRESS_PODCAST_SILENCE and out["kind"] == "podcast"):
+            return
+        with span("silence", on_span, kind=out["kind"], file=os.path.basename(out["path"])) as s, \
+                WavReader(wav_path) as source:
+            s.audio_seconds = audio_seconds([out])
+            out["intervals"] = refine_intervals(source, out, snapped)
+
+    def audio_seconds(outs):
+        return sum(end - start for out in outs for start, end in out["intervals"]) / sample_rate
+
+    def wait_source(out):
+        if source_ready:
+            with span("wait_source", on_span, kind=out["kind"], file=os.path.basename(out["path"])) as s:
+                s.bytes = needed[out["path"]]
+                source_ready(needed[out["path"]])
+
+    def export_wav(out):
+        wait_source(out)
+        prepare(out)
+        # Opened per output so the mapping covers everything received so far
+        with span("export", on_span, kind=out["kind"], file=os.path.basename(out["path"])) as s, \
+                WavReader(wav_path) as source:
+            s.audio_seconds = audio_seconds([out])
+            digests = Digests()
+            s.bytes = source.write(out["path"], [source.view(start, end) for start, end in out["intervals"]],
+                                   digests)
+        remember_digests(out["path"], digests)
+
+    def from_cache(out):
+        """Copy an encoded output from RENDER_CACHE if it was rendered before; returns (key, hit)."""
+        if not RENDER_CACHE.enabled:
+            return None, False
+        with WavReader(wav_path) as source:
+            key = RENDER_CACHE.key(source, out)
+        if RENDER_CACHE.fetch(key, out["path"]):
+            log(f"♻️ Reused cached render: {os.path.basename(out['path'])}")
+            return key, True
+        return key, False
+
+    def render(out):
+        wait_source(out)
+        prepare(out)
+        with span("encode", on_span, kind=out["kind"], file=os.path.basename(out["path"])) as s:
+            s.audio_seconds = audio_seconds([out])
+            key, hit = from_cache(out)
+            s.fields["cached"] = hit
+            if not hit:
+                normalize(out)
+                render_outputs(wav_path, [out])
+                if key:
+                    RENDER_CACHE.store(key, out["path"])
+            s.bytes = os.path.getsize(out["path"])
+
+    def render_single_pass():
+        """Render every encoded output in one ffmpeg pass, minus cached ones."""
+        for out in encoded:
+            prepare(out)
+        # One span for the whole pass: the outputs share a single ffmpeg process
+        with span("encode", on_span, kind=",".join(out["kind"] for out in encoded)) as s:
+            s.audio_seconds = audio_seconds(encoded)
+            keys = {out["path"]: from_cache(out) for out in encoded}
+            misses = [out for out in encoded if not keys[out["path"]][1]]
+            s.fields["cached"] = len(encoded) - len(misses)
+            if misses:
+                for out in misses:
+                    normalize(out)
+                log(f"Starting single-pass render of {len(misses)} outputs...")
+                render_outputs(wav_path, misses)
+                for out in misses:
+                    if keys[out["path"]][0]:
+                        RENDER_CACHE.store(keys[out["path"]][0], out["path"])
+            s.bytes = sum(os.path.getsize(out["path"]) for out in encoded)
+
+    def finish(out):
+        log(f"{EXPORT_MESSAGES.get(out['kind'], out['kind'] + ' exported')}: {out['path']}")
+
+        # --- ID3 tagging ---
+        if out.get("tags"):
+            log(f"Applying ID3 tags to {os.path.basename(out['path'])}...")
+            with span("tag", on_span, kind=out["kind"], file=os.path.basename(out["path"])) as s:
+                tagged = apply_tag_set(out["path"], out["tags"])
+                s.status = "ok" if tagged else "error"
+            if tagged:
+                log(f"✅ ID3 tags applied to {out['path']}")
+            else:
+                log(f"❌ Failed to apply ID3 tags to {out['path']}")
+
+        if on_output:
+            on_output(out)
+
+    def deliver(out, site):
+        deliver_outputs([out], progress_callback=progress_callback, on_span=on_span, sites=[site])
+
+    # --- Compile the outputs into a task graph ---
+    graph = TaskGraph({"render": workers, "io": IO_WORKERS,
+                       "upload": upload_workers or DELIVERY_WORKERS})
+
+    single_pass = workers == 1 and source_ready is None and len(encoded) > 1
+    if single_pass:
+        graph.add("render", render_single_pass, resource="render")
+
+    if source_ready:
+        # Render in the order the source arrives: S1 is done long before H1 can start
+        order = sorted(outputs, key=lambda out: needed[out["path"]])
     else:
-        log(f"❌ Failed to apply ID3 tags to {podcast_file}")
-
+        # The long MP3 encodes first so they overlap each other
+        order = encoded + pcm
+
+    for out in order:
+        name = os.path.basename(out["path"])
+        if out["codec"] is None:
+            rendered = graph.add(f"export:{name}", lambda out=out: export_wav(out), resource="io")
+        elif single_pass:
+            rendered = "render"
+        else:
+            rendered = graph.add(f"render:{name}", lambda out=out: render(out), resource="render")
+        finished = graph.add(f"tag:{name}", lambda out=out: finish(out), [rendered], resource="io")
+        if upload:
+            for site in out["deliveries"]:
+                graph.add(f"upload:{site}:{name}", lambda out=out, site=site: deliver(out, site),
+                          [finished], resource="upload")
+
+    if single_pass:
+        log(f"Rendering {len(outputs)} outputs ({len(encoded)} in a single ffmpeg pass)...")
+    else:
+        log(f"Starting parallel render of {len(outputs)} outputs ({workers} workers)...")
+    graph.run()
 
-    mp3_files = [h1_file, podcast_file]
+    wav_files = [out["path"] for out in pcm]
+    mp3_files = [out["path"] for out in encoded]
+    podcast_file = next((out["path"] for out in encoded if out["kind"] == "podcast"), None)
 
     return wav_files, mp3_files, podcast_file
 
@@ -434,7 +970,12 @@ def split_and_export(wav_path, output_dir, date_str, show_title="", guest="", ar
 
 #     log("🎉 All uploads complete!")
 
-def upload_files_to_ftp(h1_mp3, wav_files, podcast_file, progress_callback=None, max_retries=3):
+# Concurrent connections per site; override per site with "max_connections" in FTP_LOCATIONS
+SITE_MAX_CONNECTIONS = 1
+
+
+def upload_files_to_ftp(h1_mp3, wav_files, podcast_file, progress_callback=None, max_retries=3, on_span=None,
+                        date_str=None, profile=None):
     """
     Uploads processed files to all configured FTP sites.
     Raises an exception if any upload fails after retries.
@@ -444,6 +985,49 @@ def upload_files_to_ftp(h1_mp3, wav_files, podcast_file, progress_callback=None,
     :param podcast_file: path to podcast MP3
     :param progress_callback: optional function for logging
     :param max_retries: number of retry attempts per file
+    :param on_span: optional callable(event) receiving metrics span events
+    :param date_str: optional show Monday for remote names that need show
+                     fields the file names don't hold
+    :param profile: output profile dict, default load_profile(); the files'
+                    sites and remote names come from its h1, sirius and
+                    podcast outputs
+    :raises ProfileError: if the profile has no output of a file's kind
+    """
+    if profile is None:
+        profile = load_profile()
+    fields = show_fields(date_str) if date_str else None
+    files = [("h1", h1_mp3)] + [("sirius", path) for path in wav_files] + [("podcast", podcast_file)]
+    outputs = [{"kind": kind, "path": path, "deliveries": file_deliveries(profile, kind, path, fields)}
+               for kind, path in files]
+    deliver_outputs(outputs, progress_callback=progress_callback, max_retries=max_retries, on_span=on_span)
+
+    if progress_callback:
+        progress_callback("🎉 All FTP uploads completed successfully!")
+    else:
+        logging.info("🎉 All FTP uploads completed successfully!")
+
+
+def deliver_outputs(outputs, progress_callback=None, max_retries=3, on_span=None, sites=None):
+    """
+    Upload rendered outputs to every site that takes them.
+    Sites are uploaded concurrently; each site uses at most its
+    "max_connections" (default SITE_MAX_CONNECTIONS) parallel connections
+    and its "max_bps" bandwidth, counted across all deliveries running at
+    once on UPLOAD_ENGINE, so single outputs can be sent as soon as they
+    are rendered.
+    Files whose content is already verified on a site (per DELIVERY_MANIFEST)
+    are skipped, so a rerun only sends what is missing. Each delivered file
+    gets a `<name>.sha256` sidecar on the site unless the site's "sidecar"
+    (default CHECKSUM_SIDECARS) is off.
+    Raises an exception if any upload fails after retries.
+
+    :param outputs: output dicts from build_output_plan; each goes to the sites
+                    in its "deliveries", under the remote names listed there
+    :param progress_callback: optional function for logging
+    :param max_retries: number of retry attempts per file
+    :param on_span: optional callable(event) receiving a "site_upload" span per
+                    site and an "upload" span per file transfer attempt
+    :param sites: only upload to these sites (default: all the outputs go to)
     """
     def progress(msg):
         if progress_callback:
@@ -451,99 +1035,183 @@ def upload_files_to_ftp(h1_mp3, wav_files, podcast_file, progress_callback=None,
         else:
             logging.info(msg)
 
-    errors = []
+    single = os.path.basename(outputs[0]["path"]) if len(outputs) == 1 else None
 
-    for site, cfg in FTP_LOCATIONS.items():
-        try:
-            if site == "srn":
-                files_to_upload = [h1_mp3] + wav_files
-                progress(f"Uploading to {site.upper()}...")
-                ftp_upload(files_to_upload, **cfg, max_retries=max_retries, progress=progress)
+    def upload_site(site, cfg, site_deliveries):
+        cfg = dict(cfg)
+        max_connections = max(1, int(cfg.pop("max_connections", SITE_MAX_CONNECTIONS)))
+        max_bps = cfg.pop("max_bps", None)
+        sidecar = cfg.pop("sidecar", CHECKSUM_SIDECARS)
+        site_progress = lambda msg: progress(f"[{site.upper()}] {msg}")
 
-            elif site == "ambos":
-                progress(f"Uploading to {site.upper()} (NONCOM/COM)...")
-                for tag in ["NONCOM", "COM"]:
-                    rename_map = {os.path.basename(h1_mp3): os.path.basename(h1_mp3).replace("_H1.mp3", f"_{tag}.mp3")}
-                    ftp_upload([h1_mp3], **cfg, rename=rename_map, max_retries=max_retries, progress=progress)
+        if single:
+            progress(f"Uploading {single} to {site.upper()}...")
+        else:
+            progress(f"Uploading {len(site_deliveries)} files to {site.upper()}...")
+
+        deliveries = []
+        for local_path, remote_name in site_deliveries:
+            # Hashed only if the rest of the entry matches
+            if DELIVERY_MANIFEST.is_delivered(site, remote_name, lambda: file_sha256(local_path),
+                                              os.path.getsize(local_path), cfg["host"], cfg["remote_dir"]):
+                site_progress(f"⏭ Already delivered, skipping: {remote_name}")
+            else:
+                deliveries.append((local_path, remote_name))
+
+        def record_delivery(file_path, remote_name):
+            DELIVERY_MANIFEST.record(site, remote_name, file_sha256(file_path),
+                                     os.path.getsize(file_path), cfg["host"], cfg["remote_dir"])
+
+        # Every local file is sent once; its extra remote names are created with a server-side copy
+        names = {}
+        for local_path, remote_name in deliveries:
+            names.setdefault(local_path, []).append(remote_name)
+
+        with span("site_upload", on_span, site=site, files=len(deliveries)) as s:
+            s.bytes = sum(os.path.getsize(local_path) for local_path, _ in deliveries)
+            if names:
+                ftp_upload(list(names), **cfg, rename={os.path.basename(f): n for f, n in names.items()},
+                           max_retries=max_retries, progress=site_progress, on_verified=record_delivery,
+                           on_span=with_fields(on_span, site=site), max_connections=max_connections,
+                           max_bps=max_bps, sidecar=sidecar)
+
+        progress(f"{site.upper()} upload complete: {single}" if single else f"{site.upper()} upload complete!")
 
-            elif site == "kln":
-                progress(f"Uploading podcast to {site.upper()}...")
-                ftp_upload([podcast_file], **cfg, max_retries=max_retries, progress=progress)
+    errors = []
 
-        except Exception as e:
-            error_msg = f"❌ FTP upload failed for site {site}: {e}"
-            progress(error_msg)
-            errors.append(error_msg)
+    # Only the sites that take at least one of these outputs, as (local_path, remote_name) pairs
+    targets = {}
+    for out in outputs:
+        for site, names in out["deliveries"].items():
+            if sites is None or site in sites:
+                targets.setdefault(site, []).extend((out["path"], name) for name in names)
+    unknown = sorted(site for site in targets if site not in FTP_LOCATIONS)
+    if unknown:
+        raise RuntimeError(f"No FTP_LOCATIONS entry for site(s): {', '.join(unknown)}")
+    targets = {site: (FTP_LOCATIONS[site], site_deliveries) for site, site_deliveries in targets.items()}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+        futures = {pool.submit(upload_site, site, cfg, site_deliveries): site
+                   for site, (cfg, site_deliveries) in targets.items()}
+        for future in as_completed(futures):
+            site = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                error_msg = f"❌ FTP upload failed for site {site}: {e}"
+                progress(error_msg)
+                errors.append(error_msg)
 
     if errors:
         # Raise an exception if any site failed
         raise RuntimeError("One or more FTP uploads failed:\n" + "\n".join(errors))
 
-    progress("🎉 All FTP uploads completed successfully!")
 
+# Free space left in the ID3v2 tag whenever it has to grow, so later edits
+# to title, guest or artwork are rewritten in place instead of the whole MP3
+ID3_PADDING = 64 * 1024
 
-def apply_id3_tags(mp3_file, date_str, show_title, guest, artwork_path="assets/album_art.png"):
-    """
-    Apply full ID3 tags to the given MP3 file.
+# TXXX frame the render reserves ID3_PADDING with; apply_tag_set turns it into padding
+ID3_PLACEHOLDER = "id3_padding"
 
-    Includes:
-    - Title: SBE number | date | show_title | guest
-    - Artist: Steve Brown
-    - Album: Steve Brown, Etc.
-    - Track: SBE number
-    - Year: current year
-    - Genre: Podcast - Talk
-    - Comment: © & ℗ current year Key Life Network http://www.KeyLife.org
-    - Cover Art (optional)
-    """
+
+def _id3_padding(info):
+    """mutagen padding callback: keep the tag in place while it fits, else grow it with room to spare."""
+    if info.padding >= 0:
+        return info.padding
+    return ID3_PADDING
+
+
+@lru_cache(maxsize=8)
+def _load_artwork(path, mtime_ns, size):
+    with open(path, "rb") as img:
+        return img.read()
+
+
+def _artwork_bytes(path):
+    """Artwork file contents, read once per process (again only if the file changes)."""
     try:
-        # Dynamic values
-        show_number = get_sbe_number(date_str)
-        sunday_date = get_sunday_before(date_str)  # e.g., "May 25, 2025"
-        current_year = str(datetime.now().year)
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _load_artwork(os.path.abspath(path), st.st_mtime_ns, st.st_size)
 
- 
-        # Extract year from the date_str
-        dt = datetime.strptime(date_str, "%m-%d-%y")
-        year_from_date = dt.year  # 4-digit year
 
-        title_text = f"SBE{show_number} | {sunday_date} | {show_title} | {guest}"
-        comment_text = f"© & ℗ {year_from_date} Key Life Network http://www.KeyLife.org"
+# ID3 frame for each field of a profile tag set
+ID3_FRAMES = {
+    "title": TIT2,
+    "artist": TPE1,
+    "album": TALB,
+    "track": TRCK,
+    "year": TDRC,
+    "genre": TCON,
+}
 
+
+def apply_tag_set(mp3_file, tags):
+    """
+    Write a profile tag set (values already filled in) to an MP3 file.
+
+    :param tags: dict with any of the ID3_FRAMES fields, "comment" and
+                 "artwork" (path to a PNG cover)
+    :return: True on success, False if tagging failed (the error is logged)
+    """
+    try:
         # Load existing tags or create new
         try:
             audio = ID3(mp3_file)
         except ID3NoHeaderError:
             audio = ID3()
+        audio.delall(f"TXXX:{ID3_PLACEHOLDER}")
 
-        # --- Set core metadata ---
-        audio.add(TIT2(encoding=3, text=title_text))    # Title
-        audio.add(TPE1(encoding=3, text="Steve Brown")) # Artist
-        audio.add(TALB(encoding=3, text="Steve Brown, Etc."))  # Album
-        audio.add(TRCK(encoding=3, text=str(show_number)))      # Track
-        audio.add(TDRC(encoding=3, text=str(year_from_date)))         # Year
-        audio.add(TCON(encoding=3, text="Podcast - Talk"))     # Genre
-        #audio.add(COMM(encoding=3, desc="Comment", text=comment_text))  # Comment
-        #audio.add(COMM(encoding=1, lang="eng", desc="Comment", text=comment_text))
+        for field, frame in ID3_FRAMES.items():
+            if tags.get(field):
+                audio.add(frame(encoding=3, text=tags[field]))
 
         # Comment frame — use UTF-16 for Mp3tag compatibility
-        audio.add(COMM(encoding=1, lang="eng", desc="", text=comment_text))
+        if tags.get("comment"):
+            audio.add(COMM(encoding=1, lang="eng", desc="", text=tags["comment"]))
 
         # --- Embed album art ---
-        if os.path.exists(artwork_path):
-            with open(artwork_path, "rb") as img:
-                audio.add(APIC(
-                    encoding=3,
-                    mime="image/png",
-                    type=3,       # front cover
-                    desc="Cover",
-                    data=img.read()
-                ))
-
-        # Save all tags
-        audio.save(mp3_file)
+        artwork = _artwork_bytes(tags["artwork"]) if tags.get("artwork") else None
+        if artwork is not None:
+            audio.add(APIC(
+                encoding=3,
+                mime="image/png",
+                type=3,       # front cover
+                desc="Cover",
+                data=artwork
+            ))
+
+        # Save all tags; only the tag is rewritten as long as it fits its padding
+        audio.save(mp3_file, padding=_id3_padding)
         return True
 
     except Exception as e:
         logging.error(f"Error applying ID3 tags to {mp3_file}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def apply_id3_tags(mp3_file, date_str, show_title, guest, artwork_path="assets/album_art.png"):
+    """
+    Apply the podcast tag set of DEFAULT_PROFILE to the given MP3 file.
+
+    Includes:
+    - Title: SBE number | date | show_title | guest
+    - Artist: Steve Brown
+    - Album: Steve Brown, Etc.
+    - Track: SBE number
+    - Year: year of the show
+    - Genre: Podcast - Talk
+    - Comment: © & ℗ year of the show Key Life Network http://www.KeyLife.org
+    - Cover Art (optional)
+    """
+    try:
+        fields = show_fields(date_str, show_title, guest)
+    except ValueError as e:
+        logging.error(f"Error applying ID3 tags to {mp3_file}: {e}")
+        return False
+
+    tags = {field: value.format(**fields) for field, value in DEFAULT_PROFILE["tags"]["podcast"].items()}
+    tags["artwork"] = artwork_path
+    return apply_tag_set(mp3_file, tags)
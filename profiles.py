@@ -0,0 +1,245 @@
+"""
+Output profiles: which files are rendered for a show, how they are encoded
+and tagged, and which sites receive them under which names.
+
+A profile is plain data, so adding an affiliate or a format is a config
+change. Profiles are read from PROFILES_PATH, a JSON object of named
+profiles, e.g.:
+
+    {
+      "default": {
+        "encodings": {"mp3_320": ["-c:a", "libmp3lame", "-b:a", "320k"], "wav": null},
+        "tags": {"podcast": {"title": "SBE{sbe} | {sunday} | {show_title} | {guest}", ...}},
+        "outputs": [
+          {"kind": "h1", "segments": "H1", "file": "stevebrown_{saturday}_H1.mp3",
+           "encoding": "mp3_320",
+           "sites": {"srn": ["{file}"], "ambos": ["stevebrown_{saturday}_COM.mp3"]}},
+          ...
+        ]
+      }
+    }
+
+Every output names a segment table ("H1", "SEGMENTS", "MONDAY_SEGMENTS" or
+one of the profile's own "segments"), an encoding (null = straight PCM
+copy) and optionally a tag set and a loudness target. With "each_segment"
+it yields one file per segment of its table. File names, remote names and
+tag values are str.format templates over the show fields (saturday,
+sunday, monday, sbe, year, date_str, show_title, guest), plus segment and
+file. PROFILE picks the profile; without a file the built-in
+DEFAULT_PROFILE is used.
+"""
+import os
+import re
+import json
+import copy
+import string
+import logging
+
+
+PROFILES_PATH = os.environ.get("PROFILES_PATH", "config/profiles.json")
+PROFILE = os.environ.get("PROFILE", "default")
+
+
+class ProfileError(Exception):
+    """Raised for a profile that is missing or refers to something it does not define."""
+
+
+# What the station has always delivered: H1 to SRN and (twice) to AMBOS,
+# the Sirius segments to SRN and the tagged Monday podcast to KLN
+DEFAULT_PROFILE = {
+    "encodings": {
+        "mp3_320": ["-c:a", "libmp3lame", "-b:a", "320k"],
+        "mp3_96": ["-c:a", "libmp3lame", "-b:a", "96k", "-ar", "44100"],
+        "wav": None,
+    },
+    "tags": {
+        "podcast": {
+            "title": "SBE{sbe} | {sunday} | {show_title} | {guest}",
+            "artist": "Steve Brown",
+            "album": "Steve Brown, Etc.",
+            "track": "{sbe}",
+            "year": "{year}",
+            "genre": "Podcast - Talk",
+            "comment": "© & ℗ {year} Key Life Network http://www.KeyLife.org",
+            "artwork": "assets/album_art.png",
+        },
+    },
+    "outputs": [
+        {
+            "kind": "h1",
+            "segments": "H1",
+            "file": "stevebrown_{saturday}_H1.mp3",
+            "encoding": "mp3_320",
+            "sites": {
+                "srn": ["{file}"],
+                "ambos": ["stevebrown_{saturday}_NONCOM.mp3", "stevebrown_{saturday}_COM.mp3"],
+            },
+        },
+        {
+            "kind": "sirius",
+            "segments": "SEGMENTS",
+            "each_segment": True,
+            "file": "stevebrown_{saturday}_{segment}_Sirius.wav",
+            "encoding": "wav",
+            "sites": {"srn": ["{file}"]},
+        },
+        {
+            "kind": "podcast",
+            "segments": "MONDAY_SEGMENTS",
+            "file": "sbe{sbe}-{monday}.mp3",
+            "encoding": "mp3_96",
+            "tags": "podcast",
+            "sites": {"kln": ["{file}"]},
+        },
+    ],
+}
+
+
+def load_profile(name=None, path=None):
+    """
+    Read a profile by name (default PROFILE) from PROFILES_PATH.
+
+    :raises ProfileError: if the file exists but does not define the profile,
+                          or a non-default profile is asked for without a file
+    """
+    name = name or PROFILE
+    path = path or PROFILES_PATH
+    try:
+        with open(path) as f:
+            profiles = json.load(f)
+    except FileNotFoundError:
+        profiles = {}
+    except ValueError as e:
+        raise ProfileError(f"Invalid profiles file {path}: {e}")
+
+    if name in profiles:
+        return profiles[name]
+    if name == "default":
+        return copy.deepcopy(DEFAULT_PROFILE)
+    raise ProfileError(f"No profile named {name!r} in {path}")
+
+
+def _format(template, fields, what):
+    try:
+        return template.format(**fields)
+    except (KeyError, IndexError) as e:
+        raise ProfileError(f"Unknown field {e} in {what} {template!r}")
+
+
+def compile_outputs(profile, output_dir, fields, tables):
+    """
+    Expand a profile into the concrete outputs of one show.
+
+    :param fields: show fields for the templates (see the module docstring)
+    :param tables: built-in segment tables by name, each a list of
+                   {"start", "end"[, "name"]} in minutes; the profile's own
+                   "segments" take precedence
+    :return: list of dicts with kind, name (segment, if any), path,
+             segments [(start_min, end_min)], codec (None = PCM copy),
+             tags (tag set with its values filled in, or None), loudness
+             (target from the profile, or None) and deliveries
+             ({site: [remote names]})
+    :raises ProfileError: for references to undefined encodings, tag sets
+                          or segment tables, unknown template fields, or two
+                          outputs writing the same file
+    """
+    tables = dict(tables, **profile.get("segments", {}))
+    encodings = profile.get("encodings", {})
+    tag_sets = profile.get("tags", {})
+
+    outputs = []
+    for spec in profile.get("outputs", []):
+        kind = spec.get("kind")
+        if not kind or "file" not in spec:
+            raise ProfileError(f"Output without a kind or file: {spec}")
+        if spec.get("segments") not in tables:
+            raise ProfileError(f"Unknown segment table {spec.get('segments')!r} for {kind}")
+        if spec.get("encoding") not in encodings:
+            raise ProfileError(f"Unknown encoding {spec.get('encoding')!r} for {kind}")
+        if spec.get("tags") and spec["tags"] not in tag_sets:
+            raise ProfileError(f"Unknown tag set {spec['tags']!r} for {kind}")
+
+        table = tables[spec["segments"]]
+        groups = [[seg] for seg in table] if spec.get("each_segment") else [table]
+        for group in groups:
+            out_fields = dict(fields, segment=group[0].get("name", "") if len(group) == 1 else "")
+            out_fields["file"] = _format(spec["file"], out_fields, "file name")
+
+            tags = None
+            if spec.get("tags"):
+                tags = {frame: _format(value, out_fields, "tag") if frame != "artwork" else value
+                        for frame, value in tag_sets[spec["tags"]].items()}
+
+            outputs.append({
+                "kind": kind,
+                "name": out_fields["segment"],
+                "path": os.path.join(output_dir, out_fields["file"]),
+                "segments": [(seg["start"], seg["end"]) for seg in group],
+                "codec": encodings[spec["encoding"]],
+                "tags": tags,
+                "loudness": spec.get("loudness"),
+                "deliveries": {site: [_format(name, out_fields, "remote name") for name in names]
+                               for site, names in spec.get("sites", {}).items()},
+            })
+
+    paths = [out["path"] for out in outputs]
+    duplicates = sorted({path for path in paths if paths.count(path) > 1})
+    if duplicates:
+        raise ProfileError(f"Several outputs write {', '.join(duplicates)}")
+    return outputs
+
+
+def _fields_from_name(template, name):
+    """The template fields a file name holds, e.g. saturday from "stevebrown_{saturday}_H1.mp3"; None if it doesn't fit."""
+    pattern = ""
+    for literal, field, _, _ in string.Formatter().parse(template):
+        pattern += re.escape(literal)
+        if field is None:
+            continue
+        if not field.isidentifier():
+            return None
+        pattern += f"(?P={field})" if f"(?P<{field}>" in pattern else f"(?P<{field}>.+?)"
+    match = re.fullmatch(pattern, name)
+    return match.groupdict() if match else None
+
+
+def file_deliveries(profile, kind, path, fields=None):
+    """
+    Sites and remote names of an already rendered file of the given kind.
+
+    The remote name templates are filled in with `fields` (show fields) and
+    whatever the file name holds for the output's file template, so a file
+    named by the profile needs no show date; {file} is the file's own name.
+    A file named some other way still goes to the kind's sites: under its
+    own name wherever a remote name needs fields that aren't known.
+
+    :return: {site: [remote names]}
+    :raises ProfileError: if the profile has no output of that kind
+    """
+    specs = [spec for spec in profile.get("outputs", []) if spec.get("kind") == kind]
+    if not specs:
+        raise ProfileError(f"No {kind} output in the profile")
+
+    name = os.path.basename(path)
+    matches = [(spec, _fields_from_name(spec.get("file", ""), name)) for spec in specs]
+    spec, parsed = next(((spec, parsed) for spec, parsed in matches if parsed is not None), (specs[0], None))
+    out_fields = dict(fields or {}, segment="")
+    out_fields.update(parsed or {}, file=name)
+
+    deliveries = {}
+    for site, names in spec.get("sites", {}).items():
+        remotes = []
+        for remote in names:
+            try:
+                remote = _format(remote, out_fields, "remote name")
+            except ProfileError:
+                if parsed is not None or fields is not None:
+                    raise
+                remote = name
+            if remote not in remotes:
+                remotes.append(remote)
+        deliveries[site] = remotes
+    if parsed is None:
+        logging.warning(f"{name} does not fit the file name of any {kind} output; "
+                        f"delivering to {', '.join(deliveries) or 'no sites'}")
+    return deliveries
@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+
+# Bump when the render graph changes in a way that alters output bytes
+RENDER_CACHE_VERSION = 4
+
+
+class RenderCache:
+    """
+    Content-addressed store of encoded outputs.
+
+    An entry is keyed on a hash of the source audio an output reads (the
+    PCM inside its intervals, plus the source format), the interval
+    boundaries (in frames), the ffmpeg codec arguments and any loudness target.
+    Re-uploading the same WAV, or rerunning a show to fix its metadata,
+    turns the encode into a file copy. Entries are files in `directory`;
+    the least recently used are evicted once the total passes `max_bytes`
+    (0 disables the cache).
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, source, out):
+        """
+        Cache key for rendering `out` from an open WavReader.
+
+        Only the output's own intervals are hashed, so the key can be computed
+        as soon as those bytes have arrived, before the whole source is in.
+        """
+        fmt = {name: source.format[name] for name in ("format_tag", "channels", "sample_rate", "sample_width")}
+        params = {
+            "version": RENDER_CACHE_VERSION,
+            "format": fmt,
+            "intervals": out["intervals"],
+            "codec": out["codec"],
+        }
+        # The gain follows from the audio and the target, so the target is enough
+        if out.get("loudness"):
+            params["loudness"] = out["loudness"]
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+
+        for start, end in out["intervals"]:
+            view = source.view(start, end)
+            try:
+                digest.update(view)
+            finally:
+                view.release()
+        return digest.hexdigest() + os.path.splitext(out["path"])[1]
+
+    def fetch(self, key, dest_path):
+        """Copy a cached render to dest_path; returns False on a miss."""
+        if not self.enabled:
+            return False
+        entry = os.path.join(self.directory, key)
+        try:
+            shutil.copyfile(entry, dest_path)
+            os.utime(entry)   # mtime doubles as the LRU timestamp
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, path):
+        """Add a finished render to the cache, evicting old entries to stay under max_bytes."""
+        if not self.enabled:
+            return
+        entry = os.path.join(self.directory, key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, entry)
+            self._evict()
+        except OSError as e:
+            # The cache is an optimisation only; never fail a render over it
+            logging.warning(f"Could not cache render {path}: {e}")
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
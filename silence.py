@@ -0,0 +1,119 @@
+import numpy as np
+
+from wavfile import WAVE_FORMAT_IEEE_FLOAT
+
+
+# Resolution of the level analysis
+WINDOW_MS = 10
+
+# Windows converted to float per step; small enough to stay in the CPU cache
+BLOCK_WINDOWS = 500
+
+
+def pcm_samples(view, fmt):
+    """
+    Samples of a WavReader view as a flat float32 array, unscaled.
+
+    :return: (samples, full_scale) where full_scale is the magnitude of 0 dBFS
+    """
+    channels, width = fmt["channels"], fmt["sample_width"]
+    raw = np.frombuffer(view, dtype=np.uint8)
+    if fmt["block_align"] != channels * width:
+        # Padded frames: keep only the sample bytes of each one
+        raw = np.ascontiguousarray(raw.reshape(-1, fmt["block_align"])[:, :channels * width]).reshape(-1)
+
+    if fmt["format_tag"] == WAVE_FORMAT_IEEE_FLOAT:
+        return raw.view("<f4" if width == 4 else "<f8").astype(np.float32), 1.0
+    if width == 1:
+        return raw.astype(np.float32) - 128, 128.0
+    if width == 3:
+        triples = raw.reshape(-1, 3).astype(np.int32)
+        ints = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        return np.where(ints & 0x800000, ints - 0x1000000, ints).astype(np.float32), float(2 ** 23)
+    return raw.view(f"<i{width}").astype(np.float32), float(2 ** (8 * width - 1))
+
+
+def window_frames(reader, window_ms=WINDOW_MS):
+    return max(1, reader.sample_rate * window_ms // 1000)
+
+
+def window_levels(reader, start, end, window_ms=WINDOW_MS):
+    """
+    RMS level in dBFS of consecutive window_ms windows of frames [start, end),
+    all channels together. A trailing partial window is dropped.
+
+    :param reader: open WavReader
+    :return: float32 numpy array, one level per window
+    """
+    frames = window_frames(reader, window_ms)
+    start, end = max(0, start), min(end, reader.frames)
+
+    power = []
+    for pos in range(start, end, frames * BLOCK_WINDOWS):
+        count = min(BLOCK_WINDOWS, (end - pos) // frames)
+        if count <= 0:
+            break
+        view = reader.view(pos, pos + count * frames)
+        try:
+            samples, full_scale = pcm_samples(view, reader.format)
+        finally:
+            view.release()
+        samples = samples.reshape(count, -1)
+        power.append(np.einsum("ij,ij->i", samples, samples) / (samples.shape[1] * full_scale ** 2))
+
+    if not power:
+        return np.zeros(0, dtype=np.float32)
+    return 10 * np.log10(np.maximum(np.concatenate(power), 1e-10))
+
+
+def silent_runs(levels, threshold_db, min_windows):
+    """[(first, end)) window index ranges of at least min_windows windows below threshold_db."""
+    quiet = np.concatenate(([False], levels < threshold_db, [False]))
+    edges = np.flatnonzero(quiet[1:] != quiet[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    keep = ends - starts >= max(1, min_windows)
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+def snap_to_silence(reader, frame, tolerance_ms, threshold_db, min_silence_ms, window_ms=WINDOW_MS):
+    """
+    Move a cut point to the middle of the nearest silence within tolerance_ms of it.
+
+    :return: the new cut frame, or `frame` unchanged when no gap of at
+             least min_silence_ms is found in the window
+    """
+    tolerance = reader.sample_rate * tolerance_ms // 1000
+    lo = max(0, frame - tolerance)
+    levels = window_levels(reader, lo, frame + tolerance, window_ms)
+    runs = silent_runs(levels, threshold_db, -(-min_silence_ms // window_ms))
+    if not runs:
+        return frame
+
+    step = window_frames(reader, window_ms)
+    gaps = [(lo + first * step, lo + end * step) for first, end in runs]
+    # Distance to a gap; 0 when the cut already falls inside it
+    start, end = min(gaps, key=lambda gap: max(gap[0] - frame, frame - gap[1], 0))
+    return (start + end) // 2
+
+
+def compress_silences(reader, intervals, max_pause_ms, threshold_db, window_ms=WINDOW_MS):
+    """
+    Shorten every pause longer than max_pause_ms inside the given cuts to max_pause_ms.
+
+    The pause is cut out of its middle, so the speech on both sides keeps
+    its natural tail and lead-in.
+
+    :param intervals: list of (start_frame, end_frame) cuts
+    :return: the cuts with the long pauses taken out, as a new list
+    """
+    step = window_frames(reader, window_ms)
+    keep = reader.sample_rate * max_pause_ms // 1000 // 2
+    result = []
+    for start, end in intervals:
+        levels = window_levels(reader, start, end, window_ms)
+        cursor = start
+        for first, last in silent_runs(levels, threshold_db, 2 * keep // step + 1):
+            result.append((cursor, start + first * step + keep))
+            cursor = start + last * step - keep
+        result.append((cursor, end))
+    return result
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class SkippedTask(Exception):
+    """Recorded for a task that never ran because one of its dependencies failed."""
+
+
+class TaskGraph:
+    """
+    Tasks with dependencies, each started as soon as everything it depends on is done.
+
+    Every task draws on a named resource with a fixed number of slots (e.g.
+    "render" for ffmpeg, "upload" for transfers), so a long encode never
+    holds up an upload that is ready to go and vice versa. Ready tasks start
+    in the order they were added, which is how callers set priorities.
+    A failed task skips the tasks that depend on it; the rest of the graph
+    still runs to the end.
+    """
+
+    def __init__(self, limits):
+        """:param limits: dict of resource name -> tasks of that resource run at once"""
+        self.limits = {resource: max(1, int(n)) for resource, n in limits.items()}
+        self._tasks = {}   # name -> (fn, deps, resource), in insertion order
+
+    def add(self, name, fn, deps=(), resource=None):
+        """
+        Add a task; its dependencies must already be in the graph.
+
+        :param resource: one of the limits' keys (default: the first one)
+        :return: name, to be used in later tasks' deps
+        """
+        if name in self._tasks:
+            raise ValueError(f"Duplicate task: {name}")
+        missing = [dep for dep in deps if dep not in self._tasks]
+        if missing:
+            raise ValueError(f"Task {name} depends on unknown tasks: {', '.join(missing)}")
+        resource = resource or next(iter(self.limits))
+        if resource not in self.limits:
+            raise ValueError(f"Unknown resource for task {name}: {resource}")
+        self._tasks[name] = (fn, tuple(deps), resource)
+        return name
+
+    def run(self):
+        """
+        Run every task; blocks until the graph is finished.
+
+        :raises: the task's own exception if exactly one task failed,
+                 RuntimeError listing them if several did
+        """
+        pending = list(self._tasks)
+        done, failed = set(), {}
+        running = {}   # future -> name
+        busy = dict.fromkeys(self.limits, 0)
+
+        with ThreadPoolExecutor(max_workers=sum(self.limits.values())) as pool:
+            while pending or running:
+                # Deps come before their dependents, so one pass settles each wave
+                for name in list(pending):
+                    fn, deps, resource = self._tasks[name]
+                    if any(dep in failed for dep in deps):
+                        failed[name] = SkippedTask(name)
+                        pending.remove(name)
+                    elif all(dep in done for dep in deps) and busy[resource] < self.limits[resource]:
+                        busy[resource] += 1
+                        running[pool.submit(fn)] = name
+                        pending.remove(name)
+
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    busy[self._tasks[name][2]] -= 1
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as e:
+                        failed[name] = e
+
+        errors = [(name, e) for name, e in failed.items() if not isinstance(e, SkippedTask)]
+        if len(errors) == 1:
+            raise errors[0][1]
+        if errors:
+            raise RuntimeError("\n".join(f"{name}: {e}" for name, e in errors))
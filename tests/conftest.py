@@ -0,0 +1,62 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wavfile import build_header, WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT
+
+try:
+    import config.settings  # noqa: F401
+except ModuleNotFoundError:
+    # Outside the app container there is no config/settings.py; tests that
+    # need sites patch FTP_LOCATIONS themselves.
+    config = types.ModuleType("config")
+    config.settings = types.ModuleType("config.settings")
+    config.settings.FTP_LOCATIONS = {}
+    sys.modules["config"] = config
+    sys.modules["config.settings"] = config.settings
+
+
+def pcm_bytes(samples, width, float_format=False):
+    """Interleaved little-endian PCM of float samples in [-1, 1], shape (frames, channels)."""
+    samples = np.asarray(samples, dtype=np.float64)
+    if float_format:
+        return samples.astype("<f4" if width == 4 else "<f8").tobytes()
+    if width == 1:
+        return (np.round(samples * 127) + 128).astype(np.uint8).tobytes()
+    full_scale = 2 ** (8 * width - 1)
+    ints = np.clip(np.round(samples * full_scale), -full_scale, full_scale - 1).astype(np.int64)
+    if width == 3:
+        raw = ints.astype("<i4").reshape(-1, 1).view(np.uint8).reshape(-1, 4)[:, :3]
+        return raw.tobytes()
+    return ints.astype(f"<i{width}").tobytes()
+
+
+@pytest.fixture
+def make_wav(tmp_path):
+    """make_wav(samples, rate=48000, width=2, float_format=False, name=...) -> path of a new WAV file."""
+    def make(samples, rate=48000, width=2, float_format=False, name="source.wav"):
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        fmt = {
+            "format_tag": WAVE_FORMAT_IEEE_FLOAT if float_format else WAVE_FORMAT_PCM,
+            "channels": samples.shape[1],
+            "sample_rate": rate,
+            "sample_width": width,
+            "block_align": width * samples.shape[1],
+        }
+        data = pcm_bytes(samples, width, float_format)
+        path = tmp_path / name
+        path.write_bytes(build_header(fmt, len(data)) + data)
+        return str(path)
+    return make
+
+
+def sine(freq, seconds, rate=48000, dbfs=0.0):
+    t = np.arange(int(seconds * rate)) / rate
+    return 10 ** (dbfs / 20) * np.sin(2 * np.pi * freq * t)
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from events import EventBroker, END_OF_STREAM
+
+
+@pytest.fixture
+def broker(tmp_path):
+    return EventBroker(str(tmp_path / "jobs.db"), keepalive=0.05)
+
+
+def test_subscribe_replays_after_the_last_event_id(broker):
+    broker.publish("job", "one")
+    broker.publish("job", '{"stage": "render"}', "span")
+    broker.publish("job", "two")
+    broker.publish("job", END_OF_STREAM)
+
+    assert list(broker.subscribe("job", after=1)) == [(2, "span", '{"stage": "render"}'), (3, None, "two"),
+                                                      (4, None, END_OF_STREAM)]
+
+
+def test_a_restarted_broker_rebuilds_logs_from_sqlite(broker, tmp_path):
+    broker.publish("job", "one")
+    broker.publish("job", END_OF_STREAM)
+
+    restarted = EventBroker(str(tmp_path / "jobs.db"))
+
+    assert restarted.has_events("job")
+    assert [seq for seq, _, _ in restarted.subscribe("job")] == [1, 2]
+    assert restarted.publish("job", "again") == 3
+
+
+def test_subscribers_wake_on_publish_and_get_keepalives(broker):
+    received = []
+
+    def listen():
+        for event in broker.subscribe("job"):
+            received.append(event)
+
+    listener = threading.Thread(target=listen)
+    listener.start()
+    threading.Event().wait(0.12)
+    broker.publish("job", "hello")
+    broker.publish("job", END_OF_STREAM)
+    listener.join(5)
+
+    assert not listener.is_alive()
+    assert None in received
+    assert [e for e in received if e is not None] == [(1, None, "hello"), (2, None, END_OF_STREAM)]
+
+
+def test_logs_of_finished_jobs_are_not_cached(broker, tmp_path):
+    # A job that died without END_OF_STREAM, and one whose events expired
+    broker.publish("crashed", "one")
+    restarted = EventBroker(str(tmp_path / "jobs.db"), keepalive=0.05)
+
+    assert list(restarted.subscribe("crashed", finished=True)) == [(1, None, "one")]
+    assert not restarted.has_events("expired")
+    assert list(restarted.subscribe("expired", finished=True)) == []
+    assert restarted._logs == {}
+
+
+def test_live_logs_stay_cached_for_new_events(broker):
+    broker.publish("job", "one")
+    assert broker.has_events("job")
+    assert "job" in broker._logs
+    assert not broker.has_events("other")
+    assert "other" not in broker._logs
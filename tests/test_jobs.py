@@ -0,0 +1,92 @@
+import time
+import threading
+
+import pytest
+
+from jobs import JobStore, JobScheduler, JobQueueFull, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "state" / "jobs.db"))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_store_keeps_params_status_and_attempts(store):
+    store.create("a", {"date_str": "10-13-25"})
+    assert store.get("a")["status"] == QUEUED
+    assert store.get("a")["params"] == {"date_str": "10-13-25"}
+
+    store.mark_running("a")
+    store.mark_finished("a", "boom")
+    job = store.get("a")
+    assert (job["status"], job["error"], job["attempts"]) == (FAILED, "boom", 1)
+    assert store.get("missing") is None
+
+
+def test_unfinished_jobs_are_listed_oldest_first(store):
+    for job_id in ("a", "b", "c"):
+        store.create(job_id, {})
+    store.mark_running("b")
+    store.mark_finished("c")
+
+    assert store.unfinished() == ["a", "b"]
+    assert store.get("b")["status"] == RUNNING
+
+
+def test_average_duration_counts_successful_jobs_only(store):
+    assert store.average_duration() is None
+    with store._connect() as db:
+        db.executemany("INSERT INTO jobs (id, status, params, created, started, finished) VALUES (?, ?, '{}', 0, ?, ?)",
+                       [("a", DONE, 0, 10), ("b", DONE, 0, 30), ("c", FAILED, 0, 1000)])
+    assert store.average_duration() == 20
+
+
+def test_scheduler_runs_jobs_and_records_failures(store):
+    def handler(job_id, params):
+        if params.get("fail"):
+            raise ValueError()
+
+    scheduler = JobScheduler(store, handler, workers=2)
+    scheduler.start()
+    ok = scheduler.submit({})
+    bad = scheduler.submit({"fail": True})
+    wait_for(lambda: scheduler.pending == 0)
+
+    assert store.get(ok)["status"] == DONE
+    assert (store.get(bad)["status"], store.get(bad)["error"]) == (FAILED, "ValueError")
+
+
+def test_submit_refuses_jobs_past_max_pending(store):
+    release = threading.Event()
+    scheduler = JobScheduler(store, lambda job_id, params: release.wait(5), workers=1, max_pending=2)
+    scheduler.start()
+    scheduler.submit({})
+    scheduler.submit({})
+
+    with pytest.raises(JobQueueFull) as e:
+        scheduler.submit({})
+    # 60 s default per job; two waves ahead of a new job with one worker
+    assert e.value.retry_after == 120
+    release.set()
+    wait_for(lambda: scheduler.pending == 0)
+
+
+def test_start_resumes_interrupted_jobs(store):
+    store.create("queued", {"n": 1})
+    store.create("interrupted", {"n": 2})
+    store.mark_running("interrupted")
+    seen = []
+
+    scheduler = JobScheduler(store, lambda job_id, params: seen.append(params["n"]), workers=1)
+    scheduler.start()
+    wait_for(lambda: scheduler.pending == 0)
+
+    assert seen == [1, 2]
+    assert store.get("interrupted")["attempts"] == 2
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from conftest import sine
+from loudness import LoudnessMeter, _k_weighting_biquads, k_weighting
+
+
+def test_k_weighting_matches_the_bs1770_coefficients_at_48k():
+    (shelf_b, shelf_a), (highpass_b, highpass_a) = _k_weighting_biquads(48000)
+
+    assert shelf_b == pytest.approx([1.53512485958697, -2.69169618940638, 1.19839281085285], abs=1e-9)
+    assert shelf_a == pytest.approx([1.0, -1.69065929318241, 0.73248077421585], abs=1e-9)
+    assert highpass_b == pytest.approx([1.0, -2.0, 1.0])
+    assert highpass_a == pytest.approx([1.0, -1.99004745483398, 0.99007225036621], abs=1e-9)
+
+
+def test_impulse_response_has_died_away():
+    taps = k_weighting(48000)
+    assert np.abs(taps[-100:]).max() < 1e-10
+
+
+@pytest.mark.parametrize("freq", [997, 1000])
+def test_calibration_tone_mono(make_wav, freq):
+    # BS.1770: a 0 dBFS 997 Hz sine on one channel reads -3.01 LKFS
+    path = make_wav(sine(freq, 10, dbfs=-20), width=3)
+    integrated, _ = LoudnessMeter(path).measure([(0, 480000)])
+    assert integrated == pytest.approx(-23.01, abs=0.1)
+
+
+def test_calibration_tone_stereo(make_wav):
+    tone = sine(997, 10, dbfs=-20)
+    path = make_wav(np.stack([tone, tone], axis=1), width=3)
+    integrated, _ = LoudnessMeter(path).measure([(0, 480000)])
+    assert integrated == pytest.approx(-20.0, abs=0.1)
+
+
+def test_true_peak_of_a_sine(make_wav):
+    path = make_wav(sine(997, 5, dbfs=-6), float_format=True, width=4)
+    _, true_peak = LoudnessMeter(path).measure([(0, 240000)])
+    assert true_peak == pytest.approx(-6.0, abs=0.1)
+
+
+def test_silence_is_minus_infinity(make_wav):
+    path = make_wav(np.zeros(48000 * 2))
+    assert LoudnessMeter(path).measure([(0, 96000)]) == (float("-inf"), float("-inf"))
+
+
+def test_partial_chunk_at_the_end_of_the_source(make_wav):
+    # 7 s: the second 5 s chunk of sub-blocks is only partly there
+    path = make_wav(sine(997, 7, dbfs=-20))
+    meter = LoudnessMeter(path)
+    integrated, _ = meter.measure([(0, 7 * 48000)])
+    assert integrated == pytest.approx(-23.01, abs=0.1)
+
+
+def test_cut_measured_on_the_sub_blocks_it_contains(make_wav):
+    quiet, loud = sine(997, 5, dbfs=-40), sine(997, 5, dbfs=-20)
+    path = make_wav(np.concatenate([quiet, loud]))
+    meter = LoudnessMeter(path)
+    assert meter.measure([(240000, 480000)])[0] == pytest.approx(-23.01, abs=0.1)
+    assert meter.measure([(0, 240000)])[0] == pytest.approx(-43.01, abs=0.1)
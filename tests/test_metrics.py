@@ -0,0 +1,42 @@
+import pytest
+
+from metrics import Metrics, span, with_fields, current_rss_kb
+
+
+def test_span_reports_throughput_and_memory():
+    events = []
+    with span("encode", events.append, kind="h1") as s:
+        s.bytes = 10 ** 6
+        s.audio_seconds = 60
+        block = b"x" * (64 * 1024 * 1024)
+
+    event = events[0]
+    assert (event["span"], event["kind"], event["status"], event["bytes"]) == ("encode", "h1", "ok", 10 ** 6)
+    assert event["mb_per_s"] > 0 and event["realtime"] > 0
+    assert event["process_peak_rss_kb"] > 0
+    if current_rss_kb() is not None:
+        # The touched 64 MiB is still held when the span ends
+        assert event["rss_end_kb"] - event["rss_start_kb"] >= 60 * 1024
+    del block
+
+
+def test_failed_span_is_reported_and_reraised():
+    events = []
+    with pytest.raises(ValueError):
+        with span("upload", with_fields(events.append, site="srn")):
+            raise ValueError()
+    assert (events[0]["status"], events[0]["site"]) == ("error", "srn")
+
+
+def test_render_exports_histograms_and_gauges():
+    metrics = Metrics()
+    metrics.observe({"span": "upload", "site": "srn", "status": "ok", "duration": 2.0, "bytes": 100})
+    metrics.observe({"span": "upload", "site": "srn", "status": "ok", "duration": 40.0, "bytes": 50})
+    metrics.gauge("pipeline_jobs_pending", "Jobs queued or running.", lambda: 3)
+
+    text = metrics.render()
+
+    assert 'pipeline_span_seconds_bucket{span="upload",site="srn",status="ok",le="5"} 1' in text
+    assert 'pipeline_span_seconds_count{span="upload",site="srn",status="ok"} 2' in text
+    assert 'pipeline_span_bytes_total{span="upload",site="srn",status="ok"} 150' in text
+    assert "pipeline_jobs_pending 3" in text
@@ -0,0 +1,83 @@
+import copy
+import json
+
+import pytest
+
+import processor
+from profiles import load_profile, compile_outputs, file_deliveries, ProfileError, DEFAULT_PROFILE
+
+FIELDS = processor.show_fields("10-13-25", "Grace", "Jane Doe")
+
+
+def test_default_profile_compiles_to_the_classic_outputs(tmp_path):
+    outputs = compile_outputs(DEFAULT_PROFILE, str(tmp_path), FIELDS, processor._segment_tables())
+
+    names = [out["path"][len(str(tmp_path)) + 1:] for out in outputs]
+    assert names[0] == "stevebrown_10-11-25_H1.mp3"
+    assert names[1:-1] == [f"stevebrown_10-11-25_{seg['name']}_Sirius.wav" for seg in processor.SEGMENTS]
+    assert names[-1] == f"sbe{FIELDS['sbe']}-{FIELDS['monday']}.mp3"
+
+    h1, podcast = outputs[0], outputs[-1]
+    assert h1["deliveries"] == {"srn": ["stevebrown_10-11-25_H1.mp3"],
+                                "ambos": ["stevebrown_10-11-25_NONCOM.mp3", "stevebrown_10-11-25_COM.mp3"]}
+    assert outputs[1]["codec"] is None
+    assert podcast["tags"]["title"] == f"SBE{FIELDS['sbe']} | {FIELDS['sunday']} | Grace | Jane Doe"
+    assert podcast["tags"]["artwork"] == "assets/album_art.png"
+
+
+def test_build_output_plan_converts_minutes_to_frames(tmp_path):
+    outputs = processor.build_output_plan(str(tmp_path), "10-13-25", 48000)
+
+    h1 = outputs[0]
+    assert h1["intervals"] == [(round(processor.H1_SEGMENT["start"] * 60 * 48000),
+                                round(processor.H1_SEGMENT["end"] * 60 * 48000))]
+    assert h1["loudness"] == processor.LOUDNESS_TARGETS.get("h1")
+    assert outputs[1]["loudness"] is None
+
+
+def test_profile_segments_and_loudness_override_the_tables(tmp_path):
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    profile["segments"] = {"H1": [{"start": 0, "end": 1}]}
+    profile["outputs"][0]["loudness"] = {"integrated": -16, "true_peak": -1}
+
+    h1 = compile_outputs(profile, str(tmp_path), FIELDS, processor._segment_tables())[0]
+
+    assert h1["segments"] == [(0, 1)]
+    assert h1["loudness"] == {"integrated": -16, "true_peak": -1}
+
+
+@pytest.mark.parametrize("change, message", [
+    (lambda p: p["outputs"][0].update(encoding="flac"), "Unknown encoding 'flac'"),
+    (lambda p: p["outputs"][0].update(segments="H2"), "Unknown segment table 'H2'"),
+    (lambda p: p["outputs"][2].update(tags="news"), "Unknown tag set 'news'"),
+    (lambda p: p["outputs"][0].update(file="{station}_H1.mp3"), "Unknown field 'station'"),
+    (lambda p: p["outputs"][1].update(file="sirius.wav"), "Several outputs write"),
+    (lambda p: p["outputs"][0].pop("kind"), "Output without a kind"),
+])
+def test_invalid_profiles_raise(tmp_path, change, message):
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    change(profile)
+    with pytest.raises(ProfileError, match=message):
+        compile_outputs(profile, str(tmp_path), FIELDS, processor._segment_tables())
+
+
+def test_load_profile_reads_named_profiles(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps({"weekend": {"outputs": []}}))
+
+    assert load_profile("weekend", str(path)) == {"outputs": []}
+    assert load_profile("default", str(path)) == DEFAULT_PROFILE
+    assert load_profile("default", str(path)) is not DEFAULT_PROFILE
+    with pytest.raises(ProfileError, match="No profile named 'other'"):
+        load_profile("other", str(path))
+    path.write_text("{")
+    with pytest.raises(ProfileError, match="Invalid profiles file"):
+        load_profile("weekend", str(path))
+
+
+def test_file_deliveries_reads_fields_from_the_file_name():
+    assert file_deliveries(DEFAULT_PROFILE, "h1", "/out/stevebrown_01-04-25_H1.mp3") == {
+        "srn": ["stevebrown_01-04-25_H1.mp3"],
+        "ambos": ["stevebrown_01-04-25_NONCOM.mp3", "stevebrown_01-04-25_COM.mp3"],
+    }
+    assert file_deliveries(DEFAULT_PROFILE, "podcast", "/out/sbe969-10132025.mp3") == {"kln": ["sbe969-10132025.mp3"]}
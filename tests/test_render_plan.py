@@ -0,0 +1,66 @@
+import shutil
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+import processor
+from wavfile import WavReader
+
+PCM = ["-c:a", "pcm_s16le"]
+
+
+def test_plan_pieces_cuts_at_the_union_of_boundaries():
+    outputs = [{"intervals": [(0, 100), (200, 300)]}, {"intervals": [(50, 250)]}, {"intervals": [(200, 300)]}]
+
+    bounds, pieces = processor.plan_pieces(outputs)
+
+    assert bounds == [0, 50, 100, 200, 250, 300]
+    assert pieces == [[0, 1, 3, 4], [1, 2, 3], [3, 4]]
+
+
+def test_render_command_shares_pieces_between_outputs():
+    outputs = [{"intervals": [(0, 100), (200, 300)], "codec": PCM, "path": "a.wav", "gain_db": -1.5},
+               {"intervals": [(200, 300)], "codec": ["-c:a", "libmp3lame"], "path": "b.mp3"}]
+
+    cmd = processor.build_render_command("in.wav", outputs)
+
+    assert cmd[cmd.index("-i") + 1] == "in.wav"
+    graph = cmd[cmd.index("-filter_complex") + 1].split(";")
+    assert graph[0] == "[0:a]asegment=samples=0|100|200|300[s0][s1][s2][s3][s4]"
+    # Before the first and after the last boundary, and the gap between outputs, go nowhere
+    assert "[s0]anullsink" in graph and "[s2]anullsink" in graph and "[s4]anullsink" in graph
+    assert "[s1]asetpts=PTS-STARTPTS[o0p0]" in graph
+    assert "[s3]asetpts=PTS-STARTPTS,asplit=2[o0p1][o1p0]" in graph
+    assert "[o0p0][o0p1]concat=n=2:v=0:a=1,volume=-1.50dB[o0]" in graph
+    assert "[o1p0]anull[o1]" in graph
+    assert cmd[-10:] == ["-map", "[o0]", "-c:a", "pcm_s16le", "a.wav", "-map", "[o1]", "-c:a", "libmp3lame", "b.mp3"]
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    path = shutil.which("ffmpeg")
+    if path is None:
+        pytest.skip("ffmpeg is not installed")
+    monkeypatch.setattr(AudioSegment, "converter", path)
+
+
+def test_render_is_sample_exact(ffmpeg, make_wav, tmp_path):
+    ramp = (np.arange(48000) % 20000 - 10000) / 32768
+    source = make_wav(ramp)
+    outputs = [{"intervals": [(1000, 5000), (30001, 40000)], "codec": PCM, "path": str(tmp_path / "a.wav")},
+               {"intervals": [(3000, 31000)], "codec": PCM, "path": str(tmp_path / "b.wav")}]
+
+    processor.render_outputs(source, outputs)
+
+    with WavReader(source) as src:
+        for out in outputs:
+            expected = b"".join(src.view(start, end).tobytes() for start, end in out["intervals"])
+            with WavReader(out["path"]) as rendered:
+                assert rendered.view(0, rendered.frames).tobytes() == expected
+
+
+def test_render_failure_raises_with_ffmpeg_stderr(ffmpeg, tmp_path):
+    outputs = [{"intervals": [(0, 10)], "codec": PCM, "path": str(tmp_path / "a.wav")}]
+    with pytest.raises(RuntimeError, match="ffmpeg render failed"):
+        processor.render_outputs(str(tmp_path / "missing.wav"), outputs)
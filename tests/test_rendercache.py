@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import sine
+from rendercache import RenderCache
+from wavfile import WavReader
+
+MP3 = ["-c:a", "libmp3lame", "-b:a", "320k"]
+
+
+def output(intervals, codec=MP3, path="/out/h1.mp3", loudness=None):
+    return {"intervals": intervals, "codec": codec, "path": path, "loudness": loudness}
+
+
+@pytest.fixture
+def source(make_wav):
+    samples = np.concatenate([sine(440, 1.0), sine(880, 1.0)])
+    with WavReader(make_wav(samples)) as reader:
+        yield reader
+
+
+def test_key_depends_only_on_what_the_output_renders(source, make_wav):
+    cache = RenderCache("unused", 1)
+    key = cache.key(source, output([(0, 48000)]))
+
+    assert key.endswith(".mp3")
+    assert cache.key(source, output([(0, 48000)], path="/elsewhere/other.mp3")) == key
+    assert cache.key(source, output([(0, 48001)])) != key
+    assert cache.key(source, output([(0, 48000)], codec=MP3[:-1] + ["96k"])) != key
+    assert cache.key(source, output([(0, 48000)], loudness={"integrated": -16})) != key
+
+    # Only the output's intervals are hashed; the rest of the source may differ
+    other = np.concatenate([sine(440, 1.0), sine(1000, 1.0)])
+    with WavReader(make_wav(other, name="other.wav")) as reader:
+        assert cache.key(reader, output([(0, 48000)])) == key
+        assert cache.key(reader, output([(48000, 96000)])) != cache.key(source, output([(48000, 96000)]))
+    with WavReader(make_wav(sine(440, 1.0), rate=44100, name="cd.wav")) as reader:
+        assert cache.key(reader, output([(0, 100)])) != cache.key(source, output([(0, 100)]))
+
+
+def test_fetch_returns_what_was_stored(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), 10 ** 6)
+    render = tmp_path / "h1.mp3"
+    render.write_bytes(b"encoded")
+
+    assert not cache.fetch("k.mp3", str(tmp_path / "out.mp3"))
+    cache.store("k.mp3", str(render))
+    assert cache.fetch("k.mp3", str(tmp_path / "out.mp3"))
+    assert (tmp_path / "out.mp3").read_bytes() == b"encoded"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), 250)
+    render = tmp_path / "render"
+    render.write_bytes(b"x" * 100)
+    for age, key in enumerate(["a", "b"]):
+        cache.store(key, str(render))
+        os.utime(tmp_path / "cache" / key, (1000 + age, 1000 + age))
+    # Reading "a" makes "b" the oldest
+    assert cache.fetch("a", str(tmp_path / "out"))
+
+    cache.store("c", str(render))
+
+    assert sorted(os.listdir(tmp_path / "cache")) == ["a", "c"]
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), 0)
+    render = tmp_path / "render"
+    render.write_bytes(b"x")
+
+    cache.store("a", str(render))
+
+    assert not cache.enabled
+    assert not os.path.exists(tmp_path / "cache")
+    assert not cache.fetch("a", str(tmp_path / "out"))
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from conftest import sine
+from silence import pcm_samples, window_levels, silent_runs, snap_to_silence, compress_silences
+from wavfile import WavReader
+
+RATE = 48000
+
+
+def speech_with_gaps(*parts):
+    """Concatenate (seconds, dbfs) parts: a 1 kHz tone at dbfs, or silence for dbfs None."""
+    return np.concatenate([np.zeros(int(seconds * RATE)) if dbfs is None else sine(1000, seconds, dbfs=dbfs)
+                           for seconds, dbfs in parts])
+
+
+@pytest.mark.parametrize("width, float_format", [(1, False), (2, False), (3, False), (4, False), (4, True)])
+def test_pcm_samples_decodes_every_width(make_wav, width, float_format):
+    samples = np.array([0.0, 0.5, -0.5, 0.25, -0.999])
+    with WavReader(make_wav(samples, width=width, float_format=float_format)) as reader:
+        view = reader.view(0, reader.frames)
+        decoded, full_scale = pcm_samples(view, reader.format)
+        view.release()
+
+    tolerance = 1 / 127 if width == 1 else 1e-4
+    assert np.allclose(decoded / full_scale, samples, atol=tolerance)
+
+
+def test_window_levels_are_rms_dbfs(make_wav):
+    # A full-scale sine has an RMS of -3.01 dBFS
+    with WavReader(make_wav(speech_with_gaps((1, -20.0), (1, None)))) as reader:
+        levels = window_levels(reader, 0, reader.frames)
+
+    assert len(levels) == 200
+    assert np.allclose(levels[:100], -23.01, atol=0.05)
+    assert np.allclose(levels[100:], -100)
+
+
+def test_window_levels_span_blocks_and_drop_a_partial_window(make_wav):
+    with WavReader(make_wav(sine(1000, 6.0, dbfs=-10))) as reader:
+        levels = window_levels(reader, 5, reader.frames)
+
+    assert len(levels) == 599
+    assert np.allclose(levels, -13.01, atol=0.05)
+
+
+def test_silent_runs_keep_only_long_enough_runs():
+    levels = np.array([0, -60, -60, 0, -60, -60, -60, 0, -60], dtype=np.float32)
+    assert silent_runs(levels, -50, 3) == [(4, 7)]
+    assert silent_runs(levels, -50, 1) == [(1, 3), (4, 7), (8, 9)]
+
+
+def test_snap_moves_a_cut_to_the_middle_of_the_nearest_gap(make_wav):
+    # Gap from 2.0 s to 2.4 s
+    path = make_wav(speech_with_gaps((2.0, -20.0), (0.4, None), (2.0, -20.0)))
+    with WavReader(path) as reader:
+        snapped = snap_to_silence(reader, int(1.9 * RATE), 500, -50, 200)
+        unchanged = snap_to_silence(reader, int(0.5 * RATE), 500, -50, 200)
+        too_short = snap_to_silence(reader, int(1.9 * RATE), 500, -50, 600)
+
+    assert snapped == int(2.2 * RATE)
+    assert unchanged == int(0.5 * RATE)
+    assert too_short == int(1.9 * RATE)
+
+
+def test_compress_silences_keeps_max_pause_around_the_speech(make_wav):
+    path = make_wav(speech_with_gaps((1.0, -20.0), (3.0, None), (1.0, -20.0), (0.3, None), (1.0, -20.0)))
+    with WavReader(path) as reader:
+        cuts = compress_silences(reader, [(0, reader.frames)], 500, -50)
+
+    # The 3 s pause keeps 250 ms on each side; the 300 ms one is left alone
+    assert cuts == [(0, int(1.25 * RATE)), (int(3.75 * RATE), int(6.3 * RATE))]
+    assert sum(end - start for start, end in cuts) == int(3.8 * RATE)
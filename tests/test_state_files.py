@@ -0,0 +1,37 @@
+import multiprocessing
+
+from transfer import ProtocolCache, DeliveryManifest
+
+
+def record_many(path, worker):
+    manifest = DeliveryManifest(path)
+    protocols = ProtocolCache(path + ".protocols", 3600)
+    for n in range(25):
+        manifest.record("srn", f"w{worker}_{n}.mp3", "0" * 64, n, "srn.example", "/")
+        protocols.set(f"host{worker}_{n}", "sftp")
+
+
+def test_concurrent_processes_keep_every_update(tmp_path):
+    path = str(tmp_path / "delivery_manifest.json")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=record_many, args=(path, worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+
+    manifest = DeliveryManifest(path)
+    protocols = ProtocolCache(path + ".protocols", 3600)
+    assert all(manifest.is_delivered("srn", f"w{worker}_{n}.mp3", "0" * 64, n, "srn.example", "/")
+               for worker in range(4) for n in range(25))
+    assert all(protocols.get(f"host{worker}_{n}") == "sftp" for worker in range(4) for n in range(25))
+
+
+def test_protocol_cache_expires_and_invalidates(tmp_path):
+    protocols = ProtocolCache(str(tmp_path / "protocols.json"), 3600)
+    protocols.set("a", "ftps")
+    protocols.set("b", "sftp")
+    protocols.invalidate("a")
+
+    assert (protocols.get("a"), protocols.get("b")) == (None, "sftp")
+    assert ProtocolCache(protocols.path, 0).get("b") is None
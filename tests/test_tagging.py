@@ -0,0 +1,65 @@
+import os
+import shutil
+
+import pytest
+from mutagen.id3 import ID3
+from pydub import AudioSegment
+
+import processor
+from conftest import sine
+
+ARTWORK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "album_art.png")
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    path = shutil.which("ffmpeg")
+    if path is None:
+        pytest.skip("ffmpeg is not installed")
+    monkeypatch.setattr(AudioSegment, "converter", path)
+
+
+def podcast_tags(artwork=ARTWORK, **changes):
+    fields = dict(processor.show_fields("10-13-25", "Grace", "Jane Doe"), **changes)
+    tags = {field: value.format(**fields) for field, value in processor.DEFAULT_PROFILE["tags"]["podcast"].items()}
+    tags["artwork"] = artwork
+    return tags
+
+
+def render_podcast(tmp_path, make_wav, tags):
+    out = {"intervals": [(0, 48000 * 3)], "codec": processor.DEFAULT_PROFILE["encodings"]["mp3_96"],
+           "path": str(tmp_path / "sbe969-10132025.mp3"), "tags": tags}
+    processor.render_outputs(make_wav(sine(440, 3.0, dbfs=-12)), [out])
+    return out["path"]
+
+
+def audio_after_tag(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data[ID3(path).size:]
+
+
+@pytest.mark.parametrize("artwork", [ARTWORK, None], ids=["artwork", "no-artwork"])
+def test_first_tag_write_stays_inside_the_reserved_tag(ffmpeg, tmp_path, make_wav, artwork):
+    path = render_podcast(tmp_path, make_wav, podcast_tags(artwork))
+    size, audio = os.path.getsize(path), audio_after_tag(path)
+
+    assert processor.apply_tag_set(path, podcast_tags(artwork))
+
+    tag = ID3(path)
+    assert os.path.getsize(path) == size
+    assert audio_after_tag(path) == audio
+    assert f"TXXX:{processor.ID3_PLACEHOLDER}" not in tag
+    assert str(tag["TIT2"]) == podcast_tags()["title"]
+    assert ("APIC:Cover" in tag) == (artwork is not None)
+
+
+def test_retag_edits_the_tag_in_place(ffmpeg, tmp_path, make_wav):
+    path = render_podcast(tmp_path, make_wav, podcast_tags())
+    processor.apply_tag_set(path, podcast_tags())
+    size = os.path.getsize(path)
+
+    processor.apply_tag_set(path, podcast_tags(show_title="A much longer corrected title", guest="Another Guest"))
+
+    assert os.path.getsize(path) == size
+    assert "A much longer corrected title" in str(ID3(path)["TIT2"])
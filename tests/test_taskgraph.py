@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from taskgraph import TaskGraph
+
+
+def test_tasks_start_once_their_deps_are_done():
+    order = []
+    graph = TaskGraph({"render": 2})
+    graph.add("encode", lambda: order.append("encode"))
+    graph.add("tag", lambda: order.append("tag"), deps=["encode"])
+    graph.add("upload", lambda: order.append("upload"), deps=["tag"])
+
+    graph.run()
+
+    assert order == ["encode", "tag", "upload"]
+
+
+def test_each_resource_has_its_own_slots():
+    running = {"render": 0, "upload": 0}
+    peak = {"render": 0, "upload": 0}
+    lock = threading.Lock()
+
+    def task(resource):
+        def run():
+            with lock:
+                running[resource] += 1
+                peak[resource] = max(peak[resource], running[resource])
+            time.sleep(0.05)
+            with lock:
+                running[resource] -= 1
+        return run
+
+    graph = TaskGraph({"render": 1, "upload": 3})
+    for i in range(4):
+        graph.add(f"render{i}", task("render"), resource="render")
+        graph.add(f"upload{i}", task("upload"), resource="upload")
+    started = time.monotonic()
+    graph.run()
+
+    assert peak == {"render": 1, "upload": 3}
+    # The uploads never waited for the renders
+    assert time.monotonic() - started < 0.35
+
+
+def test_a_failure_skips_its_dependents_only():
+    ran = []
+    graph = TaskGraph({"render": 1})
+    graph.add("encode", lambda: 1 / 0)
+    graph.add("upload", lambda: ran.append("upload"), deps=["encode"])
+    graph.add("sirius", lambda: ran.append("sirius"))
+
+    with pytest.raises(ZeroDivisionError):
+        graph.run()
+    assert ran == ["sirius"]
+
+
+def test_several_failures_are_reported_together():
+    graph = TaskGraph({"render": 2})
+    graph.add("a", lambda: 1 / 0)
+    graph.add("b", lambda: [][1])
+
+    with pytest.raises(RuntimeError, match="a: division by zero\nb: list index out of range"):
+        graph.run()
+
+
+@pytest.mark.parametrize("name, deps, resource, message", [
+    ("a", (), None, "Duplicate task"),
+    ("b", ["missing"], None, "unknown tasks: missing"),
+    ("c", (), "gpu", "Unknown resource"),
+])
+def test_add_rejects_bad_tasks(name, deps, resource, message):
+    graph = TaskGraph({"render": 1})
+    graph.add("a", lambda: None)
+    with pytest.raises(ValueError, match=message):
+        graph.add(name, lambda: None, deps=deps, resource=resource)
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import processor
+from profiles import ProfileError, DEFAULT_PROFILE
+
+
+SITES = {site: {"host": f"{site}.example", "user": "u", "password": "p", "remote_dir": f"/{site}"}
+         for site in ("srn", "ambos", "kln")}
+
+
+@pytest.fixture
+def uploads(monkeypatch, tmp_path):
+    """Every ftp_upload call as (host, {local name: [remote names]}), instead of uploading."""
+    calls = []
+
+    def ftp_upload(files, host, user, password, remote_dir, rename=None, **kwargs):
+        calls.append((host, {os.path.basename(f): rename[os.path.basename(f)] for f in files}))
+
+    monkeypatch.setattr(processor, "FTP_LOCATIONS", SITES)
+    monkeypatch.setattr(processor, "ftp_upload", ftp_upload)
+    monkeypatch.setattr(processor, "DELIVERY_MANIFEST", processor.DeliveryManifest(str(tmp_path / "manifest.json")))
+    return calls
+
+
+def show_files(directory, names):
+    paths = []
+    for name in names:
+        path = directory / name
+        path.write_bytes(b"audio")
+        paths.append(str(path))
+    return paths
+
+
+def test_baseline_call_delivers_every_file(uploads, tmp_path):
+    h1, s1, s2, podcast = show_files(tmp_path, ["stevebrown_10-11-25_H1.mp3", "stevebrown_10-11-25_S1_Sirius.wav",
+                                                "stevebrown_10-11-25_S2_Sirius.wav", "sbe969-10132025.mp3"])
+    messages = []
+
+    processor.upload_files_to_ftp(h1, [s1, s2], podcast, progress_callback=messages.append)
+
+    assert dict(uploads) == {
+        "srn.example": {
+            "stevebrown_10-11-25_H1.mp3": ["stevebrown_10-11-25_H1.mp3"],
+            "stevebrown_10-11-25_S1_Sirius.wav": ["stevebrown_10-11-25_S1_Sirius.wav"],
+            "stevebrown_10-11-25_S2_Sirius.wav": ["stevebrown_10-11-25_S2_Sirius.wav"],
+        },
+        "ambos.example": {
+            "stevebrown_10-11-25_H1.mp3": ["stevebrown_10-11-25_NONCOM.mp3", "stevebrown_10-11-25_COM.mp3"],
+        },
+        "kln.example": {"sbe969-10132025.mp3": ["sbe969-10132025.mp3"]},
+    }
+    assert messages[-1] == "🎉 All FTP uploads completed successfully!"
+
+
+def test_files_named_some_other_way_still_go_to_their_sites(uploads, tmp_path):
+    h1, s1, podcast = show_files(tmp_path, ["show_H1.mp3", "segment1.wav", "sbe969-10132025.mp3"])
+
+    processor.upload_files_to_ftp(h1, [s1], podcast)
+
+    assert dict(uploads) == {
+        "srn.example": {"show_H1.mp3": ["show_H1.mp3"], "segment1.wav": ["segment1.wav"]},
+        "ambos.example": {"show_H1.mp3": ["show_H1.mp3"]},
+        "kln.example": {"sbe969-10132025.mp3": ["sbe969-10132025.mp3"]},
+    }
+
+
+def test_date_str_fills_in_names_the_file_name_cannot(uploads, tmp_path):
+    h1, s1, podcast = show_files(tmp_path, ["show_H1.mp3", "segment1.wav", "podcast.mp3"])
+
+    processor.upload_files_to_ftp(h1, [s1], podcast, date_str="10-13-25")
+
+    ambos = dict(uploads)["ambos.example"]
+    assert ambos == {"show_H1.mp3": ["stevebrown_10-11-25_NONCOM.mp3", "stevebrown_10-11-25_COM.mp3"]}
+
+
+def test_kind_missing_from_the_profile_raises(uploads, tmp_path):
+    h1, s1, podcast = show_files(tmp_path, ["stevebrown_10-11-25_H1.mp3", "stevebrown_10-11-25_S1_Sirius.wav",
+                                            "sbe969-10132025.mp3"])
+    profile = dict(DEFAULT_PROFILE, outputs=[out for out in DEFAULT_PROFILE["outputs"] if out["kind"] != "podcast"])
+
+    with pytest.raises(ProfileError, match="podcast"):
+        processor.upload_files_to_ftp(h1, [s1], podcast, profile=profile)
+    assert uploads == []
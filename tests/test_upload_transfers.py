@@ -0,0 +1,286 @@
+import os
+import hashlib
+import zlib
+
+import ftplib
+import pytest
+
+pyftpdlib = pytest.importorskip("pyftpdlib")
+from pyftpdlib.handlers import FTPHandler
+
+import processor
+import transfer
+import uploadengine
+from benchmarks.servers import start_ftp_server, start_sftp_server
+
+
+USER, PASSWORD = "u", "p"
+
+
+class HashFTPHandler(FTPHandler):
+    """FTPHandler with XMD5/XCRC (optionally over "start end") and HASH with OPTS HASH and RANG."""
+
+    proto_cmds = dict(FTPHandler.proto_cmds)
+    for command in ("XMD5", "XCRC", "HASH", "RANG"):
+        proto_cmds[command] = dict(perm=None, auth=True, arg=True, help="")
+
+    hash_algorithm = "SHA-256"
+    hash_range = None
+
+    def _read(self, line):
+        parts = line.split()
+        with open(self.fs.ftp2fs(parts[0]), "rb") as f:
+            data = f.read()
+        return data[int(parts[1]):int(parts[2])] if len(parts) == 3 else data
+
+    def ftp_XMD5(self, line):
+        self.respond("250 " + hashlib.md5(self._read(line)).hexdigest().upper())
+
+    def ftp_XCRC(self, line):
+        self.respond("250 %08X" % zlib.crc32(self._read(line)))
+
+    def ftp_OPTS(self, line):
+        if line.upper().startswith("HASH "):
+            self.hash_algorithm = line.split()[1].upper()
+            if self.hash_algorithm != "SHA-256":
+                return self.respond("501 Unsupported algorithm")
+            return self.respond("200 SHA-256")
+        return FTPHandler.ftp_OPTS(self, line)
+
+    def ftp_RANG(self, line):
+        start, last = line.split()
+        self.hash_range = (int(start), int(last) + 1)
+        self.respond("350 Range set")
+
+    def ftp_HASH(self, line):
+        with open(self.fs.ftp2fs(line), "rb") as f:
+            data = f.read()
+        start, end = self.hash_range or (0, len(data))
+        self.hash_range = None
+        self.respond(f"213 SHA-256 {start}-{end - 1} {hashlib.sha256(data[start:end]).hexdigest()} {line}")
+
+
+class XMD5OnlyHandler(HashFTPHandler):
+    def ftp_HASH(self, line):
+        self.respond("502 Command not implemented")
+
+
+class NoRestHandler(HashFTPHandler):
+    def ftp_REST(self, line):
+        self.respond("502 REST not allowed for uploads")
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch, tmp_path):
+    monkeypatch.setattr(processor, "PROTOCOL_CACHE", transfer.ProtocolCache(str(tmp_path / "protocols.json"), 3600))
+    monkeypatch.setattr(processor, "backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(processor, "VERIFY_BLOCK_BYTES", 256 * 1024)
+    monkeypatch.setattr(processor, "SFTP_SEGMENT_MIN_BYTES", 1024 * 1024)
+    monkeypatch.setattr(transfer, "_ftp_hash_methods", {})
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "local" / "stevebrown_10-11-25_H1.mp3"
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 12345))
+    return str(path)
+
+
+def ftp_server(tmp_path, handler):
+    root = tmp_path / "ftp"
+    (root / "up").mkdir(parents=True)
+    server, port = start_ftp_server(str(root), USER, PASSWORD, handler_base=handler)
+    return server, f"127.0.0.1:{port}", root / "up"
+
+
+@pytest.fixture
+def corrupt_once(monkeypatch):
+    """Flip the byte 1.5 MB in the first time it is sent; returns the (offset, end) of every send."""
+    original = uploadengine.UploadEngine.send_file
+    sends = []
+    target = 1536 * 1024
+    flipped = []
+
+    async def send_file(self, host, file_path, offset, write, end=None, digests=None):
+        sends.append((offset, end))
+        position = [offset]
+
+        def corrupted(chunk):
+            if not flipped and position[0] <= target < position[0] + len(chunk):
+                i = target - position[0]
+                chunk = chunk[:i] + bytes([chunk[i] ^ 0xFF]) + chunk[i + 1:]
+                flipped.append(True)
+            position[0] += len(chunk)
+            write(chunk)
+
+        return await original(self, host, file_path, offset, corrupted, end, digests)
+
+    monkeypatch.setattr(uploadengine.UploadEngine, "send_file", send_file)
+    return sends
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_ftp_checksum_mismatch_resends_from_the_first_bad_block(tmp_path, local_file, corrupt_once):
+    server, host, remote = ftp_server(tmp_path, HashFTPHandler)
+    messages = []
+    try:
+        processor.ftp_upload([local_file], host, USER, PASSWORD, "/up", progress=messages.append, sidecar=True)
+    finally:
+        server.close_all()
+
+    name = os.path.basename(local_file)
+    assert read(remote / name) == read(local_file)
+    assert any("Checksum mismatch (sha256)" in m for m in messages)
+    assert any(f"Re-sending {name} from byte {1536 * 1024}/" in m for m in messages)
+    assert corrupt_once[1] == (1536 * 1024, None)
+    assert (remote / f"{name}.sha256").read_text() == f"{hashlib.sha256(read(local_file)).hexdigest()}  {name}\n"
+
+
+def test_ftp_falls_back_to_xmd5(tmp_path, local_file, corrupt_once):
+    server, host, remote = ftp_server(tmp_path, XMD5OnlyHandler)
+    messages = []
+    try:
+        processor.ftp_upload([local_file], host, USER, PASSWORD, "/up", progress=messages.append)
+    finally:
+        server.close_all()
+
+    assert read(remote / os.path.basename(local_file)) == read(local_file)
+    assert any("Checksum mismatch (md5)" in m for m in messages)
+    assert any("(md5 match)" in m for m in messages)
+
+
+def test_ftp_refused_rest_after_a_mismatch_sends_the_file_whole(tmp_path, local_file, corrupt_once):
+    server, host, remote = ftp_server(tmp_path, NoRestHandler)
+    messages = []
+    try:
+        processor.ftp_upload([local_file], host, USER, PASSWORD, "/up", progress=messages.append)
+    finally:
+        server.close_all()
+
+    assert read(remote / os.path.basename(local_file)) == read(local_file)
+    assert any("sending it whole" in m for m in messages)
+    assert not any("size mismatch" in m for m in messages)
+    assert corrupt_once[1] == (0, None)
+
+
+def test_ftp_without_hash_commands_is_checked_by_size(tmp_path, local_file):
+    server, host, remote = ftp_server(tmp_path, None)
+    messages = []
+    try:
+        processor.ftp_upload([local_file], host, USER, PASSWORD, "/up", progress=messages.append,
+                             rename={os.path.basename(local_file): ["a.mp3", "b.mp3"]})
+    finally:
+        server.close_all()
+
+    assert read(remote / "a.mp3") == read(remote / "b.mp3") == read(local_file)
+    assert any(m.endswith("a.mp3 uploaded successfully.") for m in messages)
+
+
+def test_sftp_mismatch_resends_only_the_bad_range(tmp_path, local_file, corrupt_once):
+    remote = tmp_path / "sftp"
+    remote.mkdir()
+    sock, port = start_sftp_server("/", USER, PASSWORD, allow_exec=True)
+    messages = []
+    try:
+        processor.sftp_upload([local_file], f"127.0.0.1:{port}", USER, PASSWORD, str(remote),
+                              progress=messages.append, sidecar=True)
+    finally:
+        sock.close()
+
+    name = os.path.basename(local_file)
+    assert read(remote / name) == read(local_file)
+    assert any("Checksum mismatch (sha256)" in m for m in messages)
+    assert any(f"Resuming {name}: 1 of its ranges left" in m for m in messages)
+    assert len(corrupt_once) == processor.SFTP_STREAMS + 1
+    assert (remote / f"{name}.sha256").read_text().startswith(hashlib.sha256(read(local_file)).hexdigest())
+
+
+def test_sftp_single_stream_resumes_after_a_drop(tmp_path, local_file, monkeypatch):
+    monkeypatch.setattr(processor, "SFTP_STREAMS", 1)
+    original = uploadengine.UploadEngine.send_file
+    calls = []
+
+    async def flaky(self, host, file_path, offset, write, end=None, digests=None):
+        calls.append(offset)
+        if len(calls) == 1:
+            sent = [0]
+
+            def dropping(chunk):
+                if sent[0] >= 1024 * 1024:
+                    raise ConnectionResetError("simulated drop")
+                sent[0] += len(chunk)
+                write(chunk)
+
+            return await original(self, host, file_path, offset, dropping, end, digests)
+        return await original(self, host, file_path, offset, write, end, digests)
+
+    monkeypatch.setattr(uploadengine.UploadEngine, "send_file", flaky)
+    remote = tmp_path / "sftp"
+    remote.mkdir()
+    sock, port = start_sftp_server("/", USER, PASSWORD, allow_exec=True)
+    messages = []
+    try:
+        processor.sftp_upload([local_file], f"127.0.0.1:{port}", USER, PASSWORD, str(remote),
+                              progress=messages.append)
+    finally:
+        sock.close()
+
+    assert read(remote / os.path.basename(local_file)) == read(local_file)
+    assert calls[1] == 1024 * 1024
+    assert any("(sha256 match)" in m for m in messages)
+
+
+class FakeFTP:
+    """Just what ftp_open_store uses, for a server that refuses REST."""
+
+    def __init__(self, remote_size):
+        self.remote_size = remote_size
+        self.commands = []
+
+    def voidcmd(self, command):
+        self.commands.append(command)
+
+    def transfercmd(self, command, rest=None):
+        if rest is not None:
+            raise ftplib.error_perm("502 REST not allowed")
+        self.commands.append(command)
+        return "data"
+
+    def size(self, name):
+        return self.remote_size
+
+
+@pytest.mark.parametrize("remote_size, command, start", [(1000, "APPE f", 1000), (5000, "STOR f", 0)])
+def test_ftp_open_store_only_appends_to_a_file_ending_at_the_offset(remote_size, command, start):
+    ftp = FakeFTP(remote_size)
+    assert transfer.ftp_open_store(ftp, "f", 1000) == ("data", start)
+    assert ftp.commands[-1] == command
+
+
+def test_byte_ranges_cover_the_file_on_aligned_boundaries():
+    ranges = transfer.byte_ranges(10 * 1024 + 7, 4, 1024)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 10 * 1024 + 7
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert all(start % 1024 == 0 for start, _ in ranges)
+
+
+def test_file_digests_are_memoised_from_a_streamed_hash(tmp_path):
+    path = tmp_path / "f.bin"
+    data = os.urandom(100000)
+    path.write_bytes(data)
+    digests = transfer.Digests()
+    digests.update(data[:500])
+    digests.update(data[500:])
+    transfer.remember_digests(str(path), digests)
+
+    assert transfer.cached_digests(str(path)) == {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "md5": hashlib.md5(data).hexdigest(),
+        "crc32": f"{zlib.crc32(data):08x}",
+    }
+    assert transfer.file_digests(str(path), 10, 20)["md5"] == hashlib.md5(data[10:20]).hexdigest()
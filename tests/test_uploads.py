@@ -0,0 +1,99 @@
+import io
+import os
+import threading
+
+import pytest
+
+from conftest import sine
+from uploads import UploadStore, UploadOffsetError, UploadAbortedError
+from wavfile import WavFormatError
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path))
+
+
+def test_chunks_are_written_in_place_and_may_overlap(store):
+    data = os.urandom(3000)
+    session = store.create("../show.wav", len(data), {"date_str": "10-13-25"})
+
+    assert os.path.basename(session.path) == f"{session.upload_id}-show.wav"
+    assert session.write(0, io.BytesIO(data[:1000])) == 1000
+    # A retried chunk re-sends bytes that already arrived
+    assert session.write(500, io.BytesIO(data[500:2000])) == 2000
+    assert session.write(2000, io.BytesIO(data[2000:] + b"extra")) == 3000
+    assert session.complete
+    with open(session.path, "rb") as f:
+        assert f.read() == data
+
+
+def test_a_chunk_past_the_received_bytes_is_refused(store):
+    session = store.create("show.wav", 100, {})
+    with pytest.raises(UploadOffsetError):
+        session.write(10, io.BytesIO(b"x"))
+
+
+def test_sessions_resume_from_their_sidecar_after_a_restart(store, tmp_path):
+    session = store.create("show.wav", 100, {"guest": "Jane"})
+    session.write(0, io.BytesIO(b"x" * 40))
+
+    restarted = UploadStore(str(tmp_path)).get(session.upload_id)
+
+    assert (restarted.received, restarted.size, restarted.fields) == (40, 100, {"guest": "Jane"})
+    assert UploadStore(str(tmp_path)).get("missing") is None
+
+
+def test_probe_header_waits_for_enough_bytes(store, make_wav):
+    with open(make_wav(sine(440, 1.0)), "rb") as f:
+        data = f.read()
+    session = store.create("show.wav", len(data), {})
+
+    session.write(0, io.BytesIO(data[:1000]))
+    assert session.probe_header() is None
+    session.write(1000, io.BytesIO(data[1000:]))
+    assert session.probe_header()["sample_rate"] == 48000
+
+
+def test_probe_header_rejects_other_files(store):
+    session = store.create("show.wav", 100, {})
+    session.write(0, io.BytesIO(b"ID3" + b"\0" * 97))
+    with pytest.raises(WavFormatError):
+        session.probe_header()
+
+
+def test_wait_for_blocks_until_the_bytes_arrive(store):
+    session = store.create("show.wav", 100, {})
+    done = threading.Event()
+
+    def job():
+        session.wait_for(60)
+        done.set()
+
+    threading.Thread(target=job, daemon=True).start()
+    session.write(0, io.BytesIO(b"x" * 50))
+    assert not done.wait(0.1)
+    session.write(50, io.BytesIO(b"x" * 50))
+    assert done.wait(5)
+
+
+def test_waiting_jobs_fail_on_abort_or_stall(store):
+    session = store.create("show.wav", 100, {})
+    with pytest.raises(UploadAbortedError, match="stalled at 0 of 100"):
+        session.wait_for(10, timeout=0.05)
+
+    errors = []
+
+    def job():
+        try:
+            session.wait_for(10)
+        except UploadAbortedError as e:
+            errors.append(e)
+
+    waiter = threading.Thread(target=job)
+    waiter.start()
+    store.discard(session.upload_id, delete_file=True)
+    waiter.join(5)
+
+    assert "aborted" in str(errors[0])
+    assert not os.path.exists(session.path) and not os.path.exists(session.meta_path)
@@ -0,0 +1,118 @@
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import pcm_bytes, sine
+from wavfile import (WavReader, WavFormatError, parse_header, build_header,
+                     WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_EXTENSIBLE)
+
+
+def chunk(chunk_id, body):
+    return chunk_id + struct.pack("<I", len(body)) + body + (b"\0" if len(body) & 1 else b"")
+
+
+def fmt_chunk(channels=2, rate=48000, width=2, format_tag=WAVE_FORMAT_PCM, extensible=False):
+    block_align = channels * width
+    body = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE if extensible else format_tag, channels, rate,
+                       rate * block_align, block_align, width * 8)
+    if extensible:
+        guid_tail = b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+        body += struct.pack("<HHIH", 22, width * 8, 3, format_tag) + guid_tail
+    return chunk(b"fmt ", body)
+
+
+def riff(*chunks):
+    body = b"WAVE" + b"".join(chunks)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def test_data_offset_skips_chunks_before_fmt_and_odd_sized_padding(tmp_path):
+    data = pcm_bytes(sine(1000, 0.01)[:, None].repeat(2, axis=1), 2)
+    wav = riff(chunk(b"bext", b"x" * 603), fmt_chunk(), chunk(b"iXML", b"<a/>"), chunk(b"data", data))
+    path = tmp_path / "broadcast.wav"
+    path.write_bytes(wav)
+
+    with WavReader(str(path)) as reader:
+        assert reader.data_offset == 12 + (8 + 604) + (8 + 16) + (8 + 4) + 8
+        assert reader.frames == 480
+        assert reader.view(10, 20).tobytes() == data[40:80]
+
+
+def test_extensible_header_reports_the_sub_format():
+    header = parse_header(riff(fmt_chunk(width=3, format_tag=WAVE_FORMAT_PCM, extensible=True), chunk(b"data", b"")))
+    assert header["format_tag"] == WAVE_FORMAT_PCM
+    assert header["sample_width"] == 3
+
+
+@pytest.mark.parametrize("wav", [
+    b"RIFX" + b"\0" * 40,
+    riff(chunk(b"data", b"\0\0")),
+    riff(fmt_chunk(format_tag=0x0055), chunk(b"data", b"")),
+    riff(fmt_chunk()),
+], ids=["not-riff", "data-before-fmt", "mp3-in-wav", "no-data"])
+def test_unsliceable_headers_raise(wav):
+    with pytest.raises(WavFormatError):
+        parse_header(wav)
+
+
+@pytest.mark.parametrize("width, float_format", [(3, False), (4, True)], ids=["24-bit", "float"])
+def test_write_copies_frames_exactly_in_the_source_format(make_wav, tmp_path, width, float_format):
+    samples = np.stack([sine(440, 0.1, dbfs=-6), sine(660, 0.1, dbfs=-12)], axis=1)
+    path = make_wav(samples, width=width, float_format=float_format)
+    out = str(tmp_path / "cut.wav")
+
+    with WavReader(path) as reader:
+        assert reader.format["sample_width"] == width
+        assert reader.block_align == 2 * width
+        written = reader.write(out, [reader.view(0, 100), reader.view(2000, 2500)])
+
+    data = pcm_bytes(samples, width, float_format)
+    expected = data[:100 * 2 * width] + data[2000 * 2 * width:2500 * 2 * width]
+    with open(out, "rb") as f:
+        contents = f.read()
+    assert written == len(expected)
+    assert contents[44:] == expected
+    assert parse_header(contents)["format_tag"] == (WAVE_FORMAT_IEEE_FLOAT if float_format else WAVE_FORMAT_PCM)
+
+
+def test_write_feeds_every_byte_to_the_digests(make_wav, tmp_path):
+    path = make_wav(sine(440, 0.05))
+    seen = []
+
+    class Collect:
+        def update(self, data):
+            seen.append(bytes(data))
+
+    with WavReader(path) as reader:
+        reader.write(str(tmp_path / "out.wav"), [reader.view(0, 1000)], digests=Collect())
+
+    assert b"".join(seen) == (tmp_path / "out.wav").read_bytes()
+
+
+def test_partial_source_trusts_the_bytes_on_disk(make_wav, tmp_path):
+    path = make_wav(sine(440, 1.0))
+    full = open(path, "rb").read()
+    # A recorder still writing: the header claims a full second, the disk
+    # holds 1000.5 frames of it
+    partial = tmp_path / "recording.wav"
+    partial.write_bytes(full[:44 + 2001])
+
+    with WavReader(str(partial)) as reader:
+        assert reader.frames == 1000
+        assert reader.view(900, 5000).nbytes == 100 * 2
+        # Frames past the end of the disk still map into the declared data
+        assert reader.byte_at_frame(24000) == 44 + 48000
+        assert reader.byte_at_frame(10 ** 9) == 44 + 96000
+
+
+def test_unpatched_zero_data_size_reads_to_end_of_file(tmp_path):
+    data = pcm_bytes(sine(440, 0.01)[:, None], 2)
+    path = tmp_path / "unpatched.wav"
+    path.write_bytes(build_header({"format_tag": WAVE_FORMAT_PCM, "channels": 1, "sample_rate": 48000,
+                                   "sample_width": 2, "block_align": 2}, 0) + data)
+
+    with WavReader(str(path)) as reader:
+        assert reader.frames == 480
+        assert reader.duration == 0.01
+        assert reader.byte_at_frame(10 ** 6) == 44 + 2 * 10 ** 6
@@ -0,0 +1,661 @@
+import io
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+import hashlib
+import ftplib
+import ssl
+import shlex
+import zlib
+import posixpath
+from contextlib import contextmanager
+
+import paramiko
+
+
+# Seconds to wait for a remote `cp` before giving up on a server-side copy
+SERVER_COPY_TIMEOUT = 120
+# Seconds a server may take to hash a file (HASH/XMD5/..., sha256sum)
+REMOTE_HASH_TIMEOUT = 300
+
+# Hex digest lengths of the algorithms servers are asked for
+DIGEST_LENGTHS = {"sha256": 64, "md5": 32, "crc32": 8}
+
+_hash_cache = {}
+_hash_lock = threading.Lock()
+
+
+class Digests:
+    """
+    SHA-256, MD5 and CRC32 of a byte stream, updated chunk by chunk as the
+    bytes are written or sent, so nothing has to be read back to hash it.
+    """
+
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self._crc32 = 0
+        self.size = 0
+
+    def update(self, chunk):
+        self._sha256.update(chunk)
+        self._md5.update(chunk)
+        self._crc32 = zlib.crc32(chunk, self._crc32)
+        self.size += len(chunk)
+
+    def update_from_file(self, path, start=0, end=None):
+        """Feed the file's bytes [start, end) (default: to its end)."""
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = (os.fstat(f.fileno()).st_size if end is None else end) - start
+            while remaining > 0:
+                block = f.read(min(1024 * 1024, remaining))
+                if not block:
+                    break
+                self.update(block)
+                remaining -= len(block)
+
+    def hexdigests(self):
+        return {"sha256": self._sha256.hexdigest(), "md5": self._md5.hexdigest(), "crc32": f"{self._crc32:08x}"}
+
+
+def _cache_key(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def cached_digests(path):
+    """The memoised whole-file digests of a file, or None if it hasn't been hashed yet."""
+    key = _cache_key(path)
+    with _hash_lock:
+        return _hash_cache.get(key)
+
+
+def remember_digests(path, digests):
+    """Memoise the Digests of a whole file hashed while it was written or sent (ignored if it is not whole)."""
+    key = _cache_key(path)
+    if digests.size == key[1]:
+        with _hash_lock:
+            _hash_cache[key] = digests.hexdigests()
+
+
+def file_digests(path, start=0, end=None):
+    """
+    {algorithm: hexdigest} of a local file, or of its bytes [start, end).
+
+    Whole-file digests are memoised on (path, size, mtime), and usually
+    already known from remember_digests, so each file is read at most once.
+    """
+    whole = not start and end is None
+    if whole:
+        key = _cache_key(path)
+        with _hash_lock:
+            if key in _hash_cache:
+                return _hash_cache[key]
+
+    digests = Digests()
+    digests.update_from_file(path, start, end)
+
+    if whole:
+        with _hash_lock:
+            _hash_cache[key] = digests.hexdigests()
+    return digests.hexdigests()
+
+
+def file_sha256(path):
+    """SHA-256 of a local file (see file_digests)."""
+    return file_digests(path)["sha256"]
+
+
+def split_host(host, default_port):
+    """Split "host" or "host:port" into (host, port)."""
+    name, sep, port = host.rpartition(":")
+    if sep and port.isdigit():
+        return name, int(port)
+    return host, default_port
+
+
+def remote_names(file_path, rename_map):
+    """
+    Remote names for a local file.
+
+    A rename_map value may be a single name or a list of names; the file is
+    uploaded to the first and the rest are created from that upload.
+    """
+    local_name = os.path.basename(file_path)
+    names = rename_map.get(local_name, local_name)
+    return [names] if isinstance(names, str) else list(names)
+
+
+def ftp_server_copy(ftp, src, dst):
+    """
+    Copy src to dst on an FTP server with SITE CPFR/CPTO (ProFTPD mod_copy).
+    Returns False if the server does not support it or the copy is incomplete.
+    """
+    try:
+        ftp.sendcmd(f"SITE CPFR {src}")
+        ftp.sendcmd(f"SITE CPTO {dst}")
+        return ftp.size(dst) == ftp.size(src)
+    except ftplib.all_errors:
+        return False
+
+
+def _sftp_exec(sftp, command, timeout):
+    """
+    Run a shell command next to an SFTP session, over an exec channel of its transport.
+    Returns its stdout, or None if it failed, timed out or the account has no shell.
+    """
+    channel = sftp.get_channel().get_transport().open_session(timeout=10)
+    try:
+        channel.exec_command(command)
+        stdout = channel.makefile("rb")
+        if not channel.status_event.wait(timeout) or channel.recv_exit_status() != 0:
+            return None
+        return stdout.read()
+    finally:
+        channel.close()
+
+
+def _sftp_path(sftp, name):
+    return posixpath.join(sftp.getcwd() or sftp.normalize("."), name)
+
+
+def sftp_server_copy(sftp, src, dst):
+    """
+    Copy src to dst on an SFTP server by running `cp` over an SSH exec channel.
+    Returns False if the account has no shell or the copy is incomplete.
+    """
+    try:
+        command = f"cp -- {shlex.quote(_sftp_path(sftp, src))} {shlex.quote(_sftp_path(sftp, dst))}"
+        if _sftp_exec(sftp, command, SERVER_COPY_TIMEOUT) is None:
+            return False
+        return sftp.stat(dst).st_size == sftp.stat(src).st_size
+    except (paramiko.SSHException, OSError):
+        return False
+
+
+def _checked_digest(algorithm, digest):
+    """Normalise a hex digest from a server; raises ValueError if it isn't one."""
+    digest = digest.lower()
+    if algorithm == "crc32":
+        digest = digest.zfill(8)
+    int(digest, 16)
+    if len(digest) != DIGEST_LENGTHS[algorithm]:
+        raise ValueError(f"Not a {algorithm} digest: {digest}")
+    return digest
+
+
+# Hash commands tried in order: (algorithm, command, HASH algorithm name).
+# HASH is draft-bryan-ftpext-hash (FileZilla Server, ProFTPD mod_digest, ...),
+# the X* commands the older vendor extensions
+FTP_HASH_METHODS = (
+    ("sha256", "HASH", "SHA-256"),
+    ("md5", "HASH", "MD5"),
+    ("crc32", "HASH", "CRC32"),
+    ("sha256", "XSHA256", None),
+    ("md5", "XMD5", None),
+    ("crc32", "XCRC", None),
+)
+
+# (host, port) -> the FTP_HASH_METHODS entry that worked there, or None if none did
+_ftp_hash_methods = {}
+
+
+def _ftp_hash(ftp, method, remote_name, start, end):
+    algorithm, command, hash_name = method
+    if command == "HASH":
+        ftp.sendcmd(f"OPTS HASH {hash_name}")
+        if start is not None:
+            # RANG takes the last byte, not the end
+            ftp.sendcmd(f"RANG {start} {end - 1}")
+        # 213 SHA-256 0-49 169cd22282da7f147cb491e559e9dd filename
+        return algorithm, _checked_digest(algorithm, ftp.sendcmd(f"HASH {remote_name}").split()[3])
+    args = f" {start} {end}" if start is not None else ""
+    # 250 169cd22282da7f147cb491e559e9dd
+    return algorithm, _checked_digest(algorithm, ftp.sendcmd(f"{command} {remote_name}{args}").split()[-1])
+
+
+def ftp_remote_digest(ftp, remote_name, start=None, end=None):
+    """
+    Hash of a remote file (or of its bytes [start, end)) computed by the FTP
+    server itself, with the first of FTP_HASH_METHODS it supports.
+
+    :return: (algorithm, hexdigest), or None if the server has no hash
+             command (or cannot hash ranges)
+    """
+    host = (getattr(ftp, "host", None), getattr(ftp, "port", None))
+    methods = FTP_HASH_METHODS
+    if host in _ftp_hash_methods:
+        methods = (_ftp_hash_methods[host],) if _ftp_hash_methods[host] else ()
+
+    timeout = ftp.sock.gettimeout()
+    ftp.sock.settimeout(REMOTE_HASH_TIMEOUT)
+    try:
+        for method in methods:
+            try:
+                result = _ftp_hash(ftp, method, remote_name, start, end)
+            except (ftplib.Error, ValueError, IndexError):
+                continue
+            if start is None:
+                _ftp_hash_methods[host] = method
+            return result
+    finally:
+        ftp.sock.settimeout(timeout)
+
+    if start is None:
+        _ftp_hash_methods[host] = None
+    return None
+
+
+def sftp_remote_digest(sftp, remote_name, start=None, end=None):
+    """
+    Hash of a remote file (or of its bytes [start, end)) from `sha256sum`,
+    or `md5sum`, run over an exec channel.
+
+    :return: (algorithm, hexdigest), or None if the server can't run them
+    """
+    path = shlex.quote(_sftp_path(sftp, remote_name))
+    for algorithm, tool in (("sha256", "sha256sum"), ("md5", "md5sum")):
+        if start is None:
+            command = f"{tool} -- {path}"
+        else:
+            command = f"tail -c +{start + 1} -- {path} | head -c {end - start} | {tool}"
+        try:
+            output = _sftp_exec(sftp, command, REMOTE_HASH_TIMEOUT)
+            if output:
+                return algorithm, _checked_digest(algorithm, output.split()[0].decode(errors="replace"))
+        except (paramiko.SSHException, OSError, ValueError, IndexError):
+            pass
+    return None
+
+
+def checksum_sidecar(remote_name, sha256):
+    """Name and content of the `sha256sum -c` file that goes next to a delivered file."""
+    return f"{remote_name}.sha256", f"{sha256}  {remote_name}\n".encode()
+
+
+def ftp_put_bytes(ftp, remote_name, data):
+    ftp.storbinary(f"STOR {remote_name}", io.BytesIO(data))
+
+
+def sftp_put_bytes(sftp, remote_name, data):
+    sftp.putfo(io.BytesIO(data), remote_name)
+
+
+def ftp_resume_offset(ftp, remote_name, local_size):
+    """
+    Bytes of a partial upload already on the FTP server that can be kept.
+    Returns 0 when there is nothing usable and the upload should start over.
+    """
+    try:
+        ftp.voidcmd("TYPE I")
+        remote_size = ftp.size(remote_name)
+    except ftplib.all_errors:
+        return 0
+    return remote_size if remote_size and remote_size < local_size else 0
+
+
+def ftp_open_store(ftp, remote_name, offset=0):
+    """
+    Start a binary upload: STOR, continuing at `offset` with REST. If REST is
+    refused, APPE continues a partial file that ends exactly at `offset`;
+    anything else (e.g. a full-size file to patch from `offset`) starts over.
+    Finish with ftp_finish_store.
+
+    :return: (data connection to write the file to, offset it starts at)
+    """
+    ftp.voidcmd("TYPE I")
+    if not offset:
+        return ftp.transfercmd(f"STOR {remote_name}"), 0
+    try:
+        return ftp.transfercmd(f"STOR {remote_name}", rest=offset), offset
+    except ftplib.error_perm:
+        pass
+    # Server refused REST for uploads
+    try:
+        remote_size = ftp.size(remote_name)
+    except ftplib.error_perm:
+        remote_size = None
+    if remote_size == offset:
+        return ftp.transfercmd(f"APPE {remote_name}"), offset
+    return ftp.transfercmd(f"STOR {remote_name}"), 0
+
+
+def ftp_finish_store(ftp, conn):
+    """Close an upload's data connection (cleanly for FTPS) and wait for the server's reply."""
+    try:
+        if isinstance(conn, ssl.SSLSocket):
+            conn.unwrap()
+    finally:
+        conn.close()
+    return ftp.voidresp()
+
+
+def sftp_resume_offset(sftp, remote_name, local_size):
+    """Bytes of a partial upload already on the SFTP server that can be kept (0 = start over)."""
+    try:
+        remote_size = sftp.stat(remote_name).st_size
+    except IOError:
+        return 0
+    return remote_size if remote_size and remote_size < local_size else 0
+
+
+def sftp_open_store(sftp, remote_name, offset=0):
+    """
+    Open a remote file for upload, positioned at `offset` (an existing partial
+    upload is kept up to there). Writes are pipelined; closing the file
+    waits for the server to acknowledge them.
+    """
+    remote = sftp.open(remote_name, "r+b" if offset else "wb")
+    remote.seek(offset)
+    remote.set_pipelined(True)
+    return remote
+
+
+def sftp_open_range(sftp, remote_name, offset):
+    """Open an existing remote file for a pipelined write of one byte range, starting at `offset`."""
+    remote = sftp.open(remote_name, "r+b")
+    remote.seek(offset)
+    remote.set_pipelined(True)
+    return remote
+
+
+def sftp_open_channel(sftp):
+    """
+    Another SFTP session on the same SSH connection, in the same directory.
+    SSH flow control is per channel, so each one adds its own window on a
+    high-latency link.
+    """
+    channel = paramiko.SFTPClient.from_transport(sftp.get_channel().get_transport())
+    if sftp.getcwd():
+        channel.chdir(sftp.getcwd())
+    return channel
+
+
+def byte_ranges(size, parts, align):
+    """Split [0, size) into up to `parts` contiguous (start, end) ranges, cut at multiples of `align`."""
+    step = max(align, -(-size // parts // align) * align)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+@contextmanager
+def _state_file_lock(path):
+    """
+    Exclusive lock on `path`.lock, held across processes (e.g. batch workers
+    sharing STATE_DIR), around a read-modify-write of a JSON state file.
+    If the lock file can't be opened, runs unlocked: the state files are
+    optimisations and must never fail an upload.
+    """
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        lock_file = open(f"{path}.lock", "a")
+    except OSError as e:
+        logging.warning(f"Could not lock {path}: {e}")
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ProtocolCache:
+    """
+    Remembers which protocol (ftp, ftps, sftp) each host accepted last.
+
+    Entries are stored as JSON on disk so later jobs, and other processes,
+    skip the failed handshakes. Every change re-reads the file under a lock
+    shared with those processes, so concurrent updates merge instead of
+    overwriting each other. An entry expires after `ttl` seconds and is
+    dropped as soon as the cached protocol fails.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # The cache is an optimisation only; never fail an upload over it
+            logging.warning(f"Could not write protocol cache {self.path}: {e}")
+
+    def get(self, host):
+        with self._lock:
+            entry = self._load().get(host)
+        if entry and time.time() - entry.get("ts", 0) < self.ttl:
+            return entry.get("protocol")
+        return None
+
+    def set(self, host, protocol):
+        with self._lock, _state_file_lock(self.path):
+            entries = self._load()
+            entries[host] = {"protocol": protocol, "ts": time.time()}
+            self._save(entries)
+
+    def invalidate(self, host):
+        with self._lock, _state_file_lock(self.path):
+            entries = self._load()
+            if entries.pop(host, None) is not None:
+                self._save(entries)
+
+
+class ConnectionPool:
+    """
+    Keeps authenticated FTP, FTPS and SFTP sessions alive between uploads.
+
+    Sessions are keyed by (host, user, protocol) and checked out exclusively,
+    so concurrent uploads never share one. A session is health-checked before
+    it is handed out again, closed if it broke during use, and evicted once it
+    has been idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, idle_timeout=300, max_idle=4, timeout=10):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}   # (host, user, protocol) -> [(session, last_used), ...]
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    @contextmanager
+    def session(self, protocol, host, user, password):
+        """
+        Check out a logged-in session, connecting if none is idle.
+
+        Yields an ftplib.FTP / ftplib.FTP_TLS object, or a paramiko.SFTPClient,
+        positioned in the login directory. `host` may carry a non-standard
+        port as "host:port".
+        """
+        key = (host, user, protocol)
+        session = self._checkout(key)
+        if session is None:
+            session = self._connect(protocol, host, user, password)
+
+        try:
+            yield session
+        except BaseException:
+            # Whatever went wrong, the session state is unknown now
+            self._close(protocol, session)
+            raise
+        else:
+            self._checkin(key, session)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for (_, _, protocol), sessions in idle.items():
+            for session, _ in sessions:
+                self._close(protocol, session)
+
+    # ---------- internals ----------
+    def _connect(self, protocol, host, user, password):
+        if protocol == "ftp":
+            ftp = ftplib.FTP(timeout=self.timeout)
+            ftp.connect(*split_host(host, 21))
+            ftp.login(user, password)
+            ftp.home_dir = ftp.pwd()
+            return ftp
+
+        if protocol == "ftps":
+            ftps = ftplib.FTP_TLS(timeout=self.timeout)
+            ftps.connect(*split_host(host, 21))
+            ftps.login(user, password)
+            ftps.prot_p()   # Enable secure data channel
+            ftps.home_dir = ftps.pwd()
+            return ftps
+
+        if protocol == "sftp":
+            transport = paramiko.Transport(split_host(host, 22))
+            try:
+                transport.connect(username=user, password=password)
+                transport.set_keepalive(30)
+                return paramiko.SFTPClient.from_transport(transport)
+            except Exception:
+                transport.close()
+                raise
+
+        raise ValueError(f"Unknown protocol: {protocol}")
+
+    def _healthy(self, protocol, session):
+        try:
+            if protocol == "sftp":
+                if not session.get_channel().get_transport().is_active():
+                    return False
+                session.chdir(None)   # back to the login directory
+                session.normalize(".")
+            else:
+                session.cwd(session.home_dir)   # doubles as a NOOP
+            return True
+        except Exception:
+            return False
+
+    def _close(self, protocol, session):
+        try:
+            if protocol == "sftp":
+                transport = session.get_channel().get_transport()
+                session.close()
+                transport.close()
+            else:
+                try:
+                    session.quit()
+                except Exception:
+                    session.close()
+        except Exception:
+            pass
+
+    def _checkout(self, key):
+        protocol = key[2]
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                if not sessions:
+                    return None
+                session, last_used = sessions.pop()
+
+            if time.time() - last_used < self.idle_timeout and self._healthy(protocol, session):
+                return session
+            self._close(protocol, session)
+
+    def _checkin(self, key, session):
+        with self._lock:
+            sessions = self._idle.setdefault(key, [])
+            if len(sessions) < self.max_idle:
+                sessions.append((session, time.time()))
+                session = None
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="connection-pool-reaper", daemon=True)
+                self._reaper.start()
+        if session is not None:
+            self._close(key[2], session)
+
+    def _reap(self):
+        while True:
+            time.sleep(min(60, self.idle_timeout))
+            expired = []
+            with self._lock:
+                now = time.time()
+                for key, sessions in self._idle.items():
+                    keep = [(s, t) for s, t in sessions if now - t < self.idle_timeout]
+                    expired += [(key[2], s) for s, t in sessions if now - t >= self.idle_timeout]
+                    sessions[:] = keep
+            for protocol, session in expired:
+                self._close(protocol, session)
+
+
+class DeliveryManifest:
+    """
+    Record of files verified on each site, keyed by (site, remote_name).
+
+    Each entry keeps the local content hash, size, destination and time of
+    delivery, so a rerun can skip anything the remote already has. Stored as
+    JSON, updated under the same cross-process lock as ProtocolCache;
+    entries older than `max_age` seconds are pruned on write.
+    """
+
+    def __init__(self, path, max_age=90 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        cutoff = time.time() - self.max_age
+        entries = {k: v for k, v in entries.items() if v.get("ts", 0) >= cutoff}
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not write delivery manifest {self.path}: {e}")
+
+    @staticmethod
+    def _key(site, remote_name):
+        return f"{site}:{remote_name}"
+
+    def is_delivered(self, site, remote_name, sha256, size, host, remote_dir):
+        """:param sha256: the local hash, or a callable returning it, only called if everything else matches"""
+        with self._lock:
+            entry = self._load().get(self._key(site, remote_name))
+        if not entry or entry.get("size") != size or entry.get("host") != host \
+                or entry.get("remote_dir") != remote_dir:
+            return False
+        return entry.get("sha256") == (sha256() if callable(sha256) else sha256)
+
+    def record(self, site, remote_name, sha256, size, host, remote_dir):
+        with self._lock, _state_file_lock(self.path):
+            entries = self._load()
+            entries[self._key(site, remote_name)] = {
+                "sha256": sha256,
+                "size": size,
+                "host": host,
+                "remote_dir": remote_dir,
+                "ts": time.time(),
+            }
+            self._save(entries)
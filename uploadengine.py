@@ -0,0 +1,225 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Bytes sent per executor call; also the unit the bandwidth caps are charged in
+CHUNK_SIZE = 256 * 1024
+
+# Retry delays: exponential from RETRY_BASE_DELAY seconds, capped, with full jitter
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """
+    Seconds to wait after failed attempt number `attempt` (1-based).
+
+    Uniform in [0, min(cap, base * 2^(attempt-1))], so uploads that failed
+    together (a dropped uplink) do not all come back at the same moment.
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """
+    Bandwidth cap in bytes per second, allowing bursts of up to `burst` bytes.
+
+    Callers take what they are about to send; a caller that overdraws the
+    bucket sleeps until it is paid back, so concurrent senders share the
+    rate between them. Only used from the engine's event loop.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, CHUNK_SIZE)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    async def take(self, nbytes):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= nbytes
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class PrioritySlots:
+    """
+    Connection slots for one host, handed to the highest priority waiter first.
+
+    Transfers ask with their file size as priority, so when a host is busy
+    the largest file waiting goes next, whichever delivery it belongs to.
+    Only used from the engine's event loop.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.busy = 0
+        self._waiters = []   # heap of (-priority, seq, future)
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def take(self, priority=0):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority):
+        if self.busy < self.limit and not self._waiters:
+            self.busy += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Handed a slot just as it was cancelled: give it back
+                self._release()
+            raise
+
+    def resize(self, limit):
+        self.limit = limit
+        self._wake()
+
+    def _release(self):
+        self.busy -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.busy < self.limit and self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.busy += 1
+                future.set_result(None)
+
+
+class UploadEngine:
+    """
+    Runs every FTP, FTPS and SFTP transfer of the process on one asyncio event loop.
+
+    ftplib and paramiko are blocking, so their calls (login, commands, one
+    chunk of data) run on a small bounded executor; everything that waits
+    (connection slots, bandwidth caps, retry backoff) is a coroutine, so a
+    slow link or a transfer sitting out its backoff holds no thread.
+
+    Bandwidth is capped globally (`max_bps`, e.g. to keep the station's
+    uplink free for the live stream) and per host (`host_max_bps`, or
+    set_host_rate); every chunk is charged to both. 0 means unlimited.
+    Synchronous callers hand coroutines to run(), which blocks until done.
+    """
+
+    def __init__(self, workers=8, max_bps=0, host_max_bps=0):
+        self.workers = workers
+        self.host_max_bps = host_max_bps
+        self._global = TokenBucket(max_bps)
+        self._host_buckets = {}
+        self._host_slots = {}
+        self._loop = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def run(self, coro):
+        """Run a coroutine on the engine's loop from any other thread and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._start()).result()
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload-io")
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="upload-engine", daemon=True).start()
+            return self._loop
+
+    async def call(self, fn, *args):
+        """Run a blocking call (ftplib, paramiko, file I/O) on the bounded executor."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ---------- scheduling ----------
+    def slots(self, host, max_connections):
+        """
+        Connection slots shared by every transfer to `host`; the limit follows
+        the latest caller. Only call from the engine's loop (resizing wakes waiters).
+        """
+        slots = self._host_slots.get(host)
+        if slots is None:
+            slots = self._host_slots[host] = PrioritySlots(max_connections)
+        elif slots.limit != max_connections:
+            slots.resize(max_connections)
+        return slots
+
+    def set_host_rate(self, host, max_bps):
+        """Cap one host's bandwidth (bytes/s); None falls back to host_max_bps. Only call from the engine's loop."""
+        rate = self.host_max_bps if max_bps is None else max_bps
+        bucket = self._host_buckets.get(host)
+        if bucket is None:
+            self._host_buckets[host] = TokenBucket(rate)
+        elif bucket.rate != rate:
+            bucket.rate = rate
+            bucket.burst = max(rate, CHUNK_SIZE)
+
+    async def throttle(self, host, nbytes):
+        if host not in self._host_buckets:
+            self.set_host_rate(host, None)
+        await self._host_buckets[host].take(nbytes)
+        await self._global.take(nbytes)
+
+    @staticmethod
+    def largest_first(files):
+        return sorted(files, key=os.path.getsize, reverse=True)
+
+    # ---------- transfers ----------
+    @asynccontextmanager
+    async def session(self, pool, protocol, host, user, password):
+        """Async form of ConnectionPool.session; login and release run on the executor."""
+        manager = pool.session(protocol, host, user, password)
+        session = await self.call(manager.__enter__)
+        try:
+            yield session
+        except BaseException as e:
+            await self.call(manager.__exit__, type(e), e, e.__traceback__)
+            raise
+        else:
+            await self.call(manager.__exit__, None, None, None)
+
+    async def send_file(self, host, file_path, offset, write, end=None, digests=None):
+        """
+        Stream file_path from `offset` (up to `end`, default the end of the
+        file) through write(chunk), within the bandwidth caps. Every chunk
+        is also fed to `digests` (a transfer.Digests), if given.
+
+        :return: bytes sent
+        """
+        size = os.path.getsize(file_path) if end is None else end
+        sent = 0
+        with open(file_path, "rb") as f:
+            f.seek(offset)
+            while offset + sent < size:
+                nbytes = min(CHUNK_SIZE, size - offset - sent)
+                await self.throttle(host, nbytes)
+                written = await self.call(_send_chunk, f, nbytes, write, digests)
+                if not written:
+                    break
+                sent += written
+        return sent
+
+
+def _send_chunk(f, nbytes, write, digests):
+    chunk = f.read(nbytes)
+    if chunk:
+        if digests is not None:
+            digests.update(chunk)
+        write(chunk)
+    return len(chunk)
@@ -0,0 +1,199 @@
+import os
+import json
+import uuid
+import logging
+import threading
+
+from werkzeug.utils import secure_filename
+
+from wavfile import parse_header, HEADER_PROBE_BYTES
+
+
+# Size of the reads from the request stream while writing a chunk
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Seconds a job waiting on an upload may go without a single new byte
+UPLOAD_STALL_TIMEOUT = int(os.getenv("UPLOAD_STALL_TIMEOUT", "900"))
+
+
+class UploadOffsetError(Exception):
+    """Raised when a chunk starts past the bytes received so far."""
+
+
+class UploadAbortedError(Exception):
+    """Raised to a job waiting on an upload that was rejected or stalled."""
+
+
+class UploadSession:
+    """
+    A resumable upload written straight to its final path.
+
+    Chunks are copied from the request stream into the file at their offset,
+    so the body is never spooled to a temp file first. Progress is saved to a
+    small sidecar JSON so an interrupted upload (or a restarted server) can be
+    resumed from `received`.
+
+    A job may start on the file before it is complete: wait_for() blocks until
+    the bytes it needs have been written.
+    """
+
+    def __init__(self, upload_id, path, size, fields, received=0, header=None, job_id=None):
+        self.upload_id = upload_id
+        self.path = path
+        self.size = size
+        self.fields = fields
+        self.received = received
+        self.header = header
+        self.job_id = job_id
+        self.aborted = False
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+
+    @property
+    def meta_path(self):
+        return f"{self.path}.upload.json"
+
+    @property
+    def complete(self):
+        return self.received >= self.size
+
+    def to_dict(self):
+        return {
+            "upload_id": self.upload_id,
+            "path": self.path,
+            "size": self.size,
+            "fields": self.fields,
+            "received": self.received,
+            "header": self.header,
+            "job_id": self.job_id,
+        }
+
+    def save(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.meta_path)
+
+    @classmethod
+    def load(cls, meta_path):
+        with open(meta_path) as f:
+            return cls(**json.load(f))
+
+    def write(self, start, stream):
+        """
+        Copy `stream` into the file at byte `start` and return the new received count.
+        Re-sending bytes that already arrived is allowed; leaving a gap is not.
+        """
+        with self._lock:
+            if start > self.received:
+                raise UploadOffsetError(f"Chunk starts at {start}, only {self.received} bytes received")
+
+            with open(self.path, "r+b") as f:
+                f.seek(start)
+                pos = start
+                while pos < self.size:
+                    block = stream.read(min(STREAM_BLOCK_SIZE, self.size - pos))
+                    if not block:
+                        break
+                    f.write(block)
+                    pos += len(block)
+
+            self.received = max(self.received, pos)
+            self.save()
+            self._arrived.notify_all()
+            return self.received
+
+    def wait_for(self, nbytes, timeout=UPLOAD_STALL_TIMEOUT):
+        """
+        Block until the first `nbytes` of the file (capped at its size) are written.
+
+        :raises UploadAbortedError: if the upload is aborted, or no bytes arrive for `timeout` seconds
+        """
+        nbytes = min(nbytes, self.size)
+        with self._arrived:
+            while self.received < nbytes:
+                if self.aborted:
+                    raise UploadAbortedError(f"Upload {self.upload_id} was aborted")
+                before = self.received
+                if not self._arrived.wait(timeout) and self.received == before:
+                    raise UploadAbortedError(
+                        f"Upload {self.upload_id} stalled at {self.received} of {self.size} bytes")
+
+    def abort(self):
+        """Wake any job waiting on this upload so it fails instead of hanging."""
+        with self._arrived:
+            self.aborted = True
+            self._arrived.notify_all()
+
+    def probe_header(self):
+        """
+        Validate the WAV header as soon as enough bytes are in.
+
+        :return: parsed format dict, or None if more bytes are needed
+        :raises WavFormatError: if the file is not a usable WAV
+        """
+        if self.header is not None:
+            return self.header
+        if self.received < min(self.size, HEADER_PROBE_BYTES):
+            return None
+
+        with open(self.path, "rb") as f:
+            self.header = parse_header(f.read(min(self.received, HEADER_PROBE_BYTES)))
+        self.save()
+        return self.header
+
+
+class UploadStore:
+    """Upload sessions by id, backed by the sidecar files in `folder`."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename, size, fields):
+        upload_id = str(uuid.uuid4())
+        name = secure_filename(filename) or "upload.wav"
+        path = os.path.join(self.folder, f"{upload_id}-{name}")
+
+        # Create the file up front; chunks are written into it in place
+        with open(path, "wb"):
+            pass
+
+        session = UploadSession(upload_id, path, size, fields)
+        session.save()
+        with self._lock:
+            self._sessions[upload_id] = session
+        return session
+
+    def get(self, upload_id):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is not None:
+                return session
+
+            # Not in memory (e.g. after a restart): look for its sidecar
+            for name in os.listdir(self.folder):
+                if name.startswith(f"{upload_id}-") and name.endswith(".upload.json"):
+                    try:
+                        session = UploadSession.load(os.path.join(self.folder, name))
+                    except (OSError, ValueError, TypeError) as e:
+                        logging.warning(f"Unreadable upload state {name}: {e}")
+                        return None
+                    self._sessions[upload_id] = session
+                    return session
+        return None
+
+    def discard(self, upload_id, delete_file=False):
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        if session is None:
+            return
+        if delete_file:
+            session.abort()
+        paths = [session.meta_path] + ([session.path] if delete_file else [])
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
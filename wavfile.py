@@ -0,0 +1,170 @@
+import os
+import mmap
+import struct
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Bytes that must be on disk before the header is parsed; fmt/data chunks
+# (after any bext/iXML chunks) are expected to start within this window.
+HEADER_PROBE_BYTES = 64 * 1024
+
+
+class WavFormatError(Exception):
+    """Raised when a file is not a WAV we can slice."""
+
+
+def parse_header(buf):
+    """
+    Parse the RIFF/WAVE header of a WAV file.
+
+    :param buf: bytes-like object holding at least the start of the file
+    :return: dict with format_tag, channels, sample_rate, sample_width,
+             block_align, data_offset and data_size (as declared in the header)
+    """
+    if len(buf) < 12 or bytes(buf[0:4]) != b"RIFF" or bytes(buf[8:12]) != b"WAVE":
+        raise WavFormatError("Not a RIFF/WAVE file")
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id = bytes(buf[pos:pos + 4])
+        chunk_size = struct.unpack_from("<I", buf, pos + 4)[0]
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or body + 16 > len(buf):
+                raise WavFormatError("Truncated fmt chunk")
+            format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", buf, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                if chunk_size < 40 or body + 40 > len(buf):
+                    raise WavFormatError("Truncated WAVE_FORMAT_EXTENSIBLE fmt chunk")
+                # First two bytes of the sub-format GUID carry the real format tag
+                format_tag = struct.unpack_from("<H", buf, body + 24)[0]
+            fmt = {
+                "format_tag": format_tag,
+                "channels": channels,
+                "sample_rate": sample_rate,
+                "sample_width": (bits + 7) // 8,
+                "block_align": block_align,
+            }
+
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavFormatError("data chunk before fmt chunk")
+            if fmt["format_tag"] not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                raise WavFormatError(f"Unsupported WAV format tag 0x{fmt['format_tag']:04x}")
+            if not fmt["block_align"] or not fmt["sample_rate"]:
+                raise WavFormatError("Invalid fmt chunk")
+            return dict(fmt, data_offset=body, data_size=chunk_size)
+
+        # Chunks are word aligned
+        pos = body + chunk_size + (chunk_size & 1)
+
+    raise WavFormatError("No data chunk found")
+
+
+def build_header(fmt, data_size):
+    """Return a canonical 44-byte PCM/float WAV header for data_size bytes of audio."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, fmt["format_tag"], fmt["channels"], fmt["sample_rate"],
+        fmt["sample_rate"] * fmt["block_align"], fmt["block_align"], fmt["sample_width"] * 8,
+        b"data", data_size,
+    )
+
+
+class WavReader:
+    """
+    Memory-mapped WAV reader.
+
+    The RIFF header is parsed once on open; slices are returned as zero-copy
+    memoryviews over the mapped PCM data, so only the pages actually touched
+    are read (and they live in the page cache, not the process heap).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            file_size = os.fstat(self._file.fileno()).st_size
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        if hasattr(self._map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+        try:
+            self.format = parse_header(self._map)
+        except Exception:
+            self.close()
+            raise
+
+        # Recorders that never patch the header (or files over 4 GB) declare a
+        # bogus data size; trust the bytes that are actually on disk.
+        available = file_size - self.format["data_offset"]
+        data_size = min(self.format["data_size"], available) if self.format["data_size"] else available
+        self.data_offset = self.format["data_offset"]
+        self.block_align = self.format["block_align"]
+        self.sample_rate = self.format["sample_rate"]
+        self.frames = data_size // self.block_align
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
+
+    def byte_at_frame(self, frame):
+        """File offset of `frame`, whether or not those bytes are on disk yet."""
+        end = self.data_offset + int(frame) * self.block_align
+        if self.format["data_size"]:
+            end = min(end, self.data_offset + self.format["data_size"])
+        return end
+
+    def view(self, start_frame, end_frame):
+        """Zero-copy view of the PCM frames in [start_frame, end_frame)."""
+        start_frame = max(0, min(start_frame, self.frames))
+        end_frame = max(start_frame, min(end_frame, self.frames))
+        start = self.data_offset + start_frame * self.block_align
+        end = self.data_offset + end_frame * self.block_align
+        return memoryview(self._map)[start:end]
+
+    def write(self, path, views, digests=None):
+        """
+        Write the given views to a new WAV file with the source format.
+
+        Only the 44-byte header is built in memory; the PCM goes straight from
+        the mapping to the output file. The views are released afterwards.
+
+        :param digests: optional object whose update() is given every byte
+                        written, to hash the file without reading it back
+        """
+        data_size = sum(v.nbytes for v in views)
+        try:
+            with open(path, "wb") as f:
+                header = build_header(self.format, data_size)
+                f.write(header)
+                if digests is not None:
+                    digests.update(header)
+                for v in views:
+                    f.write(v)
+                    if digests is not None:
+                        digests.update(v)
+        finally:
+            for v in views:
+                v.release()
+        return data_size